@@ -1,70 +1,32 @@
 from datetime import datetime, timedelta
 
 import numpy
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
+from core.views import IsSuperUser, get_api_user
+from utpad_server import settings
+from utpad_server.database_routers import replica_reads
+from .availability import get_availability_day_counts
+from .cache import get_cached_capacity_data_for_org_groups, get_org_capacity_versions, get_capacity_validators, \
+    get_capacity_cache_statistics, aget_cached_capacity_data_for_org_groups
+from .engine import WORK_DAYS_MASK, get_capacity_data_for_org_groups
 from .models import OrgGroup, Engineer, SiteHoliday, Leave, EngineerOrgGroupParticipation
 from .serializers import SiteHolidaySerializer, LeaveSerializer
 
-# TODO: Consider making work days configurable per org group or site
-WORK_DAYS_MASK = [1, 1, 1, 1, 1, 0, 0]
-
 
 def get_capacity_data_for_org_group(org_group, from_date, to_date):
-    work_days = numpy.busday_count(from_date,
-                                   to_date + timedelta(days=1),
-                                   weekmask=WORK_DAYS_MASK
-                                   )
-
-    org_group_participation_qs = EngineerOrgGroupParticipation.objects.filter(org_group=org_group)
-
-    total_capacity = 0
-    engineer_data = {}
-    for org_group_participation in org_group_participation_qs:
-        engineer = org_group_participation.engineer
-        engineer_leave_plans = Leave.objects.filter(engineer=engineer,
-                                                    start_date__gte=from_date, start_date__lte=to_date,
-                                                    end_date__gte=from_date, end_date__lte=to_date)
-        engineer_site_holidays = SiteHoliday.objects.filter(site=engineer.site,
-                                                            date__gte=from_date,
-                                                            date__lte=to_date)
-        engineer_site_holidays_dates = [item.date for item in engineer_site_holidays]
-        leave_count = 0
-        for engineer_leave in engineer_leave_plans:
-            leave_count = leave_count + numpy.busday_count(engineer_leave.start_date,
-                                                           engineer_leave.end_date + timedelta(days=1),
-                                                           weekmask=WORK_DAYS_MASK,
-                                                           holidays=engineer_site_holidays_dates)
-        site_holiday_count = len(engineer_site_holidays_dates)
-        available_days = work_days - leave_count - site_holiday_count
-        capacity = available_days * org_group_participation.capacity
-        total_capacity = total_capacity + capacity
-        engineer_data[engineer.employee_id] = {'employee_id': engineer.employee_id,
-                                               'name': engineer.auth_user.username,
-                                               'leave_plans': LeaveSerializer(engineer_leave_plans, many=True).data,
-                                               'site_holidays': SiteHolidaySerializer(engineer_site_holidays,
-                                                                                      many=True).data,
-                                               'engineer_site_holidays_dates': engineer_site_holidays_dates,
-                                               'leave_count': leave_count,
-                                               'site_holiday_count': site_holiday_count,
-                                               'available_days': available_days,
-                                               'participation_capacity': org_group_participation.capacity,
-                                               'capacity': capacity,
-                                               }
-
-    capacity_data = {
-        'work_days': work_days,
-        'total_capacity': total_capacity,
-        'engineer_data': engineer_data,
-    }
-
-    return capacity_data
+    return get_capacity_data_for_org_groups([org_group.id], from_date, to_date)[org_group.id]
 
 
 @swagger_auto_schema(
@@ -80,6 +42,7 @@ def get_capacity_data_for_org_group(org_group, from_date, to_date):
     ],
     responses={
         200: 'Capacity data returned',
+        304: 'Capacity data not modified since the ETag or time passed',
         400: 'One of the parameters (org_group/from/to) missing',
         404: 'Could not find org_group passed',
         405: 'Method not allowed'
@@ -87,6 +50,7 @@ def get_capacity_data_for_org_group(org_group, from_date, to_date):
 )
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
+@replica_reads()
 def get_org_capacity_for_time_range(request):
     if not request.method == 'GET':
         return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -103,14 +67,100 @@ def get_org_capacity_for_time_range(request):
     from_date = datetime.strptime(request.query_params.get('from'), '%Y-%m-%d').date()
     to_date = datetime.strptime(request.query_params.get('to'), '%Y-%m-%d').date()
 
-    capacity_data_for_org_groups = {org_group.name: get_capacity_data_for_org_group(org_group, from_date, to_date)}
+    transitive_sub_group_ids = org_group.get_transitive_sub_groups()
+    org_groups = list(OrgGroup.objects.filter(id__in=transitive_sub_group_ids).values_list('id', 'name', 'updated_at'))
+    org_group_names = {org_group_id: name for org_group_id, name, updated_at in org_groups}
+
+    versions = get_org_capacity_versions(transitive_sub_group_ids)
+    etag, last_modified = get_capacity_validators(org_groups, versions, org_group.id, from_date, to_date)
+    not_modified_response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    capacity_data_by_org_group_id = get_cached_capacity_data_for_org_groups(transitive_sub_group_ids, from_date,
+                                                                            to_date, versions=versions)
+
+    capacity_data_for_org_groups = {org_group.name: capacity_data_by_org_group_id[org_group.id]}
+    for transitive_sub_group_id in transitive_sub_group_ids:
+        capacity_data_for_org_groups[org_group_names[transitive_sub_group_id]] = capacity_data_by_org_group_id[
+            transitive_sub_group_id]
+
+    response = Response(capacity_data_for_org_groups)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def aget_org_capacity_for_time_range(request):
+    """
+    Async variant of get_org_capacity_for_time_range for the ASGI server: the org group and its sub-groups are read
+    with the async ORM and their capacity is computed in concurrent slices in worker threads, so that the worker
+    keeps serving the other requests meanwhile.
+    """
+    if not request.method == 'GET':
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    try:
+        user = await sync_to_async(get_api_user)(request)
+    except APIException as e:
+        return JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+    if not user or not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    if not (('org_group' in request.GET) and ('from' in request.GET) and ('to' in request.GET)):
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST,
+                            content='One of the parameters (org_group/from/to) missing')
+
+    with replica_reads():
+        try:
+            org_group = await OrgGroup.objects.aget(pk=request.GET.get('org_group'))
+        except OrgGroup.DoesNotExist:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND, content='Could not find org_group passed')
+
+        from_date = datetime.strptime(request.GET.get('from'), '%Y-%m-%d').date()
+        to_date = datetime.strptime(request.GET.get('to'), '%Y-%m-%d').date()
+
+        transitive_sub_group_ids = await sync_to_async(org_group.get_transitive_sub_groups)()
+        org_groups = [org_group_values async for org_group_values in OrgGroup.objects.filter(
+            id__in=transitive_sub_group_ids).values_list('id', 'name', 'updated_at')]
+        org_group_names = {org_group_id: name for org_group_id, name, updated_at in org_groups}
+
+        versions = await sync_to_async(get_org_capacity_versions)(transitive_sub_group_ids)
+        etag, last_modified = get_capacity_validators(org_groups, versions, org_group.id, from_date, to_date)
+        not_modified_response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified_response is not None:
+            return not_modified_response
 
-    for transitive_sub_group_id in org_group.get_transitive_sub_groups():
-        transitive_sub_group = OrgGroup.objects.get(id=transitive_sub_group_id)
-        capacity_data_for_org_groups[transitive_sub_group.name] = get_capacity_data_for_org_group(transitive_sub_group,
-                                                                                                  from_date, to_date)
+        capacity_data_by_org_group_id = await aget_cached_capacity_data_for_org_groups(
+            transitive_sub_group_ids, from_date, to_date, versions=versions)
 
-    return Response(capacity_data_for_org_groups)
+    capacity_data_for_org_groups = {org_group.name: capacity_data_by_org_group_id[org_group.id]}
+    for transitive_sub_group_id in transitive_sub_group_ids:
+        capacity_data_for_org_groups[org_group_names[transitive_sub_group_id]] = capacity_data_by_org_group_id[
+            transitive_sub_group_id]
+
+    # Encoded like the REST framework responses (dates, decimals, numpy numbers...)
+    response = JsonResponse(capacity_data_for_org_groups, encoder=JSONEncoder)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Get the hit, miss and invalidation counts of the capacity cache of this server process",
+    responses={
+        200: 'Capacity cache statistics returned',
+        403: 'Only super users can view the statistics',
+    }
+)
+@api_view(['GET'])
+@permission_classes((IsSuperUser,))
+def get_capacity_cache_stats(request):
+    return Response(get_capacity_cache_statistics())
 
 
 @swagger_auto_schema(
@@ -133,6 +183,7 @@ def get_org_capacity_for_time_range(request):
 )
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
+@replica_reads()
 def get_engineer_capacity_for_time_range(request):
     if not request.method == 'GET':
         return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -163,13 +214,20 @@ def get_engineer_capacity_for_time_range(request):
                                                         date__gte=from_date,
                                                         date__lte=to_date)
     engineer_site_holidays_dates = [item.date for item in engineer_site_holidays]
-    leave_count = 0
-    for engineer_leave in engineer_leave_plans:
-        leave_count = leave_count + numpy.busday_count(engineer_leave.start_date,
-                                                       engineer_leave.end_date + timedelta(days=1),
-                                                       weekmask=WORK_DAYS_MASK,
-                                                       holidays=engineer_site_holidays_dates)
-    site_holiday_count = len(engineer_site_holidays_dates)
+    if settings.CAPACITY_AVAILABILITY_SOURCE == 'calendar':
+        leave_counts, site_holiday_counts = get_availability_day_counts(
+            [engineer.id], from_date, to_date, WORK_DAYS_MASK,
+            engineer_leave_plans.values_list('engineer_id', 'start_date', 'end_date'))
+        leave_count = leave_counts.get(engineer.id, 0)
+        site_holiday_count = site_holiday_counts.get(engineer.id, 0)
+    else:
+        leave_count = 0
+        for engineer_leave in engineer_leave_plans:
+            leave_count = leave_count + numpy.busday_count(engineer_leave.start_date,
+                                                           engineer_leave.end_date + timedelta(days=1),
+                                                           weekmask=WORK_DAYS_MASK,
+                                                           holidays=engineer_site_holidays_dates)
+        site_holiday_count = len(engineer_site_holidays_dates)
     available_days = work_days - leave_count - site_holiday_count
 
     org_capacity_data = {}
@@ -1,7 +1,17 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CapacityConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'capacity'
     order = 2
+
+    def ready(self):
+        from .availability import connect_availability_receivers
+        from .cache import connect_capacity_cache_receivers
+
+        # Connected first so that the calendars are refreshed on commit before the capacity versions are bumped
+        if settings.CAPACITY_AVAILABILITY_SOURCE == 'calendar':
+            connect_availability_receivers()
+        connect_capacity_cache_receivers()
@@ -0,0 +1,264 @@
+import calendar
+import datetime
+from collections import defaultdict
+
+import numpy
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_save
+
+from core.models import Site
+from core.signals import data_loaded
+from .models import Engineer, EngineerAvailabilityCalendar, SiteHoliday
+
+HOLIDAY = EngineerAvailabilityCalendar.HOLIDAY
+
+
+def get_year_length(year):
+    return 366 if calendar.isleap(year) else 365
+
+
+def get_day_of_year(date):
+    return date.timetuple().tm_yday - 1
+
+
+def decode_days(days):
+    return numpy.frombuffer(days.encode('ascii'), dtype=numpy.uint8) - ord('0')
+
+
+def encode_days(flags):
+    return (flags + ord('0')).astype(numpy.uint8).tobytes().decode('ascii')
+
+
+def get_site_filter(site_ids, field_name='site'):
+    site_filter = Q(**{field_name + '_id__in': [site_id for site_id in site_ids if site_id is not None]})
+    if None in site_ids:
+        site_filter |= Q(**{field_name + '__isnull': True})
+    return site_filter
+
+
+def build_availability_calendars(engineer_sites, site_holidays, years=None):
+    """
+    Day flags of every engineer and year from the engineer sites (engineer id to site id) and site holidays as
+    (site id, date). Only years with a holiday are returned, limited to years if passed.
+    """
+    holiday_flags = {}
+    for site_id, date in site_holidays:
+        if years is None or date.year in years:
+            flags = holiday_flags.get((site_id, date.year))
+            if flags is None:
+                flags = holiday_flags[(site_id, date.year)] = numpy.zeros(get_year_length(date.year), numpy.uint8)
+            flags[get_day_of_year(date)] = HOLIDAY
+
+    site_years = defaultdict(list)
+    for site_id, year in holiday_flags:
+        site_years[site_id].append(year)
+
+    calendars = {}
+    for engineer_id, site_id in engineer_sites.items():
+        for year in site_years.get(site_id, []):
+            calendars[(engineer_id, year)] = holiday_flags[(site_id, year)].copy()
+    return calendars
+
+
+def load_availability_calendars(engineer_ids, years=None):
+    """
+    Day flags computed from the current site holidays of the engineers, for years if passed.
+    """
+    engineer_sites = dict(Engineer.objects.filter(id__in=engineer_ids).values_list('id', 'site_id'))
+    if not engineer_sites:
+        return {}
+
+    site_holidays = SiteHoliday.objects.filter(get_site_filter(set(engineer_sites.values())))
+    if years is not None:
+        years = set(years)
+        first_date = datetime.date(min(years), 1, 1)
+        last_date = datetime.date(max(years), 12, 31)
+        site_holidays = site_holidays.filter(date__gte=first_date, date__lte=last_date)
+
+    return build_availability_calendars(engineer_sites, site_holidays.values_list('site_id', 'date'), years)
+
+
+def get_stored_availability_calendars(engineer_ids, years=None):
+    stored_calendars = EngineerAvailabilityCalendar.objects.filter(engineer_id__in=engineer_ids)
+    if years is not None:
+        stored_calendars = stored_calendars.filter(year__in=years)
+    return {(stored_calendar.engineer_id, stored_calendar.year): stored_calendar for stored_calendar in
+            stored_calendars}
+
+
+def refresh_availability_calendars(engineer_ids, years=None, batch_size=1000):
+    """
+    Recompute the stored calendars of the engineers for years (all years if None) from their site holidays. Returns the number of calendars created, updated and deleted.
+    """
+    engineer_ids = list(engineer_ids)
+    calendars = load_availability_calendars(engineer_ids, years)
+    stored_calendars = get_stored_availability_calendars(engineer_ids, years)
+
+    calendars_to_update = []
+    calendar_ids_to_delete = []
+    for key, stored_calendar in stored_calendars.items():
+        if key not in calendars:
+            calendar_ids_to_delete.append(stored_calendar.id)
+            continue
+        days = encode_days(calendars[key])
+        if stored_calendar.days != days:
+            stored_calendar.days = days
+            calendars_to_update.append(stored_calendar)
+    calendars_to_create = [EngineerAvailabilityCalendar(engineer_id=engineer_id, year=year, days=encode_days(flags))
+                           for (engineer_id, year), flags in calendars.items()
+                           if (engineer_id, year) not in stored_calendars]
+
+    with transaction.atomic():
+        if calendar_ids_to_delete:
+            EngineerAvailabilityCalendar.objects.filter(id__in=calendar_ids_to_delete).delete()
+        EngineerAvailabilityCalendar.objects.bulk_update(calendars_to_update, ['days'], batch_size=batch_size)
+        EngineerAvailabilityCalendar.objects.bulk_create(calendars_to_create, batch_size=batch_size)
+    return len(calendars_to_create), len(calendars_to_update), len(calendar_ids_to_delete)
+
+
+def rebuild_availability_calendars(batch_size=1000):
+    """
+    Recompute the calendars of all engineers, batch_size engineers at a time.
+    """
+    engineer_ids = list(Engineer.objects.order_by('id').values_list('id', flat=True))
+    counts = [0, 0, 0]
+    for index in range(0, len(engineer_ids), batch_size):
+        batch_counts = refresh_availability_calendars(engineer_ids[index:index + batch_size], batch_size=batch_size)
+        counts = [count + batch_count for count, batch_count in zip(counts, batch_counts)]
+    return tuple(counts)
+
+
+def check_availability_calendars(batch_size=1000):
+    """
+    Compare the stored calendars with the ones computed from the current site holidays. Returns a list of
+    (engineer id, year, number of days differing) for every calendar out of date.
+    """
+    engineer_ids = list(Engineer.objects.order_by('id').values_list('id', flat=True))
+    mismatches = []
+    for index in range(0, len(engineer_ids), batch_size):
+        batch_engineer_ids = engineer_ids[index:index + batch_size]
+        calendars = load_availability_calendars(batch_engineer_ids)
+        stored_calendars = get_stored_availability_calendars(batch_engineer_ids)
+        for key in sorted(set(calendars.keys()) | set(stored_calendars.keys())):
+            flags = calendars.get(key, numpy.zeros(get_year_length(key[1]), numpy.uint8))
+            stored_flags = decode_days(stored_calendars[key].days) if key in stored_calendars else numpy.zeros(
+                get_year_length(key[1]), numpy.uint8)
+            if len(flags) != len(stored_flags):
+                mismatches.append((key[0], key[1], len(flags)))
+            elif not numpy.array_equal(flags, stored_flags):
+                mismatches.append((key[0], key[1], int(numpy.count_nonzero(flags != stored_flags))))
+    return mismatches
+
+
+def get_availability_day_counts(engineer_ids, from_date, to_date, weekmask, leaves=()):
+    """
+    Leave business days not on a holiday and holiday days of every engineer id in the time range, returned as two
+    dictionaries keyed by engineer id. The holidays are read from the stored calendars and the leave days are summed
+    per leave as (engineer id, start date, end date) over them, following the live computation that only counts the
+    leaves fully in the time range and counts overlapping leaves once each.
+    """
+    dates = numpy.arange(numpy.datetime64(from_date), numpy.datetime64(to_date) + 1)
+    business_days = numpy.is_busday(dates, weekmask=weekmask)
+
+    holidays_by_engineer = defaultdict(lambda: numpy.zeros(len(dates), bool))
+    for engineer_id, year, days in EngineerAvailabilityCalendar.objects.filter(
+            engineer_id__in=engineer_ids, year__gte=from_date.year, year__lte=to_date.year).values_list(
+        'engineer_id', 'year', 'days'):
+        first_date = max(from_date, datetime.date(year, 1, 1))
+        last_date = min(to_date, datetime.date(year, 12, 31))
+        offset = (first_date - from_date).days
+        first_day = get_day_of_year(first_date)
+        day_count = (last_date - first_date).days + 1
+        holidays_by_engineer[engineer_id][offset:offset + day_count] = \
+            (decode_days(days)[first_day:first_day + day_count] & HOLIDAY) != 0
+
+    site_holiday_count = {engineer_id: int(numpy.count_nonzero(holidays))
+                          for engineer_id, holidays in holidays_by_engineer.items()}
+
+    # Leave days of a leave are a difference of the cumulative leave days of the time range
+    cumulative_leave_days = {}
+    leave_count = defaultdict(int)
+    for engineer_id, start_date, end_date in leaves:
+        cumulative_days = cumulative_leave_days.get(engineer_id)
+        if cumulative_days is None:
+            holidays = holidays_by_engineer.get(engineer_id)
+            leave_days = business_days if holidays is None else business_days & ~holidays
+            cumulative_days = cumulative_leave_days[engineer_id] = numpy.concatenate(
+                ([0], numpy.cumsum(leave_days)))
+        leave_count[engineer_id] += int(cumulative_days[(end_date - from_date).days + 1]
+                                        - cumulative_days[(start_date - from_date).days])
+    return leave_count, site_holiday_count
+
+
+def refresh_availability_calendars_on_commit(engineer_ids, years=None):
+    engineer_ids = list(engineer_ids)
+    if engineer_ids:
+        transaction.on_commit(lambda: refresh_availability_calendars(engineer_ids, years))
+
+
+availability_dependency_fields = {
+    SiteHoliday: ['site_id', 'date'],
+    Engineer: ['site_id'],
+}
+
+
+# noinspection PyUnusedLocal
+def remember_availability_dependency(sender, instance, raw=False, **kwargs):
+    # Remember the stored site/date so that the calendars they were part of are refreshed too
+    if sender in availability_dependency_fields and instance.pk is not None and not raw:
+        instance._stored_availability_dependencies = sender.objects.filter(pk=instance.pk).values_list(
+            *availability_dependency_fields[sender]).first()
+
+
+# noinspection PyUnusedLocal
+def refresh_availability(sender, instance, created=False, **kwargs):
+    if sender not in availability_dependency_fields:
+        return
+    values = [tuple(getattr(instance, field_name) for field_name in availability_dependency_fields[sender])]
+    stored_values = getattr(instance, '_stored_availability_dependencies', None)
+    if stored_values is not None and stored_values != values[0]:
+        values.append(stored_values)
+
+    match sender.__name__:
+        case 'SiteHoliday':
+            site_ids = {site_id for site_id, date in values}
+            years = {date.year for site_id, date in values}
+            refresh_availability_calendars_on_commit(
+                Engineer.objects.filter(get_site_filter(site_ids)).values_list('id', flat=True), years)
+        case 'Engineer':
+            if created or len(values) > 1:
+                refresh_availability_calendars_on_commit([instance.id])
+
+
+# noinspection PyUnusedLocal
+def refresh_availability_on_site_delete(sender, instance, **kwargs):
+    # Engineers and holidays of the site are moved to no site without save signals
+    refresh_availability_calendars_on_commit(Engineer.objects.filter(site__isnull=True).values_list('id', flat=True))
+
+
+# noinspection PyUnusedLocal
+def rebuild_availability_on_data_loaded(sender, models=(), **kwargs):
+    if any(model in availability_dependency_fields for model in models) or Site in models:
+        rebuild_availability_calendars()
+
+
+# Receivers of the availability calendars as (signal, receiver, sender, dispatch_uid), connected only with the calendar
+# availability source
+availability_receivers = [
+    (pre_save, remember_availability_dependency, None, "remember_availability_dependency"),
+    (post_save, refresh_availability, None, "refresh_availability_on_save"),
+    (post_delete, refresh_availability, None, "refresh_availability_on_delete"),
+    (post_delete, refresh_availability_on_site_delete, Site, "refresh_availability_on_site_delete"),
+    (data_loaded, rebuild_availability_on_data_loaded, None, "rebuild_availability_on_data_loaded"),
+]
+
+
+def connect_availability_receivers():
+    for signal, receiver, sender, dispatch_uid in availability_receivers:
+        signal.connect(receiver, sender=sender, dispatch_uid=dispatch_uid)
+
+
+def disconnect_availability_receivers():
+    for signal, receiver, sender, dispatch_uid in availability_receivers:
+        signal.disconnect(receiver, sender=sender, dispatch_uid=dispatch_uid)
@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from core.models import OrgGroup, Site
+from .engine import get_capacity_data_for_org_groups
+from .models import Engineer, EngineerOrgGroupParticipation, SiteHoliday, Leave
+
+
+def build_capacity_dataset(org_group_count, engineer_count, site_count, leaves_per_engineer, from_date, days,
+                           fan_out=5):
+    """
+    Create an org tree with the given fan out, engineers spread over its org groups and sites, site holidays and
+    leaves within the days following from_date. Returns the root org group.
+    """
+    org_groups = [OrgGroup.objects.create(name="bench_org_0")]
+    for index in range(1, org_group_count):
+        org_groups.append(OrgGroup.objects.create(name="bench_org_" + str(index),
+                                                  org_group=org_groups[(index - 1) // fan_out]))
+
+    sites = Site.objects.bulk_create([Site(name="bench_site_" + str(index)) for index in range(site_count)])
+    SiteHoliday.objects.bulk_create([SiteHoliday(site=site, name="bench_holiday_" + str(day),
+                                                 date=from_date + timedelta(days=day))
+                                     for site_index, site in enumerate(sites)
+                                     for day in range(site_index % 7, days, 17)])
+
+    users = User.objects.bulk_create([User(username="bench_engineer_" + str(index), password='!')
+                                      for index in range(engineer_count)])
+    engineers = Engineer.objects.bulk_create([Engineer(employee_id="bench_" + str(index), auth_user=user,
+                                                       site=sites[index % site_count])
+                                              for index, user in enumerate(users)])
+    EngineerOrgGroupParticipation.objects.bulk_create([
+        EngineerOrgGroupParticipation(engineer=engineer, org_group=org_groups[index % org_group_count],
+                                      capacity=1.0 if index % 4 else 0.5)
+        for index, engineer in enumerate(engineers)])
+    Leave.objects.bulk_create([Leave(engineer=engineer,
+                                     start_date=from_date + timedelta(days=(index * 7 + leave_index * 13) % days),
+                                     end_date=from_date + timedelta(
+                                         days=min((index * 7 + leave_index * 13) % days + 2, days - 1)))
+                               for index, engineer in enumerate(engineers)
+                               for leave_index in range(leaves_per_engineer)])
+    return org_groups[0]
+
+
+def run_capacity_benchmark(root_org_group, from_date, to_date):
+    """
+    Time the org capacity endpoint computation for the root org group and all its transitive sub groups.
+    """
+    with CaptureQueriesContext(connection) as context:
+        start_time = time.perf_counter()
+        org_group_ids = root_org_group.get_transitive_sub_groups()
+        capacity_data = get_capacity_data_for_org_groups(org_group_ids, from_date, to_date)
+        compute_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        rendered_data = JSONRenderer().render(capacity_data)
+        render_time = time.perf_counter() - start_time
+
+    return {
+        'org_groups': len(org_group_ids),
+        'engineers': sum(len(item['engineer_data']) for item in capacity_data.values()),
+        'queries': len(context.captured_queries),
+        'compute_seconds': round(compute_time, 4),
+        'render_seconds': round(render_time, 4),
+        'response_bytes': len(rendered_data),
+    }
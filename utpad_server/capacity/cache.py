@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+
+from core.models import OrgGroup, Site
+from core.signals import data_loaded
+from utpad_server import settings
+from utpad_server.dataload import run_with_own_connection
+from .engine import WORK_DAYS_MASK, get_capacity_data_for_org_groups
+from .models import Engineer, EngineerOrgGroupParticipation, SiteHoliday, Leave
+
+capacity_org_version_cache_key_prefix = 'capacity_org_version:'
+capacity_cache_key_prefix = 'capacity:'
+
+capacity_cache_statistics = {'hits': 0, 'misses': 0, 'invalidated_org_groups': 0}
+capacity_cache_statistics_lock = threading.Lock()
+
+
+def count_capacity_cache_event(event, count=1):
+    with capacity_cache_statistics_lock:
+        capacity_cache_statistics[event] += count
+
+
+def get_capacity_cache_statistics():
+    with capacity_cache_statistics_lock:
+        return dict(capacity_cache_statistics)
+
+
+def get_org_capacity_versions(org_group_ids):
+    """
+    Version of the capacity inputs of every org group, the time in nanoseconds at which they last changed.
+    """
+    version_keys = {org_group_id: capacity_org_version_cache_key_prefix + str(org_group_id)
+                    for org_group_id in org_group_ids}
+    cached_versions = cache.get_many(version_keys.values())
+
+    missing_versions = {version_key: time.time_ns() for version_key in version_keys.values()
+                        if version_key not in cached_versions}
+    if missing_versions:
+        cache.set_many(missing_versions, timeout=None)
+        cached_versions.update(missing_versions)
+    return {org_group_id: cached_versions[version_key] for org_group_id, version_key in version_keys.items()}
+
+
+def bump_org_capacity_versions(org_group_ids):
+    org_group_ids = {org_group_id for org_group_id in org_group_ids if org_group_id is not None}
+    if org_group_ids:
+        version = time.time_ns()
+        cache.set_many({capacity_org_version_cache_key_prefix + str(org_group_id): version
+                        for org_group_id in org_group_ids}, timeout=None)
+        count_capacity_cache_event('invalidated_org_groups', len(org_group_ids))
+
+
+def bump_org_capacity_versions_on_commit(org_group_ids):
+    """
+    Bump the capacity versions of the org groups once the transaction commits. A bump before the commit would let a
+    concurrent request cache the capacity of the old rows under the new version. The availability receivers are
+    connected first (CapacityConfig.ready), so the calendar refreshes queued on commit by the same change run before
+    the bump.
+    """
+    # Resolved now, the rows of deleted records are gone after the commit
+    org_group_ids = list(org_group_ids)
+    if org_group_ids:
+        transaction.on_commit(lambda: bump_org_capacity_versions(org_group_ids))
+
+
+def get_cached_capacity_data_for_org_groups(org_group_ids, from_date, to_date, weekmask=WORK_DAYS_MASK,
+                                            versions=None):
+    """
+    Capacity data of each org group id served from the cache, only the org groups whose inputs changed since
+    they were cached are computed again.
+    """
+    if versions is None:
+        versions = get_org_capacity_versions(org_group_ids)
+    weekmask_key = ''.join(str(day) for day in weekmask)
+    cache_keys = {org_group_id: capacity_cache_key_prefix + ':'.join(
+        [str(org_group_id), str(from_date), str(to_date), weekmask_key, settings.CAPACITY_AVAILABILITY_SOURCE,
+         str(versions[org_group_id])])
+        for org_group_id in org_group_ids}
+
+    cached_capacity_data = cache.get_many(cache_keys.values())
+    capacity_data_for_org_groups = {org_group_id: cached_capacity_data[cache_key]
+                                    for org_group_id, cache_key in cache_keys.items()
+                                    if cache_key in cached_capacity_data}
+    missing_org_group_ids = [org_group_id for org_group_id in org_group_ids
+                             if org_group_id not in capacity_data_for_org_groups]
+    count_capacity_cache_event('hits', len(capacity_data_for_org_groups))
+    count_capacity_cache_event('misses', len(missing_org_group_ids))
+
+    if missing_org_group_ids:
+        computed_capacity_data = get_capacity_data_for_org_groups(missing_org_group_ids, from_date, to_date,
+                                                                  weekmask)
+        cache.set_many({cache_keys[org_group_id]: capacity_data
+                        for org_group_id, capacity_data in computed_capacity_data.items()},
+                       timeout=settings.CAPACITY_CACHE_TIMEOUT)
+        capacity_data_for_org_groups.update(computed_capacity_data)
+    return capacity_data_for_org_groups
+
+
+async def aget_cached_capacity_data_for_org_groups(org_group_ids, from_date, to_date, weekmask=WORK_DAYS_MASK,
+                                                   versions=None, concurrency=None):
+    """
+    get_cached_capacity_data_for_org_groups for the async views: the org groups are split in up to concurrency
+    (ASYNC_TASK_CONCURRENCY by default) slices computed at the same time, each in a worker thread with its own
+    database connection, leaving the event loop free for the other requests.
+    """
+    if versions is None:
+        versions = await sync_to_async(get_org_capacity_versions)(org_group_ids)
+    concurrency = max(1, min(concurrency or settings.ASYNC_TASK_CONCURRENCY, len(org_group_ids)))
+    org_group_id_slices = [org_group_ids[index::concurrency] for index in range(concurrency)]
+    slice_capacity_data = await asyncio.gather(*[
+        sync_to_async(run_with_own_connection, thread_sensitive=False)(
+            get_cached_capacity_data_for_org_groups, org_group_id_slice, from_date, to_date, weekmask,
+            {org_group_id: versions[org_group_id] for org_group_id in org_group_id_slice})
+        for org_group_id_slice in org_group_id_slices if org_group_id_slice])
+    capacity_data_for_org_groups = {}
+    for capacity_data in slice_capacity_data:
+        capacity_data_for_org_groups.update(capacity_data)
+    return capacity_data_for_org_groups
+
+
+def get_capacity_validators(org_groups, versions, *parameters):
+    """
+    ETag and last modified time in seconds of a capacity response for org_groups as (id, name, updated_at) tuples.
+    """
+    etag_source = [str(parameter) for parameter in parameters]
+    last_modified = 0
+    for org_group_id, name, updated_at in sorted(org_groups):
+        etag_source.append(str(org_group_id) + ':' + str(name) + ':' + str(versions[org_group_id]))
+        last_modified = max(last_modified, versions[org_group_id] / 1e9,
+                            updated_at.timestamp() if updated_at else 0)
+    return '"' + hashlib.md5('|'.join(etag_source).encode('utf-8')).hexdigest() + '"', int(last_modified)
+
+
+def get_org_groups_of_engineers(engineer_filter):
+    return EngineerOrgGroupParticipation.objects.filter(engineer_filter).values_list('org_group_id', flat=True)
+
+
+def get_org_groups_of_sites(site_ids):
+    site_filter = Q(engineer__site_id__in=[site_id for site_id in site_ids if site_id is not None])
+    if None in site_ids:
+        site_filter |= Q(engineer__site__isnull=True)
+    return get_org_groups_of_engineers(site_filter)
+
+
+# Fields of the capacity inputs identifying the org groups whose capacity they affect
+capacity_dependency_fields = {
+    Leave: 'engineer_id',
+    SiteHoliday: 'site_id',
+    EngineerOrgGroupParticipation: 'org_group_id',
+    Engineer: 'site_id',
+}
+
+
+def get_affected_org_groups(sender, instance, dependency_values):
+    match sender.__name__:
+        case 'Leave':
+            return get_org_groups_of_engineers(Q(engineer_id__in=dependency_values))
+        case 'SiteHoliday':
+            return get_org_groups_of_sites(dependency_values)
+        case 'EngineerOrgGroupParticipation':
+            return dependency_values
+        case 'Engineer':
+            return get_org_groups_of_engineers(Q(engineer_id=instance.id))
+        case _:
+            return []
+
+
+# noinspection PyUnusedLocal
+def remember_capacity_dependency(sender, instance, raw=False, **kwargs):
+    # Remember the stored engineer/site/org group so that a change of it invalidates the previous org groups too
+    if sender in capacity_dependency_fields and instance.pk is not None and not raw:
+        instance._stored_capacity_dependencies = list(
+            sender.objects.filter(pk=instance.pk).values_list(capacity_dependency_fields[sender], flat=True))
+
+
+# noinspection PyUnusedLocal
+def invalidate_capacity(sender, instance, **kwargs):
+    if sender not in capacity_dependency_fields:
+        return
+    dependency_values = {getattr(instance, capacity_dependency_fields[sender])}
+    dependency_values.update(getattr(instance, '_stored_capacity_dependencies', []))
+    bump_org_capacity_versions_on_commit(get_affected_org_groups(sender, instance, dependency_values))
+
+
+# noinspection PyUnusedLocal
+def remember_capacity_site_org_groups(sender, instance, **kwargs):
+    # Engineers and holidays of the site are moved to no site without save signals, changing the holidays of both.
+    # Resolved before the deletion moves them, bumped after so that the calendars are refreshed first.
+    instance._capacity_org_group_ids = list(get_org_groups_of_sites({instance.id, None}))
+
+
+# noinspection PyUnusedLocal
+def invalidate_capacity_on_site_delete(sender, instance, **kwargs):
+    bump_org_capacity_versions_on_commit(getattr(instance, '_capacity_org_group_ids', []))
+
+
+def invalidate_capacity_of_user(user):
+    bump_org_capacity_versions_on_commit(get_org_groups_of_engineers(Q(engineer__auth_user_id=user.id)))
+
+
+# noinspection PyUnusedLocal
+def remember_capacity_engineer_name(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The user name is the name of the engineer in the capacity data, saves of other fields (e.g. last_login) are
+    # not looked up
+    if instance.pk is not None and not raw and (update_fields is None or 'username' in update_fields):
+        instance._stored_capacity_username = User.objects.filter(pk=instance.pk).values_list(
+            'username', flat=True).first()
+
+
+# noinspection PyUnusedLocal
+def invalidate_capacity_on_user_rename(sender, instance, **kwargs):
+    stored_username = instance.__dict__.pop('_stored_capacity_username', None)
+    if stored_username is not None and stored_username != instance.username:
+        invalidate_capacity_of_user(instance)
+
+
+# noinspection PyUnusedLocal
+def invalidate_capacity_on_user_delete(sender, instance, **kwargs):
+    # The engineer of the user is left without a user (SET_NULL) without save signals
+    invalidate_capacity_of_user(instance)
+
+
+# noinspection PyUnusedLocal
+def invalidate_capacity_on_attachments(sender, instance, action, reverse=False, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        invalidate_capacity(type(instance), instance)
+
+
+# noinspection PyUnusedLocal
+def invalidate_capacity_on_data_loaded(sender, models=(), **kwargs):
+    if OrgGroup in models or any(model in capacity_dependency_fields for model in models):
+        bump_org_capacity_versions_on_commit(OrgGroup.objects.values_list('id', flat=True))
+
+
+# Receivers of the capacity cache as (signal, receiver, sender, dispatch_uid)
+capacity_cache_receivers = [
+    (pre_save, remember_capacity_dependency, None, "remember_capacity_dependency"),
+    (post_save, invalidate_capacity, None, "invalidate_capacity_on_save"),
+    (post_delete, invalidate_capacity, None, "invalidate_capacity_on_delete"),
+    (pre_delete, remember_capacity_site_org_groups, Site, "remember_capacity_site_org_groups"),
+    (post_delete, invalidate_capacity_on_site_delete, Site, "invalidate_capacity_on_site_delete"),
+    (pre_save, remember_capacity_engineer_name, User, "remember_capacity_engineer_name"),
+    (post_save, invalidate_capacity_on_user_rename, User, "invalidate_capacity_on_user_rename"),
+    (pre_delete, invalidate_capacity_on_user_delete, User, "invalidate_capacity_on_user_delete"),
+    (m2m_changed, invalidate_capacity_on_attachments, Leave.attachments.through,
+     "invalidate_capacity_on_leave_attachments"),
+    (m2m_changed, invalidate_capacity_on_attachments, SiteHoliday.attachments.through,
+     "invalidate_capacity_on_site_holiday_attachments"),
+    (data_loaded, invalidate_capacity_on_data_loaded, None, "invalidate_capacity_on_data_loaded"),
+]
+
+
+def connect_capacity_cache_receivers():
+    for signal, receiver, sender, dispatch_uid in capacity_cache_receivers:
+        signal.connect(receiver, sender=sender, dispatch_uid=dispatch_uid)
+
+
+def disconnect_capacity_cache_receivers():
+    for signal, receiver, sender, dispatch_uid in capacity_cache_receivers:
+        signal.disconnect(receiver, sender=sender, dispatch_uid=dispatch_uid)
@@ -0,0 +1,136 @@
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy
+from django.db.models import Q
+
+from utpad_server import settings
+from .availability import get_availability_day_counts
+from .models import EngineerOrgGroupParticipation, Leave, SiteHoliday
+from .serializers import LeaveSerializer, SiteHolidaySerializer
+
+# TODO: Consider making work days configurable per org group or site
+WORK_DAYS_MASK = [1, 1, 1, 1, 1, 0, 0]
+
+
+def load_capacity_inputs(org_group_ids, from_date, to_date):
+    """
+    Load the participations, leaves and site holidays needed for the capacity of the org groups in a fixed number
+    of queries independent of the number of org groups and engineers.
+    """
+    participations = list(EngineerOrgGroupParticipation.objects.filter(org_group_id__in=org_group_ids)
+                          .select_related('engineer', 'engineer__auth_user').order_by('id'))
+
+    engineer_ids = EngineerOrgGroupParticipation.objects.filter(org_group_id__in=org_group_ids).values('engineer_id')
+    leaves = list(LeaveSerializer.optimize_queryset(
+        Leave.objects.filter(engineer_id__in=engineer_ids,
+                             start_date__gte=from_date, start_date__lte=to_date,
+                             end_date__gte=from_date, end_date__lte=to_date)).order_by('id'))
+
+    site_ids = {participation.engineer.site_id for participation in participations}
+    site_filter = Q(site_id__in=[site_id for site_id in site_ids if site_id is not None])
+    if None in site_ids:
+        site_filter |= Q(site__isnull=True)
+    site_holidays = list(SiteHolidaySerializer.optimize_queryset(
+        SiteHoliday.objects.filter(site_filter, date__gte=from_date, date__lte=to_date)).order_by('id')) \
+        if site_ids else []
+
+    return participations, leaves, site_holidays
+
+
+def count_leave_days(leaves, site_holidays_dates_by_site, engineer_site_ids, weekmask=WORK_DAYS_MASK):
+    """
+    Business days of leave per engineer id, counted with one numpy.busday_count call over all leaves of a site
+    as every site has its own holidays.
+    """
+    leaves_by_site = defaultdict(list)
+    for leave in leaves:
+        leaves_by_site[engineer_site_ids.get(leave.engineer_id)].append(leave)
+
+    leave_count = defaultdict(int)
+    for site_id, site_leaves in leaves_by_site.items():
+        start_dates = numpy.array([leave.start_date for leave in site_leaves], dtype='datetime64[D]')
+        end_dates = numpy.array([leave.end_date + timedelta(days=1) for leave in site_leaves], dtype='datetime64[D]')
+        leave_days = numpy.busday_count(start_dates, end_dates, weekmask=weekmask,
+                                        holidays=site_holidays_dates_by_site.get(site_id, []))
+        for leave, days in zip(site_leaves, leave_days.tolist()):
+            leave_count[leave.engineer_id] += days
+    return leave_count
+
+
+def compute_capacity_data(org_group_ids, from_date, to_date, participations, leaves, site_holidays,
+                          weekmask=WORK_DAYS_MASK, availability_day_counts=None):
+    """
+    Capacity data of each org group id from the loaded inputs. Leave and holiday days are counted from the leaves and
+    site holidays unless availability_day_counts from the availability calendars are passed.
+    """
+    work_days = int(numpy.busday_count(from_date, to_date + timedelta(days=1), weekmask=weekmask))
+
+    site_holidays_by_site = defaultdict(list)
+    for site_holiday in site_holidays:
+        site_holidays_by_site[site_holiday.site_id].append(site_holiday)
+    site_holidays_dates_by_site = {site_id: [item.date for item in items]
+                                   for site_id, items in site_holidays_by_site.items()}
+
+    leaves_by_engineer = defaultdict(list)
+    for leave in leaves:
+        leaves_by_engineer[leave.engineer_id].append(leave)
+
+    engineer_site_ids = {participation.engineer_id: participation.engineer.site_id
+                         for participation in participations}
+    if availability_day_counts is None:
+        leave_count = count_leave_days(leaves, site_holidays_dates_by_site, engineer_site_ids, weekmask)
+        site_holiday_count_by_engineer = None
+    else:
+        leave_count, site_holiday_count_by_engineer = availability_day_counts
+
+    # Serialize every leave and holiday once even if the engineer participates in several org groups
+    leave_data = dict(zip([leave.id for leave in leaves], LeaveSerializer(leaves, many=True).data))
+    site_holiday_data = dict(zip([item.id for item in site_holidays],
+                                 SiteHolidaySerializer(site_holidays, many=True).data))
+
+    capacity_data_for_org_groups = {org_group_id: {'work_days': work_days, 'total_capacity': 0, 'engineer_data': {}}
+                                    for org_group_id in org_group_ids}
+    for participation in participations:
+        engineer = participation.engineer
+        engineer_site_holidays = site_holidays_by_site.get(engineer.site_id, [])
+        engineer_site_holidays_dates = site_holidays_dates_by_site.get(engineer.site_id, [])
+        engineer_leave_count = leave_count.get(engineer.id, 0)
+        site_holiday_count = len(engineer_site_holidays_dates) if site_holiday_count_by_engineer is None \
+            else site_holiday_count_by_engineer.get(engineer.id, 0)
+        available_days = work_days - engineer_leave_count - site_holiday_count
+        capacity = available_days * participation.capacity
+
+        capacity_data = capacity_data_for_org_groups[participation.org_group_id]
+        capacity_data['total_capacity'] = capacity_data['total_capacity'] + capacity
+        capacity_data['engineer_data'][engineer.employee_id] = {
+            'employee_id': engineer.employee_id,
+            'name': engineer.auth_user.username,
+            'leave_plans': [leave_data[leave.id] for leave in leaves_by_engineer.get(engineer.id, [])],
+            'site_holidays': [site_holiday_data[item.id] for item in engineer_site_holidays],
+            'engineer_site_holidays_dates': engineer_site_holidays_dates,
+            'leave_count': engineer_leave_count,
+            'site_holiday_count': site_holiday_count,
+            'available_days': available_days,
+            'participation_capacity': participation.capacity,
+            'capacity': capacity,
+        }
+
+    return capacity_data_for_org_groups
+
+
+def get_capacity_data_for_org_groups(org_group_ids, from_date, to_date, weekmask=WORK_DAYS_MASK,
+                                     availability_source=None):
+    """
+    Capacity data of each org group id for the time range, computed for all the org groups in one batch. Leave and
+    holiday days are counted live from the leaves and site holidays or summed from the availability calendars as per
+    availability_source (live/calendar), CAPACITY_AVAILABILITY_SOURCE by default.
+    """
+    participations, leaves, site_holidays = load_capacity_inputs(org_group_ids, from_date, to_date)
+    availability_day_counts = None
+    if (availability_source or settings.CAPACITY_AVAILABILITY_SOURCE) == 'calendar':
+        availability_day_counts = get_availability_day_counts(
+            {participation.engineer_id for participation in participations}, from_date, to_date, weekmask,
+            [(leave.engineer_id, leave.start_date, leave.end_date) for leave in leaves])
+    return compute_capacity_data(org_group_ids, from_date, to_date, participations, leaves, site_holidays, weekmask,
+                                 availability_day_counts)
@@ -0,0 +1,38 @@
+import datetime
+import json
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from capacity.benchmarks import build_capacity_dataset, run_capacity_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the org capacity computation on synthetic data in a temporary test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engineers', type=int, nargs='+', default=[500, 1000, 5000],
+                            help='Engineer counts to benchmark')
+        parser.add_argument('--org-groups', type=int, default=200, help='Number of org groups')
+        parser.add_argument('--sites', type=int, default=10, help='Number of sites')
+        parser.add_argument('--leaves-per-engineer', type=int, default=4, help='Leaves of every engineer')
+        parser.add_argument('--days', type=int, default=90, help='Days in the time range')
+
+    def handle(self, *args, **options):
+        from_date = datetime.date(2025, 1, 1)
+        to_date = from_date + timedelta(days=options['days'] - 1)
+
+        # Never touch the configured database, the data is created in a temporary test database
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for engineer_count in options['engineers']:
+                with transaction.atomic():
+                    root_org_group = build_capacity_dataset(options['org_groups'], engineer_count, options['sites'],
+                                                            options['leaves_per_engineer'], from_date,
+                                                            options['days'])
+                    result = run_capacity_benchmark(root_org_group, from_date, to_date)
+                    transaction.set_rollback(True)
+                self.stdout.write(json.dumps(result))
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
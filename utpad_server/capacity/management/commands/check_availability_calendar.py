@@ -0,0 +1,51 @@
+import datetime
+import sys
+
+from django.core.management import BaseCommand
+
+from capacity.availability import check_availability_calendars
+from capacity.engine import get_capacity_data_for_org_groups
+from core.models import OrgGroup
+
+
+class Command(BaseCommand):
+    help = ('Check the engineer availability calendars against the site holidays, optionally comparing the'
+            ' org capacity computed from the calendars with the live computation for a time range')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Engineers checked at a time')
+        parser.add_argument('--from', dest='from_date', type=datetime.date.fromisoformat,
+                            help='Start date (yyyy-mm-dd) of the capacity comparison')
+        parser.add_argument('--to', dest='to_date', type=datetime.date.fromisoformat,
+                            help='End date (yyyy-mm-dd) of the capacity comparison')
+
+    def handle(self, *args, **options):
+        mismatch_count = 0
+        for engineer_id, year, day_count in check_availability_calendars(options['batch_size']):
+            self.stdout.write(f'Calendar of engineer {engineer_id} for {year} differs on {day_count} days')
+            mismatch_count += 1
+
+        if options['from_date'] and options['to_date']:
+            org_group_ids = list(OrgGroup.objects.values_list('id', flat=True))
+            live_capacity_data = get_capacity_data_for_org_groups(org_group_ids, options['from_date'],
+                                                                  options['to_date'], availability_source='live')
+            calendar_capacity_data = get_capacity_data_for_org_groups(org_group_ids, options['from_date'],
+                                                                      options['to_date'],
+                                                                      availability_source='calendar')
+            # Both count the leaves fully in the time range, any difference is from calendars out of date
+            for org_group_id in org_group_ids:
+                live_engineer_data = live_capacity_data[org_group_id]['engineer_data']
+                calendar_engineer_data = calendar_capacity_data[org_group_id]['engineer_data']
+                for employee_id, engineer_data in live_engineer_data.items():
+                    for key in ('leave_count', 'site_holiday_count'):
+                        if engineer_data[key] != calendar_engineer_data[employee_id][key]:
+                            self.stdout.write(
+                                f'{key} of {employee_id} in org group {org_group_id} is {engineer_data[key]} live'
+                                f' and {calendar_engineer_data[employee_id][key]} from the calendar')
+                            mismatch_count += 1
+
+        if mismatch_count:
+            self.stderr.write(self.style.ERROR(f'Found {mismatch_count} availability calendar differences, run'
+                                               f' rebuild_availability_calendar to rebuild the calendars'))
+            sys.exit(1)
+        self.stdout.write(self.style.SUCCESS('Availability calendars are consistent'))
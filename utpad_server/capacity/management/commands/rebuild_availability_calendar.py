@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from capacity.availability import rebuild_availability_calendars
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the engineer availability calendars from the site holidays'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Engineers rebuilt at a time')
+
+    def handle(self, *args, **options):
+        try:
+            created, updated, deleted = rebuild_availability_calendars(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully rebuilt availability calendars, {created} created, {updated} updated and'
+                f' {deleted} deleted'))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'Error rebuilding availability calendars: {str(e)}'))
@@ -98,6 +98,25 @@ class Leave(BaseModel):
         return self.is_owner(user) or (user == self.engineer.auth_user)
 
 
+class EngineerAvailabilityCalendar(models.Model):
+    """
+    Availability of an engineer for every day of a year derived from the holidays of the engineer site, one digit per
+    day holding the HOLIDAY flag. Years without any holiday of the engineer have no row. The leave days are counted
+    per leave over the calendar, as the live computation only counts the leaves fully in the time range.
+    """
+    HOLIDAY = 1
+
+    engineer = models.ForeignKey(Engineer, on_delete=models.CASCADE, related_name="availability_calendars")
+    year = models.IntegerField()
+    days = models.CharField(max_length=366)
+
+    class Meta:
+        unique_together = [['engineer', 'year']]
+
+    def __str__(self):
+        return str(self.engineer) + " availability for " + str(self.year)
+
+
 model_name_map = {
     'Attachment': Attachment,
     'Engineer': Engineer,
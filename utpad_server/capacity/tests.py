@@ -1,14 +1,35 @@
 import datetime
+import json
+import tempfile
+from io import StringIO
 from datetime import timedelta
 from itertools import cycle
 
+import numpy
+import pyarrow as pa
+import pyarrow.parquet as pq
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User, Group, Permission
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, AsyncClient
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
 
 from core.models import OrgGroup, Site
 from core.serializers import UserSerializer, OrgGroupSerializer
+from utpad_server.dataload import save_data_to_folder, bulk_load_data_from_folder, save_data_to_parquet_folder
 from capacity.apiviews import get_capacity_data_for_org_group
-from capacity.models import Engineer, EngineerOrgGroupParticipation, SiteHoliday, Leave
+from capacity.cache import get_cached_capacity_data_for_org_groups, get_org_capacity_versions, \
+    aget_cached_capacity_data_for_org_groups, \
+    get_capacity_cache_statistics, connect_capacity_cache_receivers, disconnect_capacity_cache_receivers
+from capacity.availability import check_availability_calendars, rebuild_availability_calendars, \
+    connect_availability_receivers, disconnect_availability_receivers
+from capacity.engine import WORK_DAYS_MASK, get_capacity_data_for_org_groups
+from capacity.models import Engineer, EngineerOrgGroupParticipation, SiteHoliday, Leave, EngineerAvailabilityCalendar
+from capacity.serializers import LeaveSerializer, SiteHolidaySerializer
 
 
 # Create your tests here.
@@ -140,3 +161,395 @@ class CapacityTestCase(TestCase):
             capacity_data_for_org_groups[transitive_sub_group.name] = get_capacity_data_for_org_group(
                 transitive_sub_group, start_date, end_date)
         print("Capacity data for root_org is " + str(capacity_data_for_org_groups))
+
+
+def get_capacity_data_per_engineer(org_group, from_date, to_date):
+    # Per engineer computation replaced by the batch capacity engine, kept as the reference for its results
+    work_days = numpy.busday_count(from_date, to_date + timedelta(days=1), weekmask=WORK_DAYS_MASK)
+    total_capacity = 0
+    engineer_data = {}
+    for org_group_participation in EngineerOrgGroupParticipation.objects.filter(org_group=org_group):
+        engineer = org_group_participation.engineer
+        engineer_leave_plans = Leave.objects.filter(engineer=engineer,
+                                                    start_date__gte=from_date, start_date__lte=to_date,
+                                                    end_date__gte=from_date, end_date__lte=to_date)
+        engineer_site_holidays = SiteHoliday.objects.filter(site=engineer.site, date__gte=from_date,
+                                                            date__lte=to_date)
+        engineer_site_holidays_dates = [item.date for item in engineer_site_holidays]
+        leave_count = 0
+        for engineer_leave in engineer_leave_plans:
+            leave_count = leave_count + numpy.busday_count(engineer_leave.start_date,
+                                                           engineer_leave.end_date + timedelta(days=1),
+                                                           weekmask=WORK_DAYS_MASK,
+                                                           holidays=engineer_site_holidays_dates)
+        available_days = work_days - leave_count - len(engineer_site_holidays_dates)
+        capacity = available_days * org_group_participation.capacity
+        total_capacity = total_capacity + capacity
+        engineer_data[engineer.employee_id] = {
+            'employee_id': engineer.employee_id,
+            'name': engineer.auth_user.username,
+            'leave_plans': LeaveSerializer(engineer_leave_plans, many=True).data,
+            'site_holidays': SiteHolidaySerializer(engineer_site_holidays, many=True).data,
+            'engineer_site_holidays_dates': engineer_site_holidays_dates,
+            'leave_count': leave_count,
+            'site_holiday_count': len(engineer_site_holidays_dates),
+            'available_days': available_days,
+            'participation_capacity': org_group_participation.capacity,
+            'capacity': capacity,
+        }
+    return {'work_days': work_days, 'total_capacity': total_capacity, 'engineer_data': engineer_data}
+
+
+class CapacityEngineTestCase(TestCase):
+    def setUp(self):
+        self.start_date = datetime.date(2025, 1, 1)
+        self.end_date = datetime.date(2025, 3, 31)
+
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        self.org_groups = [self.root_org]
+        for index in range(3):
+            self.org_groups.append(OrgGroup.objects.create(name="org_" + str(index), org_group=self.root_org))
+
+        sites = [Site.objects.create(name='ODC1'), Site.objects.create(name='ODC2'), None]
+        for site_index, site in enumerate(sites):
+            for holiday_index in range(3):
+                SiteHoliday.objects.create(site=site, name="holiday_" + str(holiday_index),
+                                           date=self.start_date + timedelta(days=7 * holiday_index + site_index))
+
+        for index in range(12):
+            user = User.objects.create_user(username="eng_" + str(index), password="password")
+            engineer = Engineer.objects.create(employee_id="eng_id_" + str(index), auth_user=user,
+                                               site=sites[index % 3])
+            EngineerOrgGroupParticipation.objects.create(engineer=engineer, org_group=self.org_groups[index % 4],
+                                                         capacity=0.5 + 0.1 * index)
+            if index % 2 == 0:
+                EngineerOrgGroupParticipation.objects.create(engineer=engineer, org_group=self.root_org)
+            for leave_index in range(index % 3):
+                start_date = self.start_date + timedelta(days=5 + 11 * leave_index + index)
+                Leave.objects.create(engineer=engineer, start_date=start_date, end_date=start_date + timedelta(days=3))
+            # Leave outside of the time range is ignored
+            Leave.objects.create(engineer=engineer, start_date=self.end_date, end_date=self.end_date + timedelta(days=2))
+
+    def test_engine_matches_per_engineer_computation(self):
+        org_group_ids = self.root_org.get_transitive_sub_groups()
+        capacity_data = get_capacity_data_for_org_groups(org_group_ids, self.start_date, self.end_date)
+
+        for org_group in self.org_groups:
+            expected_capacity_data = get_capacity_data_per_engineer(org_group, self.start_date, self.end_date)
+            self.assertEqual(json.loads(JSONRenderer().render(expected_capacity_data)),
+                             json.loads(JSONRenderer().render(capacity_data[org_group.id])))
+
+    def test_engine_query_count_independent_of_org_groups(self):
+        with CaptureQueriesContext(connection) as context:
+            get_capacity_data_for_org_groups([self.org_groups[1].id], self.start_date, self.end_date)
+        single_org_group_queries = len(context.captured_queries)
+
+        org_group_ids = self.root_org.get_transitive_sub_groups()
+        with CaptureQueriesContext(connection) as context:
+            get_capacity_data_for_org_groups(org_group_ids, self.start_date, self.end_date)
+        self.assertEqual(single_org_group_queries, len(context.captured_queries))
+
+
+class CapacityCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        CapacityEngineTestCase.setUp(self)
+        self.org_group_ids = self.root_org.get_transitive_sub_groups()
+
+    def test_cached_capacity_matches_engine(self):
+        capacity_data = get_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date)
+        self.assertEqual(capacity_data, get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date,
+                                                                                self.end_date))
+
+        statistics = get_capacity_cache_statistics()
+        with CaptureQueriesContext(connection) as context:
+            cached_capacity_data = get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date,
+                                                                           self.end_date)
+        self.assertEqual(0, len(context.captured_queries))
+        self.assertEqual(capacity_data, cached_capacity_data)
+        self.assertEqual(statistics['hits'] + len(self.org_group_ids), get_capacity_cache_statistics()['hits'])
+
+    def test_leave_change_invalidates_only_engineer_org_groups(self):
+        get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date)
+        versions = get_org_capacity_versions(self.org_group_ids)
+
+        # eng_1 only participates in org_0
+        engineer = Engineer.objects.get(employee_id="eng_id_1")
+        with self.captureOnCommitCallbacks(execute=True):
+            Leave.objects.create(engineer=engineer, start_date=datetime.date(2025, 2, 3),
+                                 end_date=datetime.date(2025, 2, 4))
+
+        new_versions = get_org_capacity_versions(self.org_group_ids)
+        changed_org_group_ids = {org_group_id for org_group_id in self.org_group_ids
+                                 if versions[org_group_id] != new_versions[org_group_id]}
+        self.assertEqual({self.org_groups[1].id}, changed_org_group_ids)
+        self.assertEqual(get_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date),
+                         get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date))
+
+    def test_calendars_not_maintained_with_live_source(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SiteHoliday.objects.create(site=Site.objects.get(name='ODC1'), name="holiday",
+                                       date=datetime.date(2025, 2, 4))
+        self.assertFalse(EngineerAvailabilityCalendar.objects.exists())
+
+    def test_participation_move_invalidates_both_org_groups(self):
+        versions = get_org_capacity_versions(self.org_group_ids)
+
+        participation = EngineerOrgGroupParticipation.objects.get(engineer__employee_id="eng_id_1")
+        participation.org_group = self.org_groups[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            participation.save()
+
+        new_versions = get_org_capacity_versions(self.org_group_ids)
+        changed_org_group_ids = {org_group_id for org_group_id in self.org_group_ids
+                                 if versions[org_group_id] != new_versions[org_group_id]}
+        self.assertEqual({self.org_groups[1].id, self.org_groups[2].id}, changed_org_group_ids)
+
+    def test_site_holiday_change_invalidates_site_engineer_org_groups(self):
+        versions = get_org_capacity_versions(self.org_group_ids)
+
+        # Engineers without a site are eng_2, eng_5, eng_8 and eng_11 in org_1, org_0, root_org and org_2
+        with self.captureOnCommitCallbacks(execute=True):
+            SiteHoliday.objects.create(site=None, name="new_holiday", date=datetime.date(2025, 3, 3))
+
+        new_versions = get_org_capacity_versions(self.org_group_ids)
+        changed_org_group_ids = {org_group_id for org_group_id in self.org_group_ids
+                                 if versions[org_group_id] != new_versions[org_group_id]}
+        self.assertEqual(set(self.org_group_ids), changed_org_group_ids)
+
+    def test_site_delete_invalidates_site_engineer_org_groups(self):
+        get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date)
+        versions = get_org_capacity_versions(self.org_group_ids)
+
+        # Engineers of ODC1 (eng_0, eng_3, eng_6, eng_9) gain the holidays without a site
+        with self.captureOnCommitCallbacks(execute=True):
+            Site.objects.get(name='ODC1').delete()
+
+        new_versions = get_org_capacity_versions(self.org_group_ids)
+        self.assertEqual(set(self.org_group_ids), {org_group_id for org_group_id in self.org_group_ids
+                                                   if versions[org_group_id] != new_versions[org_group_id]})
+        self.assertEqual(get_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date),
+                         get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date))
+
+    def test_user_rename_invalidates_engineer_org_groups(self):
+        get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date)
+        versions = get_org_capacity_versions(self.org_group_ids)
+
+        # eng_1 only participates in org_0, saving another field does not invalidate
+        user = User.objects.get(username="eng_1")
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(update_fields=['last_login'])
+            user.first_name = "first"
+            user.save()
+        self.assertEqual(versions, get_org_capacity_versions(self.org_group_ids))
+
+        user.username = "renamed_eng_1"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        new_versions = get_org_capacity_versions(self.org_group_ids)
+        self.assertEqual({self.org_groups[1].id}, {org_group_id for org_group_id in self.org_group_ids
+                                                   if versions[org_group_id] != new_versions[org_group_id]})
+        self.assertEqual(get_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date),
+                         get_cached_capacity_data_for_org_groups(self.org_group_ids, self.start_date, self.end_date))
+
+    def test_capacity_view_conditional_requests(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username="eng_0"))
+        parameters = {'org_group': self.root_org.id, 'from': '2025-01-01', 'to': '2025-03-31'}
+
+        response = client.get('/capacity/api/capacity_view', parameters)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+
+        response = client.get('/capacity/api/capacity_view', parameters, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Leave.objects.create(engineer=Engineer.objects.get(employee_id="eng_id_1"),
+                                 start_date=datetime.date(2025, 2, 3), end_date=datetime.date(2025, 2, 4))
+        response = client.get('/capacity/api/capacity_view', parameters, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+
+class AsyncCapacityViewTestCase(TransactionTestCase):
+    # Committed data, the capacity slices are computed in worker threads with their own connections
+    def setUp(self):
+        cache.clear()
+        CapacityEngineTestCase.setUp(self)
+
+    async def test_async_capacity_view_matches_capacity_view(self):
+        parameters = {'org_group': self.root_org.id, 'from': '2025-01-01', 'to': '2025-03-31'}
+        client = APIClient()
+        await sync_to_async(client.force_authenticate)(await User.objects.aget(username="eng_0"))
+        response = await sync_to_async(client.get)('/capacity/api/capacity_view', parameters)
+        self.assertEqual(200, response.status_code)
+
+        async_client = AsyncClient()
+        self.assertEqual(401, (await async_client.get('/capacity/api/async/capacity_view', parameters)).status_code)
+        await async_client.aforce_login(await User.objects.aget(username="eng_0"))
+        async_response = await async_client.get('/capacity/api/async/capacity_view', parameters)
+        self.assertEqual(200, async_response.status_code)
+        self.assertEqual(json.loads(response.content), json.loads(async_response.content))
+        self.assertEqual(response['ETag'], async_response['ETag'])
+
+        async_response = await async_client.get('/capacity/api/async/capacity_view', parameters,
+                                                headers={'If-None-Match': response['ETag']})
+        self.assertEqual(304, async_response.status_code)
+        self.assertEqual(404, (await async_client.get('/capacity/api/async/capacity_view', {
+            'org_group': 0, 'from': '2025-01-01', 'to': '2025-03-31'})).status_code)
+
+    async def test_async_cached_capacity_matches_engine(self):
+        org_group_ids = await sync_to_async(self.root_org.get_transitive_sub_groups)()
+        capacity_data = await sync_to_async(get_capacity_data_for_org_groups)(org_group_ids, self.start_date,
+                                                                              self.end_date)
+        for concurrency in [1, 3, 10]:
+            cache.clear()
+            self.assertEqual(capacity_data, await aget_cached_capacity_data_for_org_groups(
+                org_group_ids, self.start_date, self.end_date, concurrency=concurrency))
+
+
+class AvailabilityReceiversTestMixin:
+    # The availability calendars are only maintained with the calendar source, their receivers connected before the
+    # capacity cache ones as in CapacityConfig.ready
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        disconnect_capacity_cache_receivers()
+        connect_availability_receivers()
+        connect_capacity_cache_receivers()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect_availability_receivers()
+        super().tearDownClass()
+
+
+class AvailabilityCalendarTestCase(AvailabilityReceiversTestMixin, TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CapacityEngineTestCase.setUp(self)
+        self.org_group_ids = self.root_org.get_transitive_sub_groups()
+
+    def test_calendar_capacity_matches_live_capacity(self):
+        def get_leave_count(capacity_data):
+            return capacity_data[self.org_groups[1].id]['engineer_data']['eng_id_1']['leave_count']
+
+        leave_count = get_leave_count(get_capacity_data_for_org_groups(self.org_group_ids, self.start_date,
+                                                                       self.end_date, availability_source='live'))
+        with self.captureOnCommitCallbacks(execute=True):
+            engineer = Engineer.objects.get(employee_id="eng_id_1")
+            # Overlapping leaves of 5 business days each, and a leave crossing the start of the time range
+            Leave.objects.create(engineer=engineer, start_date=datetime.date(2025, 2, 3),
+                                 end_date=datetime.date(2025, 2, 7))
+            Leave.objects.create(engineer=engineer, start_date=datetime.date(2025, 2, 5),
+                                 end_date=datetime.date(2025, 2, 11))
+            Leave.objects.create(engineer=engineer, start_date=datetime.date(2024, 12, 30),
+                                 end_date=datetime.date(2025, 1, 3))
+
+        for from_date, to_date in [(self.start_date, self.end_date), (datetime.date(2025, 2, 4), self.end_date),
+                                   (datetime.date(2024, 12, 1), datetime.date(2025, 2, 28))]:
+            calendar_capacity_data = get_capacity_data_for_org_groups(self.org_group_ids, from_date, to_date,
+                                                                      availability_source='calendar')
+            self.assertEqual(get_capacity_data_for_org_groups(self.org_group_ids, from_date, to_date,
+                                                              availability_source='live'), calendar_capacity_data)
+            if from_date == self.start_date:
+                self.assertEqual(leave_count + 10, get_leave_count(calendar_capacity_data))
+
+        # Leaves crossing the time range are not reported as calendar differences
+        call_command('check_availability_calendar', '--from', '2024-12-01', '--to', '2025-02-28',
+                     stdout=StringIO())
+
+    def test_calendars_maintained_on_changes(self):
+        self.assertEqual([], check_availability_calendars())
+
+        # The calendars only hold the site holidays
+        days = list(EngineerAvailabilityCalendar.objects.order_by('id').values_list('days', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            leave = Leave.objects.filter(engineer__employee_id="eng_id_1").first()
+            leave.engineer = Engineer.objects.get(employee_id="eng_id_4")
+            leave.start_date = datetime.date(2024, 12, 30)
+            leave.save()
+        self.assertEqual(days, list(EngineerAvailabilityCalendar.objects.order_by('id').values_list('days', flat=True)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            site_holiday = SiteHoliday.objects.filter(site__name='ODC1').first()
+            site_holiday.site = Site.objects.get(name='ODC2')
+            site_holiday.save()
+            SiteHoliday.objects.filter(site__isnull=True).first().delete()
+        self.assertEqual([], check_availability_calendars())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            engineer = Engineer.objects.get(employee_id="eng_id_0")
+            engineer.site = None
+            engineer.save()
+            Site.objects.get(name='ODC2').delete()
+        self.assertEqual([], check_availability_calendars())
+
+    def test_capacity_versions_bumped_after_commit_and_calendar_refresh(self):
+        versions = get_org_capacity_versions(self.org_group_ids)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                SiteHoliday.objects.create(site=Site.objects.get(name='ODC1'), name="holiday",
+                                           date=datetime.date(2025, 2, 4))
+        # Capacity computed until the commit is cached under the versions being replaced
+        self.assertEqual(versions, get_org_capacity_versions(self.org_group_ids))
+
+        for callback in callbacks:
+            callback()
+            if get_org_capacity_versions(self.org_group_ids) != versions:
+                # Capacity computed under the new versions is read from the refreshed calendars
+                self.assertEqual([], check_availability_calendars())
+        self.assertNotEqual(versions, get_org_capacity_versions(self.org_group_ids))
+
+    def test_check_and_rebuild_calendars(self):
+        engineer = Engineer.objects.get(employee_id="eng_id_1")
+        EngineerAvailabilityCalendar.objects.filter(engineer=engineer, year=2025).update(days='0' * 365)
+        self.assertEqual([(engineer.id, 2025)], [mismatch[:2] for mismatch in check_availability_calendars()])
+
+        self.assertEqual((0, 1, 0), rebuild_availability_calendars())
+        self.assertEqual([], check_availability_calendars())
+
+
+class CapacityDataLoadTestCase(AvailabilityReceiversTestMixin, TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CapacityEngineTestCase.setUp(self)
+
+    def get_capacities(self, org_group_ids):
+        # The creation and update times of the imported records are the time of the import
+        capacity_data = get_capacity_data_for_org_groups(org_group_ids, self.start_date, self.end_date)
+        return {org_group_id: (org_capacity_data['total_capacity'],
+                               {employee_id: engineer_data['capacity']
+                                for employee_id, engineer_data in org_capacity_data['engineer_data'].items()})
+                for org_group_id, org_capacity_data in capacity_data.items()}
+
+    def test_capacity_data_exported_and_imported(self):
+        org_group_ids = self.root_org.get_transitive_sub_groups()
+        capacity_data = self.get_capacities(org_group_ids)
+
+        with tempfile.TemporaryDirectory() as data_folder:
+            export_results = save_data_to_folder(data_folder)
+            self.assertEqual(Leave.objects.count(), export_results['capacity.Leave']['records'])
+            Engineer.objects.all().delete()
+            SiteHoliday.objects.all().delete()
+            self.assertFalse(EngineerAvailabilityCalendar.objects.exists())
+
+            load_results = bulk_load_data_from_folder(data_folder)
+        self.assertEqual(Leave.objects.count(), load_results['capacity.Leave']['created'])
+        self.assertEqual(capacity_data, self.get_capacities(org_group_ids))
+        # The calendars are rebuilt after the bulk load
+        self.assertTrue(EngineerAvailabilityCalendar.objects.exists())
+        self.assertEqual([], check_availability_calendars())
+
+    def test_capacity_data_exported_as_parquet(self):
+        with tempfile.TemporaryDirectory() as data_folder:
+            save_data_to_parquet_folder(data_folder)
+            leaves = pq.read_table(data_folder + "/capacity/Leave.parquet")
+            participations = pq.read_table(data_folder + "/capacity/EngineerOrgGroupParticipation.parquet")
+        self.assertEqual(pa.date32(), leaves.schema.field('start_date').type)
+        self.assertEqual(pa.int64(), leaves.schema.field('engineer').type)
+        leave_columns = [leaves.column(name).to_pylist() for name in ('engineer', 'start_date', 'end_date')]
+        self.assertEqual(list(Leave.objects.order_by('id').values_list('engineer_id', 'start_date', 'end_date')),
+                         list(zip(*leave_columns)))
+        self.assertEqual(pa.float64(), participations.schema.field('capacity').type)
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .apiviews import get_org_capacity_for_time_range, get_engineer_capacity_for_time_range
+from .apiviews import get_org_capacity_for_time_range, get_engineer_capacity_for_time_range, \
+    get_capacity_cache_stats, aget_org_capacity_for_time_range
 from .views import CapacityAttachmentViewSet, EngineerViewSet, SiteHolidayViewSet, LeaveViewSet, \
     EngineerOrgGroupParticipationViewSet
 
@@ -20,4 +21,6 @@ urlpatterns = [
 
     path('api/capacity_view', get_org_capacity_for_time_range),
     path('api/engineer_capacity_view', get_engineer_capacity_for_time_range),
+    path('api/capacity_cache_stats', get_capacity_cache_stats),
+    path('api/async/capacity_view', aget_org_capacity_for_time_range),
 ]
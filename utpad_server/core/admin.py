@@ -7,9 +7,10 @@ from django.contrib.admin.filters import RelatedOnlyFieldListFilter
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
 from django.db.models import TextField
 from django.db.models.fields import NOT_PROVIDED
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver
 from django_ace import AceWidget
 from django_extensions.db.fields.json import JSONField
@@ -20,7 +21,7 @@ from rest_framework.authtoken.admin import TokenAdmin
 from rest_framework.authtoken.models import TokenProxy
 
 from .models import Attachment, Configuration, OrgGroup, get_database_name, Site, PythonCodeField, XMLField, \
-    GherkinField, HTMLField, LuaField
+    GherkinField, HTMLField, LuaField, configuration_service
 
 
 class CustomModelAdmin(MassEditMixin, ImportExportModelAdmin):
@@ -180,6 +181,11 @@ class CustomAdminSite(AdminSite):
 
         return app_list
 
+    def each_context(self, request):
+        # Picks up site name changes saved by the other worker processes, served from the configuration cache
+        self.reload_settings()
+        return super().each_context(request)
+
     def reload_settings(self, database_name=None):
         if database_name is None:
             database_name = "Utpad Team Management"
@@ -241,7 +247,14 @@ class ConfigurationAdmin(CustomModelAdmin):
 
 # noinspection PyUnusedLocal
 @receiver(post_save, sender=Configuration, dispatch_uid="update_admin_site_name")
+@receiver(post_delete, sender=Configuration, dispatch_uid="update_admin_site_name_on_delete")
 def update_admin_site_name(sender, instance, **kwargs):
+    # After the commit so that a rolled back change is never cached
+    transaction.on_commit(reload_configuration)
+
+
+def reload_configuration():
+    configuration_service.invalidate()
     site.reload_settings()
 
 
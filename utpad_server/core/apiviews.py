@@ -1,21 +1,26 @@
-import io
-import os
 import tempfile
 import time
 import zipfile
 
-import pandas as pd
-from django.http import FileResponse
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, StreamingHttpResponse, HttpResponse, JsonResponse
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-import utpad_server.settings
-from utpad_server.dataload import model_name_map, serializer_map, save_data_to_folder, load_data_from_folder
+from utpad_server.database_routers import replica_reads, iterate_with_replica_reads, aiterate_with_replica_reads
+from utpad_server.dataload import iterate_zip_data, zip_compression_methods, zip_compression_levels, \
+    write_data_to_excel, resolve_export_since, get_export_until, set_export_watermark, iterate_parquet_zip_data, \
+    aiterate_zip_data, aiterate_file_chunks, run_with_own_connection
+from utpad_server.metrics import render_request_metrics, render_database_pool_metrics, get_database_pool_stats
+from .jobs import create_data_import_job, get_data_import_progress, fail_stale_data_import_jobs
+from .models import DataImportJob
+from .views import IsSuperUser, get_api_user
 
 
 # noinspection PyTypeChecker
@@ -96,11 +101,43 @@ def get_user_profile_details(request):
     return Response(user_details)
 
 
+def get_zip_export_parameters(query_params):
+    """
+    Compression method, compression level and start time of a ZIP export from its query parameters. Raises
+    ValueError for unsupported values.
+    """
+    compression = query_params.get('compression', 'deflate')
+    if compression not in zip_compression_methods:
+        raise ValueError('Unsupported compression ' + compression)
+    compresslevel = query_params.get('level')
+    if compresslevel is not None:
+        try:
+            compresslevel = int(compresslevel)
+        except ValueError:
+            raise ValueError('Invalid compression level')
+        if compresslevel not in zip_compression_levels.get(compression, [compresslevel]):
+            raise ValueError('Unsupported compression level for ' + compression)
+    return compression, compresslevel, resolve_export_since(query_params.get('since'))
+
+
 class ExportZIPDataView(APIView):
     parser_classes = [MultiPartParser]
 
     @swagger_auto_schema(
-        operation_description="Export all application data as a ZIP file. Only accessible by superusers.",
+        operation_description="Export all application data as a ZIP file streamed while it is produced. Only "
+                              "accessible by superusers.",
+        manual_parameters=[
+            openapi.Parameter('compression', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              enum=list(zip_compression_methods.keys()),
+                              description='Compression method of the ZIP members, deflate by default'),
+            openapi.Parameter('level', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description='Compression level, 0 to 9 for deflate and 1 to 9 for bzip2'),
+            openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description='Only export the records changed and deleted since this ISO 8601 time, or '
+                                          'since the last export with "watermark" which then moves the watermark to '
+                                          'this export once it is fully sent. The end time of the export is '
+                                          'returned in the X-Export-Until header'),
+        ],
         responses={
             200: openapi.Response(
                 description="Data exported successfully.",
@@ -110,6 +147,7 @@ class ExportZIPDataView(APIView):
                     description='ZIP file containing exported data'
                 )
             ),
+            400: "Unsupported compression or level, or invalid since time",
             401: "Authentication Required",
             403: "Permission Denied",
             405: "Method Not Allowed"
@@ -125,19 +163,27 @@ class ExportZIPDataView(APIView):
         if not request.user.is_superuser:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        zip_path = os.path.join(utpad_server.settings.MEDIA_BASE_NAME, f'exported_data_{int(time.time())}.zip')
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            save_data_to_folder(temp_dir)
-
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, temp_dir)
-                        zipf.write(file_path, arcname)
-        response = FileResponse(open(zip_path, 'rb'), as_attachment=True, filename=os.path.basename(zip_path),
-                                content_type='application/zip')
+        try:
+            compression, compresslevel, since = get_zip_export_parameters(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Taken before querying, the records changed while the export is sent are exported again by the next export
+        # from the watermark
+        until = get_export_until()
+
+        def iterate_export_data():
+            yield from iterate_zip_data(zip_compression_methods[compression], compresslevel, since=since)
+            if request.query_params.get('since') == 'watermark':
+                set_export_watermark(until)
+
+        # Full exports are read from the replicas, incremental ones (and the first one by watermark) from the primary
+        # as a lagging replica would make the watermark skip the latest changes
+        export_data = iterate_export_data() if request.query_params.get('since') \
+            else iterate_with_replica_reads(iterate_export_data())
+        response = StreamingHttpResponse(export_data, content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="exported_data_{int(time.time())}.zip"'
+        response['X-Export-Until'] = until.isoformat()
         return response
 
 
@@ -145,7 +191,9 @@ class ImportZIPDataView(APIView):
     parser_classes = [MultiPartParser]
 
     @swagger_auto_schema(
-        operation_description="Import application data from an uploaded ZIP file. Only accessible by superusers.",
+        operation_description="Queue the import of application data from an uploaded ZIP file, the import runs in the "
+                              "background and its progress is available from the import job. Only accessible by "
+                              "superusers.",
         manual_parameters=[
             openapi.Parameter(
                 name='file',
@@ -153,19 +201,27 @@ class ImportZIPDataView(APIView):
                 type=openapi.TYPE_FILE,
                 description='ZIP file containing data to import',
                 required=True
+            ),
+            openapi.Parameter(
+                name='update_existing',
+                in_=openapi.IN_FORM,
+                type=openapi.TYPE_BOOLEAN,
+                description='Update the existing records with the same id instead of skipping them',
+                required=False
             )
         ],
         responses={
-            200: openapi.Response(
-                description="Data imported successfully.",
+            202: openapi.Response(
+                description="Data import queued.",
                 schema=openapi.Schema(
                     type=openapi.TYPE_OBJECT,
                     properties={
-                        'status': openapi.Schema(type=openapi.TYPE_STRING, description='Import status message')
+                        'job_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='Import job ID'),
+                        'status': openapi.Schema(type=openapi.TYPE_STRING, description='Import job status'),
                     }
                 )
             ),
-            400: "Bad Request - No file provided",
+            400: "Bad Request - No ZIP file provided",
             401: "Authentication Required",
             403: "Permission Denied",
             405: "Method Not Allowed"
@@ -185,19 +241,52 @@ class ImportZIPDataView(APIView):
             return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         uploaded_file = request.FILES['file']
+        if not zipfile.is_zipfile(uploaded_file):
+            return Response({'error': 'File provided is not a ZIP file'}, status=status.HTTP_400_BAD_REQUEST)
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            zip_path = os.path.join(temp_dir, 'imported_data.zip')
-            with open(zip_path, 'wb+') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
+        update_existing = str(request.data.get('update_existing', 'false')).lower() in ('true', '1', 'yes')
+        job = create_data_import_job(uploaded_file, request.user, update_existing)
+        return Response({'job_id': job.id, 'status': job.status}, status=status.HTTP_202_ACCEPTED)
 
-            with zipfile.ZipFile(zip_path, 'r') as zipf:
-                zipf.extractall(temp_dir)
 
-            load_data_from_folder(temp_dir)
+class DataImportJobView(APIView):
 
-        return Response({'status': 'Data imported successfully'})
+    @swagger_auto_schema(
+        operation_description="Get the status of a data import job with the records created, updated and skipped per "
+                              "model and the records that could not be imported. Only accessible by superusers.",
+        responses={
+            200: "Import job status returned",
+            401: "Authentication Required",
+            403: "Permission Denied",
+            404: "Import job not found",
+        }
+    )
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user or not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        if not request.user.is_superuser:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Jobs of a stopped process are reported failed
+        fail_stale_data_import_jobs()
+        try:
+            job = DataImportJob.objects.get(pk=job_id)
+        except DataImportJob.DoesNotExist:
+            return Response({'error': 'Import job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'job_id': job.id,
+            'file_name': job.file_name,
+            'status': job.status,
+            'update_existing': job.update_existing,
+            'progress': get_data_import_progress(job),
+            'errors': job.errors,
+            'error': job.error,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+        })
 
 
 @swagger_auto_schema(
@@ -228,24 +317,142 @@ def export_all_data_as_excel(request):
     if not request.user.is_superuser:
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-    excel_buffer = io.BytesIO()
-
-    # noinspection PyTypeChecker
-    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-        for app_label, models in model_name_map.items():
-            for model_name, model_class in models.items():
-                queryset = model_class.objects.all()
-                serializer_cls = serializer_map.get(model_class)
-                if serializer_cls:
-                    serializer = serializer_cls(queryset, many=True, expand_relation_as_object=False)
-                    df = pd.DataFrame(serializer.data)
-                    if not df.empty:
-                        df.to_excel(writer, sheet_name=f"{app_label}_{model_name}"[:31], index=False)
-
-    excel_buffer.seek(0)
+    # Written to an anonymous temporary file which is removed once the response closes it
+    excel_file = write_data_to_excel_file()
 
-    response = FileResponse(excel_buffer, as_attachment=True, filename='exported_data.xlsx',
+    response = FileResponse(excel_file, as_attachment=True, filename='exported_data.xlsx',
                             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     response['Content-Disposition'] = 'attachment; filename="exported_data.xlsx"'
 
     return response
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Export all application data as a ZIP file of a Parquet file per model, named "
+                          "<app>/<model>.parquet, streamed while it is produced. Only accessible by superusers.",
+    responses={
+        200: openapi.Response(
+            description="Data exported successfully.",
+            schema=openapi.Schema(
+                type=openapi.TYPE_FILE,
+                format='binary',
+                description='ZIP file containing the exported Parquet files'
+            )
+        ),
+        401: "Authentication Required",
+        403: "Permission Denied",
+        405: "Method Not Allowed"
+    }
+)
+@api_view(['GET'])
+def export_all_data_as_parquet(request):
+    if not request.method == 'GET':
+        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    if not request.user or not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if not request.user.is_superuser:
+        return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+    response = StreamingHttpResponse(iterate_with_replica_reads(iterate_parquet_zip_data()),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="exported_data_{int(time.time())}_parquet.zip"'
+    return response
+
+
+async def get_async_superuser_error_response(request):
+    # Errors of the async export views, REST framework checks the permissions of its own views
+    try:
+        user = await sync_to_async(get_api_user)(request)
+    except APIException as e:
+        return JsonResponse({'error': str(e.detail)}, status=e.status_code)
+    if not user or not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+    if not user.is_superuser:
+        return JsonResponse({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+    return None
+
+
+async def aexport_all_data_as_zip(request):
+    """
+    Async variant of ExportZIPDataView for the ASGI server, the models are serialized concurrently in worker threads
+    while the archive is streamed.
+    """
+    if not request.method == 'GET':
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    error_response = await get_async_superuser_error_response(request)
+    if error_response is not None:
+        return error_response
+
+    try:
+        compression, compresslevel, since = await sync_to_async(get_zip_export_parameters)(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Taken before querying as with ExportZIPDataView
+    until = get_export_until()
+
+    async def aiterate_export_data():
+        async for data in aiterate_zip_data(zip_compression_methods[compression], compresslevel, since=since):
+            yield data
+        if request.GET.get('since') == 'watermark':
+            await sync_to_async(set_export_watermark)(until)
+
+    # Full exports are read from the replicas, incremental ones from the primary as with ExportZIPDataView
+    export_data = aiterate_export_data() if request.GET.get('since') \
+        else aiterate_with_replica_reads(aiterate_export_data())
+    response = StreamingHttpResponse(export_data, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="exported_data_{int(time.time())}.zip"'
+    response['X-Export-Until'] = until.isoformat()
+    return response
+
+
+def write_data_to_excel_file():
+    excel_file = tempfile.TemporaryFile(prefix='utpad-export-', suffix='.xlsx')
+    try:
+        with replica_reads():
+            write_data_to_excel(excel_file)
+    except Exception:
+        excel_file.close()
+        raise
+    excel_file.seek(0)
+    return excel_file
+
+
+async def aexport_all_data_as_excel(request):
+    """
+    Async variant of export_all_data_as_excel for the ASGI server, the workbook is written in a worker thread and
+    streamed from its temporary file.
+    """
+    if not request.method == 'GET':
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    error_response = await get_async_superuser_error_response(request)
+    if error_response is not None:
+        return error_response
+
+    excel_file = await sync_to_async(run_with_own_connection, thread_sensitive=False)(write_data_to_excel_file)
+    response = StreamingHttpResponse(aiterate_file_chunks(excel_file),
+                                     content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response['Content-Disposition'] = 'attachment; filename="exported_data.xlsx"'
+    return response
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Get the wall time, SQL statements, SQL time and serializer time histograms of the requests "
+                          "by view and the database connection pool statistics of this server process in the "
+                          "Prometheus text format",
+    responses={
+        200: 'Request metrics returned',
+        403: 'Only super users can view the metrics',
+    }
+)
+@api_view(['GET'])
+@permission_classes((IsSuperUser,))
+def get_request_metrics(request):
+    return HttpResponse(render_request_metrics() + render_database_pool_metrics(get_database_pool_stats()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
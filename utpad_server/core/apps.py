@@ -1,4 +1,4 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 
 
 class CoreConfig(AppConfig):
@@ -6,3 +6,11 @@ class CoreConfig(AppConfig):
     name = 'core'
     order = 1
     verbose_name = 'Settings'
+
+    def ready(self):
+        # Register the database connection and pool checks
+        from . import checks  # noqa: F401
+
+        # Track the deletions of the exported models for the incremental exports
+        from .models import connect_incremental_export_receivers
+        connect_incremental_export_receivers(apps.get_models())
@@ -0,0 +1,350 @@
+import datetime
+import http.client
+import os
+import resource
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from datetime import timedelta
+from itertools import islice
+
+import pandas as pd
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from capacity.benchmarks import run_capacity_benchmark
+from capacity.models import Engineer, EngineerOrgGroupParticipation, SiteHoliday, Leave
+from execution.models import ProgramIncrement, Epic, Feature, Sprint, Story
+from utpad_server.dataload import model_file_names, serializer_map, write_data_to_excel, save_data_to_folder, \
+    bulk_load_data_from_folder
+from .models import OrgGroup, Site
+from .signals import data_loaded
+
+
+def save_data_to_excel_with_pandas(file_path):
+    """
+    The Excel export as it was before the streaming export, every model serialized at once into a pandas DataFrame.
+    Only kept as the reference of the Excel export benchmark.
+    """
+    with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
+        for model_class, (app_name, model_name) in model_file_names.items():
+            serializer = serializer_map[model_class](model_class.objects.all(), many=True,
+                                                     expand_relation_as_object=False)
+            df = pd.DataFrame(serializer.data)
+            if not df.empty:
+                df.to_excel(writer, sheet_name=(app_name + "_" + model_name)[:31], index=False)
+
+
+excel_exports = {
+    'streaming': write_data_to_excel,
+    'pandas': save_data_to_excel_with_pandas,
+}
+
+
+def get_peak_rss_kb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak_rss // 1024 if os.uname().sysname == 'Darwin' else peak_rss
+
+
+def run_excel_export_benchmark(export_names=('streaming', 'pandas')):
+    """
+    Time every Excel export and measure the peak of the Python allocations while it runs. The peak RSS of the
+    process only grows, so the RSS growth of an export is only accurate for the first export run, later exports
+    only report how far they went beyond the peak of the exports run before them.
+    """
+    results = []
+    for export_name in export_names:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, export_name + '.xlsx')
+            peak_rss_before = get_peak_rss_kb()
+            tracemalloc.start()
+            try:
+                start_time = time.perf_counter()
+                excel_exports[export_name](file_path)
+                export_time = time.perf_counter() - start_time
+                peak_allocated = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results.append({
+                'export': export_name,
+                'seconds': round(export_time, 4),
+                'peak_allocated_kb': peak_allocated // 1024,
+                'peak_rss_growth_kb': get_peak_rss_kb() - peak_rss_before,
+                'file_bytes': os.path.getsize(file_path),
+            })
+    return results
+
+
+# Sizes of the synthetic datasets of the benchmark suite, the org tree has fan_out sub groups per group over depth
+# levels and every user has leader, member, guest and consumer roles in different org groups
+benchmark_scales = {
+    'tiny': {'depth': 3, 'fan_out': 3, 'users': 50, 'sites': 3, 'stories': 1000, 'leaves': 1000},
+    'small': {'depth': 3, 'fan_out': 4, 'users': 200, 'sites': 5, 'stories': 10000, 'leaves': 10000},
+    'medium': {'depth': 4, 'fan_out': 5, 'users': 2000, 'sites': 10, 'stories': 100000, 'leaves': 100000},
+    'large': {'depth': 5, 'fan_out': 5, 'users': 10000, 'sites': 20, 'stories': 1000000, 'leaves': 1000000},
+}
+
+org_group_roles = ['leaders', 'members', 'guests', 'consumers']
+
+# Records created per bulk insert while building the datasets
+benchmark_batch_size = 5000
+
+benchmark_from_date = datetime.date(2025, 1, 1)
+benchmark_days = 365
+
+
+def bulk_create_in_batches(model_class, model_records):
+    model_records = iter(model_records)
+    while batch := list(islice(model_records, benchmark_batch_size)):
+        model_class.objects.bulk_create(batch)
+
+
+def build_org_tree(depth, fan_out):
+    """
+    Org groups of a tree with fan_out sub groups per org group and depth levels, root first and by level.
+    """
+    org_groups = [OrgGroup.objects.create(name="bench_org_0")]
+    level = org_groups
+    for _ in range(1, depth):
+        next_level = []
+        for parent_org_group in level:
+            for _ in range(fan_out):
+                next_level.append(OrgGroup.objects.create(name="bench_org_" + str(len(org_groups) + len(next_level)),
+                                                          org_group=parent_org_group))
+        org_groups.extend(next_level)
+        level = next_level
+    return org_groups
+
+
+def assign_org_group_roles(org_groups, users, users_per_role=2):
+    # Rotate the users over the roles so that every user has every kind of role in some org group
+    for role_index, role in enumerate(org_group_roles):
+        through = getattr(OrgGroup, role).through
+        bulk_create_in_batches(through, (
+            through(orggroup_id=org_group.id, user_id=users[(org_index * len(org_group_roles) * users_per_role +
+                                                             role_index * users_per_role + user_index) % len(users)].id)
+            for org_index, org_group in enumerate(org_groups) for user_index in range(users_per_role)))
+        # The first user, whose requests are benchmarked, holds every role in the org groups at the end of the tree
+        through.objects.bulk_create([through(orggroup_id=org_groups[-1 - role_index % len(org_groups)].id,
+                                             user_id=users[0].id)], ignore_conflicts=True)
+
+
+def build_benchmark_dataset(depth, fan_out, users, sites, stories, leaves):
+    """
+    Create the synthetic dataset of a benchmark scale. Returns the org groups, the users, and the records the
+    benchmarks read.
+    """
+    org_groups = build_org_tree(depth, fan_out)
+    bench_users = User.objects.bulk_create([User(username="bench_user_" + str(index), password='!')
+                                            for index in range(users)])
+    assign_org_group_roles(org_groups, bench_users)
+
+    site_records = Site.objects.bulk_create([Site(name="bench_site_" + str(index)) for index in range(sites)])
+    bulk_create_in_batches(SiteHoliday, (SiteHoliday(site=site, name="bench_holiday_" + str(day),
+                                                     date=benchmark_from_date + timedelta(days=day))
+                                         for site_index, site in enumerate(site_records)
+                                         for day in range(site_index % 7, benchmark_days, 17)))
+    engineers = Engineer.objects.bulk_create([Engineer(employee_id="bench_" + str(index), auth_user=user,
+                                                       site=site_records[index % sites],
+                                                       org_group=org_groups[index % len(org_groups)])
+                                              for index, user in enumerate(bench_users)])
+    EngineerOrgGroupParticipation.objects.bulk_create([
+        EngineerOrgGroupParticipation(engineer=engineer, org_group=org_groups[index % len(org_groups)],
+                                      capacity=1.0 if index % 4 else 0.5)
+        for index, engineer in enumerate(engineers)])
+    bulk_create_in_batches(Leave, (Leave(engineer=engineers[index % len(engineers)],
+                                         start_date=benchmark_from_date + timedelta(days=index * 7 % benchmark_days),
+                                         end_date=benchmark_from_date + timedelta(
+                                             days=min(index * 7 % benchmark_days + 2, benchmark_days - 1)),
+                                         published=True)
+                                   for index in range(leaves)))
+
+    program_increments = ProgramIncrement.objects.bulk_create([
+        ProgramIncrement(name="bench_pi_" + str(index), org_group=org_group)
+        for index, org_group in enumerate(org_groups)])
+    epics = Epic.objects.bulk_create([Epic(name="bench_epic_" + str(index), pi=pi, org_group=pi.org_group)
+                                      for index, pi in enumerate(program_increments)])
+    features = Feature.objects.bulk_create([Feature(name="bench_feature_" + str(index), epic=epic,
+                                                    org_group=epic.org_group) for index, epic in enumerate(epics)])
+    sprints = Sprint.objects.bulk_create([Sprint(name="bench_sprint_" + str(index), pi=pi, org_group=pi.org_group,
+                                                 start_date=benchmark_from_date,
+                                                 end_date=benchmark_from_date + timedelta(days=13))
+                                          for index, pi in enumerate(program_increments)])
+    bulk_create_in_batches(Story, (Story(name="bench_story_" + str(index), rank=index,
+                                         feature=features[index % len(features)],
+                                         sprint=sprints[index % len(sprints)],
+                                         org_group=features[index % len(features)].org_group,
+                                         published=index % 3 == 0, description="Story description " * 4)
+                                   for index in range(stories)))
+
+    # Rebuild what the bulk inserts skipped: org privilege caches, capacity caches and availability calendars (calendar
+    # availability source)
+    data_loaded.send(sender=None, models=[OrgGroup, Site, Engineer, EngineerOrgGroupParticipation, SiteHoliday,
+                                          Leave, Story])
+    return org_groups, bench_users, engineers
+
+
+def time_benchmark(function, repeat=3):
+    """
+    Median and minimum seconds of repeat runs of function with cold caches, and the queries of the first run.
+    """
+    run_seconds = []
+    query_count = 0
+    for run_index in range(repeat):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start_time = time.perf_counter()
+            function()
+            run_seconds.append(time.perf_counter() - start_time)
+        if run_index == 0:
+            query_count = len(context.captured_queries)
+    return {
+        'seconds': round(statistics.median(run_seconds), 4),
+        'min_seconds': round(min(run_seconds), 4),
+        'queries': query_count,
+    }
+
+
+def get_checked(client, url, data=None):
+    def get():
+        response = client.get(url, data)
+        if response.status_code != 200:
+            raise AssertionError(f"GET {url} returned {response.status_code}")
+        # Consume streamed responses so that their production is timed too
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    return get
+
+
+def run_benchmark_suite(org_groups, users, engineers, repeat=3):
+    """
+    Time the REST list and detail endpoints as a super user and as a user with org roles, both capacity endpoints,
+    the YAML export and import and the Excel export. Returns the results by benchmark name.
+    """
+    superuser = User.objects.create_superuser(username="bench_admin", password='!')
+    member = users[0]
+    # Users read the records through a group granting the view permissions
+    member.user_permissions.add(*Permission.objects.filter(codename__startswith='view_'))
+    member_org_group_ids = list(OrgGroup.members.through.objects.filter(user_id=member.id).values_list(
+        'orggroup_id', flat=True))
+    member_story = Story.objects.filter(org_group_id__in=member_org_group_ids).order_by('id').first()
+    member_leave = Leave.objects.filter(engineer__auth_user=member).order_by('id').first()
+    to_date = benchmark_from_date + timedelta(days=89)
+
+    endpoints = {
+        'org_groups_list': ('/api/org_groups/', None),
+        'org_groups_detail': ('/api/org_groups/' + str(member_org_group_ids[0]) + '/', None),
+        'stories_list': ('/execution/api/stories/', None),
+        'stories_list_cursor': ('/execution/api/stories/', {'pagination': 'cursor'}),
+        'stories_detail': ('/execution/api/stories/' + str(member_story.id) + '/', None),
+        'leaves_list': ('/capacity/api/leaves/', None),
+        'leaves_detail': ('/capacity/api/leaves/' + str(member_leave.id) + '/', None),
+        'capacity_view': ('/capacity/api/capacity_view', {'org_group': org_groups[0].id,
+                                                          'from': str(benchmark_from_date), 'to': str(to_date)}),
+        'engineer_capacity_view': ('/capacity/api/engineer_capacity_view', {
+            'engineer': engineers[0].id, 'from': str(benchmark_from_date), 'to': str(to_date)}),
+    }
+
+    results = {}
+    for user_kind, user in [('superuser', superuser), ('member', member)]:
+        client = APIClient()
+        client.force_authenticate(user)
+        for endpoint_name, (url, data) in endpoints.items():
+            results[endpoint_name + '_' + user_kind] = time_benchmark(get_checked(client, url, data), repeat)
+
+    results['capacity_compute'] = run_capacity_benchmark(org_groups[0], benchmark_from_date, to_date)
+
+    with tempfile.TemporaryDirectory() as data_folder:
+        results['yaml_export'] = time_benchmark(lambda: save_data_to_folder(data_folder), repeat)
+        results['yaml_import'] = time_benchmark(lambda: bulk_load_data_from_folder(data_folder, update_existing=True),
+                                                repeat)
+        results['excel_export'] = time_benchmark(lambda: write_data_to_excel(os.path.join(data_folder, 'data.xlsx')),
+                                                 repeat)
+    return results
+
+
+def get_percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def run_load_test(base_url, paths, concurrency=16, duration=10.0, headers=None, timeout=30.0):
+    """
+    Request the paths of the server at base_url in turn from concurrency threads, each over its own keep-alive
+    connection, for duration seconds. Returns the request rate, error count and latency percentiles in milliseconds.
+    """
+    url = urllib.parse.urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    base_path = url.path.rstrip('/')
+    request_headers = dict(headers or {})
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def get_response(client_connection, path):
+        client_connection.request('GET', path, headers=request_headers)
+        response = client_connection.getresponse()
+        response.read()
+        return response
+
+    def run_client(client_index):
+        client_connection = connection_class(url.netloc, timeout=timeout)
+        client_latencies = []
+        client_errors = []
+        request_index = client_index
+        try:
+            while time.perf_counter() < deadline:
+                path = paths[request_index % len(paths)]
+                request_index += 1
+                start_time = time.perf_counter()
+                try:
+                    try:
+                        response = get_response(client_connection, base_path + path)
+                    except http.client.RemoteDisconnected:
+                        # The server closed the idle keep-alive connection, retried like browsers do
+                        client_connection.close()
+                        response = get_response(client_connection, base_path + path)
+                    if response.status >= 400:
+                        client_errors.append(f"{path}: HTTP {response.status}")
+                    if response.will_close:
+                        client_connection.close()
+                except (OSError, http.client.HTTPException) as e:
+                    client_errors.append(f"{path}: {e}")
+                    client_connection.close()
+                client_latencies.append(time.perf_counter() - start_time)
+        finally:
+            client_connection.close()
+            with lock:
+                latencies.extend(client_latencies)
+                errors.extend(client_errors)
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=run_client, args=(client_index,)) for client_index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start_time
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'first_errors': errors[:5],
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1) if seconds else None,
+        'p50_ms': round(get_percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(get_percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'p99_ms': round(get_percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+    }
@@ -0,0 +1,103 @@
+import importlib.util
+
+from django.core.checks import Error, Warning, Tags, register
+from django.db import connections
+
+from utpad_server import settings
+
+postgresql_engine = 'django.db.backends.postgresql'
+local_memory_cache_backend = 'django.core.cache.backends.locmem.LocMemCache'
+# Backends culling a third of their entries once MAX_ENTRIES (300 by default) are cached
+culled_cache_backends = [local_memory_cache_backend, 'django.core.cache.backends.filebased.FileBasedCache',
+                         'django.core.cache.backends.db.DatabaseCache']
+# Entries below which the cached org privileges (per user) and capacity (per org group, time range and version) are
+# culled before they are reused
+min_cache_entries = 10000
+
+
+def get_database_settings_errors(alias, settings_dict, database_pool=None):
+    """
+    Problems of the persistent connection and pool settings of a database, found without connecting to it.
+    database_pool is the DATABASE_POOL setting applied to the PostgreSQL databases.
+    """
+    errors = []
+    pool_options = settings_dict.get('OPTIONS', {}).get('pool')
+    conn_max_age = settings_dict.get('CONN_MAX_AGE', 0)
+
+    if pool_options:
+        if settings_dict['ENGINE'] != postgresql_engine:
+            errors.append(Error(f"The connection pool of database {alias} needs PostgreSQL",
+                                hint="Remove OPTIONS.pool", id='core.E001'))
+        elif importlib.util.find_spec('psycopg') is None or importlib.util.find_spec('psycopg_pool') is None:
+            errors.append(Error(f"The connection pool of database {alias} needs psycopg 3 and psycopg_pool",
+                                hint="pip install psycopg[binary,pool]", id='core.E002'))
+        if conn_max_age != 0:
+            errors.append(Error(f"Database {alias} has both a connection pool and CONN_MAX_AGE {conn_max_age}",
+                                hint="Set CONN_MAX_AGE to 0, the pool keeps the connections", id='core.E003'))
+        if isinstance(pool_options, dict) and pool_options.get('max_size') is not None and \
+                pool_options['max_size'] < pool_options.get('min_size', 4):
+            errors.append(Error(f"The connection pool of database {alias} has max_size below min_size",
+                                id='core.E004'))
+    elif database_pool and settings_dict['ENGINE'] != postgresql_engine:
+        errors.append(Warning(f"DATABASE_POOL is ignored for the {settings_dict['ENGINE']} database {alias}",
+                              id='core.W002'))
+    elif settings_dict['ENGINE'] == postgresql_engine and conn_max_age == 0:
+        errors.append(Warning(f"Database {alias} opens a new connection for every request",
+                              hint="Set DATABASE_CONN_MAX_AGE or DATABASE_POOL", id='core.W001'))
+    return errors
+
+
+# noinspection PyUnusedLocal
+@register(Tags.database)
+def check_database_connection_settings(app_configs, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        errors.extend(get_database_settings_errors(alias, settings.DATABASES[alias], settings.DATABASE_POOL))
+    if settings.DATABASE_REPLICA_READS not in ('all', 'explicit'):
+        errors.append(Error(f"Unknown DATABASE_REPLICA_READS {settings.DATABASE_REPLICA_READS}",
+                            hint="Use all or explicit", id='core.E006'))
+    return errors
+
+
+def get_cache_settings_errors(cache_settings, server_workers):
+    """
+    Problems of the default cache of the production server run with server_workers processes (None for one per CPU).
+    """
+    errors = []
+    if cache_settings['BACKEND'] == local_memory_cache_backend and server_workers != 1:
+        errors.append(Error("The local memory cache is not shared by the worker processes of the production server, "
+                            "the cached org privileges and capacity are not invalidated in the other workers on "
+                            "changes", hint="Configure a CACHE shared by the processes (file based, database, redis "
+                                            "or memcached) in config.yaml, or set SERVER_WORKERS to 1",
+                            id='core.E007'))
+    max_entries = cache_settings.get('OPTIONS', {}).get('MAX_ENTRIES', 300)
+    if cache_settings['BACKEND'] in culled_cache_backends and max_entries < min_cache_entries:
+        errors.append(Warning(f"The cache culls its entries once {max_entries} are cached, below the org privileges "
+                              f"and capacity cached", hint=f"Set OPTIONS.MAX_ENTRIES of the CACHE to at least "
+                                                           f"{min_cache_entries}", id='core.W003'))
+    return errors
+
+
+# noinspection PyUnusedLocal
+@register(Tags.caches, deploy=True)
+def check_cache_settings(app_configs, **kwargs):
+    # A deployment check, run by runserver-prod.sh, the development server runs a single process
+    return get_cache_settings_errors(settings.CACHES['default'], settings.SERVER_WORKERS)
+
+
+# noinspection PyUnusedLocal
+@register(Tags.database)
+def check_database_connections(app_configs, databases=None, **kwargs):
+    """
+    Open a connection, through the pool if configured, and run a trivial query on every checked database. Run at
+    startup with manage.py check --database default.
+    """
+    errors = []
+    for alias in databases or []:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except Exception as e:
+            errors.append(Error(f"Could not query database {alias}: {e}", id='core.E005'))
+    return errors
@@ -0,0 +1,162 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from utpad_server import settings
+from utpad_server.dataload import bulk_load_data_from_zip, run_with_own_connection
+from .models import DataImportJob, DataImportJobStatus
+
+logger = logging.getLogger(__name__)
+
+# Imports run in a background thread of the process that received the upload, one at a time on the whole server as
+# every job is claimed against the queued and running jobs of all the processes (claim_data_import_job)
+data_import_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='data-import')
+
+# Progress of the imports running in this process by job id, updated after every batch
+data_import_progress = {}
+data_import_progress_lock = threading.Lock()
+
+active_data_import_statuses = [DataImportJobStatus.QUEUED, DataImportJobStatus.RUNNING]
+
+
+def get_data_import_progress(job):
+    with data_import_progress_lock:
+        live_progress = data_import_progress.get(job.id)
+        return dict(live_progress) if live_progress is not None else job.progress
+
+
+def remove_data_import_file(job):
+    if job.file_path and os.path.exists(job.file_path):
+        os.remove(job.file_path)
+
+
+def create_data_import_job(uploaded_file, user=None, update_existing=False):
+    """
+    Save the uploaded ZIP file outside the media folder and queue its import once the job is committed.
+    """
+    with tempfile.NamedTemporaryFile(prefix='utpad-import-', suffix='.zip', delete=False) as zip_file:
+        for chunk in uploaded_file.chunks():
+            zip_file.write(chunk)
+    job = DataImportJob.objects.create(user=user, file_name=uploaded_file.name, file_path=zip_file.name,
+                                       update_existing=update_existing, heartbeat_at=timezone.now())
+    transaction.on_commit(lambda: data_import_executor.submit(run_with_own_connection, run_data_import_job, job.id))
+    return job
+
+
+def fail_stale_data_import_jobs():
+    """
+    Fail the queued and running jobs without a heartbeat for DATA_IMPORT_STALE_TIMEOUT seconds, left by a process that
+    stopped, and remove their uploaded files. Returns the ids of the failed jobs.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.DATA_IMPORT_STALE_TIMEOUT)
+    failed_job_ids = []
+    for job in DataImportJob.objects.filter(Q(heartbeat_at__lt=stale_before) | Q(
+            heartbeat_at__isnull=True, created_at__lt=stale_before), status__in=active_data_import_statuses):
+        # Only failed if no heartbeat arrived meanwhile
+        if DataImportJob.objects.filter(pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at).update(
+                status=DataImportJobStatus.FAILED, finished_at=now,
+                error='The import stopped as the server process running it stopped'):
+            logger.warning(f"Failed import job {job.id} left {job.status.lower()} by a stopped process")
+            remove_data_import_file(job)
+            failed_job_ids.append(job.id)
+    return failed_job_ids
+
+
+def claim_data_import_job(job_id):
+    """
+    Start the queued job if it is the oldest queued job and no import runs in any process. The active jobs are
+    locked while they are checked so that two processes can not both start one. Returns the status of the job:
+    RUNNING once claimed, QUEUED to retry later, or the final status of a job failed meanwhile.
+    """
+    fail_stale_data_import_jobs()
+    with transaction.atomic():
+        active_jobs = list(DataImportJob.objects.select_for_update().filter(
+            status__in=active_data_import_statuses).order_by('id').values_list('id', 'status'))
+        if job_id not in [active_job_id for active_job_id, _ in active_jobs]:
+            return DataImportJob.objects.filter(pk=job_id).values_list('status', flat=True).first()
+        if any(status == DataImportJobStatus.RUNNING for _, status in active_jobs) or active_jobs[0][0] != job_id:
+            return DataImportJobStatus.QUEUED
+        now = timezone.now()
+        DataImportJob.objects.filter(pk=job_id).update(status=DataImportJobStatus.RUNNING, started_at=now,
+                                                       heartbeat_at=now)
+        return DataImportJobStatus.RUNNING
+
+
+def send_data_import_heartbeats(job_id, stopped):
+    while not stopped.wait(settings.DATA_IMPORT_HEARTBEAT_INTERVAL):
+        try:
+            DataImportJob.objects.filter(pk=job_id, status__in=active_data_import_statuses).update(
+                heartbeat_at=timezone.now())
+        except DatabaseError:
+            logger.exception(f"Could not save the heartbeat of import job {job_id}")
+
+
+@contextmanager
+def data_import_heartbeats(job_id):
+    # Sent from their own thread and connection, the import holds its connection in long transactions
+    stopped = threading.Event()
+    heartbeat_thread = threading.Thread(target=run_with_own_connection, name='data-import-heartbeat', daemon=True,
+                                        args=(send_data_import_heartbeats, job_id, stopped))
+    heartbeat_thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        heartbeat_thread.join()
+
+
+def run_data_import_job(job_id):
+    with data_import_heartbeats(job_id):
+        while True:
+            try:
+                status = claim_data_import_job(job_id)
+            except DatabaseError:
+                # Locked by the claim of another process on databases without row locks (SQLite)
+                logger.exception(f"Could not claim import job {job_id}")
+                status = DataImportJobStatus.QUEUED
+            if status != DataImportJobStatus.QUEUED:
+                break
+            # Another import runs, possibly in another process
+            time.sleep(settings.DATA_IMPORT_HEARTBEAT_INTERVAL)
+        if status == DataImportJobStatus.RUNNING:
+            load_data_import_job(DataImportJob.objects.get(pk=job_id))
+
+
+def load_data_import_job(job):
+    with data_import_progress_lock:
+        data_import_progress[job.id] = {}
+    errors = []
+
+    def progress(model_class, counts):
+        with data_import_progress_lock:
+            data_import_progress[job.id][model_class._meta.label] = dict(counts)
+            live_progress = dict(data_import_progress[job.id])
+        # Saved for the other processes once the model is committed, the job is not visible in the model transaction
+        if not connection.in_atomic_block:
+            DataImportJob.objects.filter(pk=job.id).update(progress=live_progress, errors=list(errors))
+
+    try:
+        job.progress = bulk_load_data_from_zip(job.file_path, job.update_existing, progress=progress, errors=errors)
+        job.status = DataImportJobStatus.SUCCEEDED
+    except Exception as e:
+        logger.exception(f"Import job {job.id} failed")
+        job.progress = get_data_import_progress(job)
+        job.status = DataImportJobStatus.FAILED
+        job.error = str(e)
+    finally:
+        job.errors = errors
+        job.finished_at = timezone.now()
+        job.save(update_fields=['progress', 'status', 'error', 'errors', 'finished_at'])
+        with data_import_progress_lock:
+            data_import_progress.pop(job.id, None)
+        remove_data_import_file(job)
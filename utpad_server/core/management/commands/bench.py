@@ -0,0 +1,42 @@
+import json
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection
+
+from core.benchmarks import benchmark_scales, build_benchmark_dataset, run_benchmark_suite
+
+
+class Command(BaseCommand):
+    help = 'Run the benchmark suite on synthetic datasets in a temporary test database and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', choices=list(benchmark_scales.keys()), default=['small'],
+                            help='Dataset scales to benchmark, from 1k (tiny) to 1M (large) stories and leaves')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of every benchmark, the median is reported')
+        parser.add_argument('--output', type=str, default=None,
+                            help='File to write the JSON results to, standard output by default')
+
+    def handle(self, *args, **options):
+        report = {'database': connection.vendor, 'repeat': options['repeat'], 'scales': {}}
+        for scale in options['scales']:
+            # Never touch the configured database, every scale is built in a new temporary test database
+            old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                start_time = time.perf_counter()
+                org_groups, users, engineers = build_benchmark_dataset(**benchmark_scales[scale])
+                dataset = dict(benchmark_scales[scale], org_groups=len(org_groups),
+                               build_seconds=round(time.perf_counter() - start_time, 2))
+                results = run_benchmark_suite(org_groups, users, engineers, options['repeat'])
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            report['scales'][scale] = {'dataset': dataset, 'results': results}
+
+        # Sorted keys so that the results of two commits can be diffed
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote the benchmark results to {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,40 @@
+import datetime
+import json
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from capacity.benchmarks import build_capacity_dataset
+from core.benchmarks import excel_exports, run_excel_export_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the streaming Excel export against the pandas export on synthetic data in a temporary test ' \
+           'database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engineers', type=int, nargs='+', default=[1000, 10000],
+                            help='Engineer counts to benchmark')
+        parser.add_argument('--org-groups', type=int, default=200, help='Number of org groups')
+        parser.add_argument('--sites', type=int, default=10, help='Number of sites')
+        parser.add_argument('--leaves-per-engineer', type=int, default=10, help='Leaves of every engineer')
+        parser.add_argument('--exports', nargs='+', choices=list(excel_exports.keys()),
+                            default=list(excel_exports.keys()),
+                            help='Exports to run, in order. The RSS growth is only exact for the first one')
+
+    def handle(self, *args, **options):
+        from_date = datetime.date(2025, 1, 1)
+
+        # Never touch the configured database, the data is created in a temporary test database
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for engineer_count in options['engineers']:
+                with transaction.atomic():
+                    build_capacity_dataset(options['org_groups'], engineer_count, options['sites'],
+                                           options['leaves_per_engineer'], from_date, 365)
+                    for result in run_excel_export_benchmark(options['exports']):
+                        result['engineers'] = engineer_count
+                        self.stdout.write(json.dumps(result))
+                    transaction.set_rollback(True)
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
@@ -0,0 +1,42 @@
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from utpad_server import settings
+
+org_permission_filters = ['exists', 'ids']
+
+
+class Command(BaseCommand):
+    help = 'Print the SQL and query plan of the list query of a model for a user with every org permission filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User whose readable records are listed')
+        parser.add_argument('--model', default='core.OrgGroup', help='Model label, e.g. execution.Story')
+        parser.add_argument('--filters', nargs='+', choices=org_permission_filters, default=org_permission_filters,
+                            help='Org permission filters to explain')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run the queries and show the actual plan (PostgreSQL EXPLAIN ANALYZE)')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+            model_class = apps.get_model(options['model'])
+        except (User.DoesNotExist, LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        if not hasattr(model_class, 'get_list_query_set'):
+            raise CommandError(f"{options['model']} has no list query set")
+
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        configured_filter = settings.ORG_PERMISSION_FILTER
+        try:
+            for permission_filter in options['filters']:
+                settings.ORG_PERMISSION_FILTER = permission_filter
+                queryset = model_class.get_list_query_set(model_class, user)
+                self.stdout.write(f"-- {permission_filter} ({connection.vendor}): {queryset.count()} records")
+                self.stdout.write(str(queryset.query))
+                self.stdout.write(queryset.explain(**explain_options))
+                self.stdout.write('')
+        finally:
+            settings.ORG_PERMISSION_FILTER = configured_filter
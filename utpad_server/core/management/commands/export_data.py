@@ -1,19 +1,62 @@
 from django.core.management import BaseCommand
 from django.db import IntegrityError
 
-from utpad_server.dataload import save_data_to_folder
+from utpad_server.database_routers import replica_reads
+
+from utpad_server.dataload import save_data_to_folder, export_chunk_size, resolve_export_since, set_export_watermark, \
+    save_data_to_parquet_folder, get_export_until
 
 
 class Command(BaseCommand):
-    help = 'Export data from database to YAML files'
+    help = 'Export data from database to YAML files, or Parquet files for analytics'
 
     def add_arguments(self, parser):
         parser.add_argument('data_folder', type=str, help='The folder where data will be exported')
+        parser.add_argument('--chunk-size', type=int, default=export_chunk_size, help='Records fetched at a time')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Models exported concurrently, 1 for SQLite and up to 4 otherwise by default')
+        parser.add_argument('--format', choices=['yaml', 'parquet'], default='yaml',
+                            help='Format of the files, a file per model in both cases')
+        parser.add_argument('--since', type=str, default=None,
+                            help='Only export the records changed and deleted since this ISO 8601 time, or since the '
+                                 'last export run with "watermark" which then moves the watermark to this export')
 
     def handle(self, *args, **options):
         data_folder = options['data_folder']
+        if options['format'] == 'parquet':
+            if options['since']:
+                self.stderr.write(self.style.ERROR('Incremental exports are only written as YAML files'))
+                return
+            with replica_reads():
+                export_results = save_data_to_parquet_folder(data_folder, options['chunk_size'], options['workers'])
+            for model_label, result in export_results.items():
+                self.stdout.write(f"{model_label}: {result['records']} records in {result['seconds']}s")
+            self.stdout.write(self.style.SUCCESS(f'Successfully exported data to {data_folder}'))
+            return
+
+        try:
+            since = resolve_export_since(options['since'])
+        except ValueError as e:
+            self.stderr.write(self.style.ERROR(str(e)))
+            return
+
+        # Taken before querying, the records changed while the export runs are exported again by the next export from
+        # the watermark
+        until = get_export_until()
         try:
-            save_data_to_folder(data_folder)
+            # Incremental exports (and the first one by watermark) are read from the primary as a lagging replica would
+            # make the watermark skip the latest changes
+            if not options['since']:
+                with replica_reads():
+                    export_results = save_data_to_folder(data_folder, options['chunk_size'], options['workers'])
+            else:
+                export_results = save_data_to_folder(data_folder, options['chunk_size'], options['workers'], since)
+            for model_label, result in export_results.items():
+                self.stdout.write(f"{model_label}: {result['records']} records in {result['seconds']}s")
+            if options['since'] == 'watermark':
+                set_export_watermark(until)
+            if since is not None:
+                self.stdout.write(f"Exported the changes from {since.isoformat()} to {until.isoformat()}")
             self.stdout.write(self.style.SUCCESS(f'Successfully exported data to {data_folder}'))
         except IntegrityError as e:
             self.stderr.write(self.style.ERROR(f'Error exporting data: {e}'))
@@ -1,6 +1,7 @@
 from django.core.management import BaseCommand
 from django.db import IntegrityError
 
+from utpad_server.database_routers import replica_reads
 from utpad_server.dataload import save_data_to_excel
 
 
@@ -13,7 +14,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         output_file = options['output_file']
         try:
-            save_data_to_excel(output_file)
+            with replica_reads():
+                save_data_to_excel(output_file)
             self.stdout.write(self.style.SUCCESS(f'Successfully exported data to {output_file}'))
         except IntegrityError as e:
             self.stderr.write(self.style.ERROR(f'IntegrityError: {str(e)}'))
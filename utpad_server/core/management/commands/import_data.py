@@ -1,7 +1,7 @@
 from django.core.management import BaseCommand
 from django.db import IntegrityError
 
-from utpad_server.dataload import load_data_from_folder
+from utpad_server.dataload import load_data_from_folder, bulk_load_data_from_folder, import_batch_size
 
 
 class Command(BaseCommand):
@@ -9,11 +9,28 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('data_folder', type=str, help='The folder where data files are located')
+        parser.add_argument('--update-existing', action='store_true',
+                            help='Update the existing records with the same id instead of skipping them, always '
+                                 'done for incremental exports')
+        parser.add_argument('--batch-size', type=int, default=import_batch_size,
+                            help='Records inserted at a time')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Models imported concurrently, 1 for SQLite and up to 4 otherwise by default')
+        parser.add_argument('--row-by-row', action='store_true',
+                            help='Create the records one at a time instead of the bulk import')
 
     def handle(self, *args, **options):
         data_folder = options['data_folder']
         try:
-            load_data_from_folder(data_folder)
+            if options['row_by_row']:
+                load_data_from_folder(data_folder)
+            else:
+                load_results = bulk_load_data_from_folder(data_folder, options['update_existing'],
+                                                          options['batch_size'], workers=options['workers'])
+                for model_label, result in load_results.items():
+                    deleted = f", {result['deleted']} deleted" if 'deleted' in result else ""
+                    self.stdout.write(f"{model_label}: {result['created']} created, {result['updated']} updated,"
+                                      f" {result['skipped']} skipped{deleted} in {result['seconds']}s")
             self.stdout.write(self.style.SUCCESS(f'Successfully imported data from {data_folder}'))
         except IntegrityError as e:
             self.stderr.write(self.style.ERROR(f'Error importing data: {e}'))
@@ -0,0 +1,33 @@
+import base64
+import json
+
+from django.core.management import BaseCommand
+
+from core.benchmarks import run_load_test
+
+
+class Command(BaseCommand):
+    help = 'Load test a running server, e.g. the development server against the production server (loadtest.sh)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server')
+        parser.add_argument('--paths', nargs='+', default=['/', '/static/logo.png', '/api/org_groups/'],
+                            help='Paths requested in turn by every client')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                            help='Numbers of concurrent clients to run the test with')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of every test')
+        parser.add_argument('--username', default=None, help='User sent with basic authentication')
+        parser.add_argument('--password', default=None, help='Password of the user')
+        parser.add_argument('--label', default=None, help='Name of the server in the results')
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['username']:
+            credentials = f"{options['username']}:{options['password'] or ''}".encode()
+            headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode()
+
+        for concurrency in options['concurrency']:
+            result = run_load_test(options['url'], options['paths'], concurrency, options['duration'], headers)
+            result['server'] = options['label'] or options['url']
+            result['concurrency'] = concurrency
+            self.stdout.write(json.dumps(result, sort_keys=True))
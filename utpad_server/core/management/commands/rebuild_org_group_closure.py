@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from core.models import OrgGroupClosure
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the org group ancestor/descendant closure table from the org group parent links'
+
+    def handle(self, *args, **options):
+        try:
+            link_count = OrgGroupClosure.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt org group closure with {link_count} links'))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'Error rebuilding org group closure: {str(e)}'))
@@ -0,0 +1,30 @@
+import sqlite3
+
+from django.core.management import BaseCommand, CommandError
+
+from utpad_server import settings
+
+sqlite_engine = 'django.db.backends.sqlite3'
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary database to the SQLite replicas of DATABASE_REPLICAS, to try the replica routing ' \
+           'locally. Run it again to replicate later changes.'
+
+    def handle(self, *args, **options):
+        primary_database = settings.DATABASES['default']
+        if primary_database['ENGINE'] != sqlite_engine:
+            raise CommandError('The primary database is not SQLite, replicate it with the database server')
+
+        replica_aliases = [alias for alias in settings.DATABASE_REPLICA_WEIGHTS
+                           if settings.DATABASES[alias]['ENGINE'] == sqlite_engine]
+        if not replica_aliases:
+            raise CommandError('No SQLite replica in DATABASE_REPLICAS')
+
+        with sqlite3.connect(primary_database['NAME']) as primary_connection:
+            for alias in replica_aliases:
+                replica_name = settings.DATABASES[alias]['NAME']
+                with sqlite3.connect(replica_name) as replica_connection:
+                    # Online backup, consistent even while the server writes to the primary
+                    primary_connection.backup(replica_connection)
+                self.stdout.write(self.style.SUCCESS(f'Copied the primary database to {alias} ({replica_name})'))
@@ -1,3 +1,14 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.string_utils import ensure_leading_trailing_slash
+
+from utpad_server import settings
+from utpad_server.database_routers import primary_pinned, primary_written
+from utpad_server.metrics import measure_request, record_request_metrics, log_slow_request
+
+
 class CustomCorsMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -15,3 +26,123 @@ class CustomCorsMiddleware:
         # the view is called.
 
         return response
+
+
+class RequestMetricsMiddleware:
+    """
+    Record the wall time, SQL statements and time and serializer time of every request in the histograms of its
+    view, exposed by /api/metrics, and log the requests slower than SLOW_REQUEST_THRESHOLD seconds.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_request_threshold = settings.SLOW_REQUEST_THRESHOLD
+        self.slow_request_logged_queries = settings.SLOW_REQUEST_LOGGED_QUERIES
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start_time = time.perf_counter()
+        with measure_request(self.slow_request_logged_queries) as measurement:
+            response = self.get_response(request)
+        self.record(request, time.perf_counter() - start_time, measurement)
+        return response
+
+    async def __acall__(self, request):
+        start_time = time.perf_counter()
+        with measure_request(self.slow_request_logged_queries) as measurement:
+            response = await self.get_response(request)
+        self.record(request, time.perf_counter() - start_time, measurement)
+        return response
+
+    def record(self, request, wall_seconds, measurement):
+        # Requests not matching any url are grouped together to keep the number of series bounded
+        view_name = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        record_request_metrics(view_name, request.method, wall_seconds, measurement)
+        if self.slow_request_threshold is not None and wall_seconds > self.slow_request_threshold:
+            log_slow_request(request, view_name, wall_seconds, measurement)
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Pin the reads of a request to the primary database when the request may write, and for DATABASE_REPLICA_STICKINESS
+    seconds after a request of the same client wrote, so that clients read their own writes despite the replica lag.
+    """
+
+    pin_cookie_name = 'utpad_read_primary'
+    write_methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.replicas_configured = bool(settings.DATABASE_REPLICA_WEIGHTS)
+        self.stickiness = settings.DATABASE_REPLICA_STICKINESS
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pinned_token, written_token = self.pin(request)
+        try:
+            return self.set_pin_cookie(self.get_response(request))
+        finally:
+            primary_pinned.reset(pinned_token)
+            primary_written.reset(written_token)
+
+    async def __acall__(self, request):
+        pinned_token, written_token = self.pin(request)
+        try:
+            return self.set_pin_cookie(await self.get_response(request))
+        finally:
+            primary_pinned.reset(pinned_token)
+            primary_written.reset(written_token)
+
+    def pin(self, request):
+        return (primary_pinned.set(request.method in self.write_methods or self.pin_cookie_name in request.COOKIES),
+                primary_written.set(False))
+
+    def set_pin_cookie(self, response):
+        if self.replicas_configured and self.stickiness and primary_written.get():
+            response.set_cookie(self.pin_cookie_name, '1', max_age=self.stickiness, httponly=True, samesite='Lax')
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise serving the collected static files, with their precompressed copies and cache headers, at every URL of
+    STATIC_URLS like the development server does.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        script_name = (settings.FORCE_SCRIPT_NAME or '').rstrip('/')
+        for static_url in settings.STATIC_URLS:
+            static_prefix = static_url[len(script_name):] if script_name and static_url.startswith(script_name) \
+                else static_url
+            static_prefix = ensure_leading_trailing_slash(static_prefix)
+            if self.static_root and static_prefix != self.static_prefix:
+                self.add_files(self.static_root, prefix=static_prefix)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        # Files are looked up in memory and opened on the event loop, only the other requests reach the views
+        static_file = self.find_file(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
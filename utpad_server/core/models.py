@@ -1,9 +1,20 @@
 from django.db import models
+import functools
+import threading
+import time
+
 from django.contrib.auth.models import Group, User
-from django.db import models
-from django.db.models import Q, TextField
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, TextField, Exists, OuterRef
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 
 from utpad_server import settings
+from .signals import data_loaded
 from .storage import CustomFileSystemStorage
 
 # Create your models here.
@@ -134,11 +145,103 @@ class Configuration(BaseModel):
         return str(self.name) + ": " + str(self.value)
 
 
+configuration_version_cache_key = 'configuration_version'
+
+
+def get_configuration_version():
+    configuration_version = cache.get(configuration_version_cache_key)
+    if configuration_version is None:
+        cache.add(configuration_version_cache_key, time.time_ns(), timeout=None)
+        configuration_version = cache.get(configuration_version_cache_key)
+    return configuration_version
+
+
+class ConfigurationService:
+    """
+    In-process copy of all Configuration rows by name, loaded with a single query. It is dropped on Configuration
+    changes in this process and, for the other worker processes, when the configuration version in the shared cache
+    changes, which is checked at most every check_interval seconds.
+    """
+
+    true_values = {'1', 'true', 'yes', 'on'}
+    false_values = {'0', 'false', 'no', 'off'}
+
+    def __init__(self, check_interval=None):
+        self.check_interval = settings.CONFIGURATION_CHECK_INTERVAL if check_interval is None else check_interval
+        self.values = None
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get_values(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.values is not None and now - self.checked_at < self.check_interval:
+                return self.values
+            version = get_configuration_version()
+            if self.values is None or version != self.version:
+                self.values = dict(Configuration.objects.values_list('name', 'value'))
+                self.version = version
+            self.checked_at = now
+            return self.values
+
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+        cache.set(configuration_version_cache_key, time.time_ns(), timeout=None)
+
+    def get(self, name, default=None):
+        return self.get_values().get(name, default)
+
+    def get_str(self, name, default=None):
+        value = self.get(name)
+        return default if value is None else value
+
+    def get_int(self, name, default=None):
+        value = self.get(name)
+        if value is None or value.strip() == '':
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError(f"Configuration {name} is not an integer: {value}")
+
+    def get_float(self, name, default=None):
+        value = self.get(name)
+        if value is None or value.strip() == '':
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            raise ValidationError(f"Configuration {name} is not a number: {value}")
+
+    def get_bool(self, name, default=None):
+        value = self.get(name)
+        if value is None or value.strip() == '':
+            return default
+        if value.strip().lower() in self.true_values:
+            return True
+        if value.strip().lower() in self.false_values:
+            return False
+        raise ValidationError(f"Configuration {name} is not a boolean: {value}")
+
+
+configuration_service = ConfigurationService()
+
+
+# noinspection PyUnusedLocal
+@receiver(data_loaded, dispatch_uid="invalidate_configuration_on_data_loaded")
+def invalidate_configuration_on_data_loaded(sender, models=(), **kwargs):
+    # Bulk loads skip the save signals handled by the admin site
+    if Configuration in models:
+        transaction.on_commit(configuration_service.invalidate)
+
+
 def get_database_name():
-    database_name_config = Configuration.objects.filter(name="site_name")
-    if database_name_config.count() > 0:
-        return database_name_config[0].value
-    return "Utpad Team Management"
+    return configuration_service.get_str("site_name", "Utpad Team Management")
+
+
+org_group_cycle_message = 'An organization group can not be its own parent or descendant.'
 
 
 # noinspection PyUnresolvedReferences
@@ -156,20 +259,16 @@ class OrgGroup(BaseModel):
     consumers = models.ManyToManyField(User, blank=True, related_name="org_groups_where_consumer")
 
     def is_owner(self, user):
-        return ((self.leaders is not None) and (user in self.leaders.all())) or (
-                (self.org_group is not None) and self.org_group.is_owner(user))
+        return user_has_org_role(user, self.id, 'leaders')
 
     def is_member(self, user):
-        return ((self.members is not None) and (user in self.members.all())) or (
-                (self.org_group is not None) and self.org_group.is_member(user))
+        return user_has_org_role(user, self.id, 'members')
 
     def is_guest(self, user):
-        return ((self.guests is not None) and (user in self.guests.all())) or (
-                (self.org_group is not None) and self.org_group.is_guest(user))
+        return user_has_org_role(user, self.id, 'guests')
 
     def is_consumer(self, user):
-        return ((self.consumers is not None) and (user in self.consumers.all())) or (
-                (self.org_group is not None) and self.org_group.is_consumer(user))
+        return user_has_org_role(user, self.id, 'consumers')
 
     def can_read(self, user):
         return (self.published and self.is_public) or self.is_consumer(user) or self.is_guest(user) or self.is_member(
@@ -182,11 +281,45 @@ class OrgGroup(BaseModel):
         return self.is_owner(user)
 
     def get_transitive_sub_groups(self):
-        transitive_sub_orgs = [self.id]
-        direct_sub_orgs = OrgGroup.objects.filter(Q(org_group__pk=self.id))
-        for direct_sub_org in direct_sub_orgs:
-            transitive_sub_orgs.extend(direct_sub_org.get_transitive_sub_groups())
-        return transitive_sub_orgs
+        return list(OrgGroupClosure.objects.filter(ancestor_id=self.id).order_by('depth', 'descendant_id')
+                    .values_list('descendant_id', flat=True))
+
+    def is_ancestor_of(self, org_group_id):
+        return OrgGroupClosure.objects.filter(ancestor_id=self.id, descendant_id=org_group_id).exists()
+
+    def creates_cycle(self, org_group_id):
+        # Whether org_group_id as the parent makes the org group its own parent or descendant
+        return self.id is not None and org_group_id is not None and self.is_ancestor_of(org_group_id)
+
+    def clean(self):
+        super().clean()
+        if self.creates_cycle(self.org_group_id):
+            raise ValidationError({'org_group': org_group_cycle_message})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # Look up the stored parent to know whether the closure table needs to be updated for a reparenting,
+            # locking the row so that concurrent saves of the org group are serialized
+            stored_parent_ids = list(OrgGroup.objects.select_for_update().filter(pk=self.pk).values_list(
+                'org_group_id', flat=True)) if self.pk is not None else []
+            if stored_parent_ids and stored_parent_ids[0] != self.org_group_id and self.org_group_id is not None:
+                # Lock the new parent and its ancestors too, a concurrent move closing a cycle with this one locks
+                # this org group or one of them and waits for the commit before checking for a cycle
+                list(OrgGroup.objects.select_for_update().filter(
+                    pk__in=OrgGroupClosure.objects.filter(descendant_id=self.org_group_id).values(
+                        'ancestor_id')).order_by('pk').values_list('pk', flat=True))
+
+            if not stored_parent_ids:
+                super().save(*args, **kwargs)
+                OrgGroupClosure.insert_node(self)
+            elif stored_parent_ids[0] != self.org_group_id:
+                # Validated by clean and the serializer, guards the closure table against other callers
+                if self.creates_cycle(self.org_group_id):
+                    raise IntegrityError(org_group_cycle_message)
+                super().save(*args, **kwargs)
+                OrgGroupClosure.move_subtree(self)
+            else:
+                super().save(*args, **kwargs)
 
     def get_list_query_set(self, user):
         user_id = user.id if user else None
@@ -199,6 +332,10 @@ class OrgGroup(BaseModel):
                 return self.objects.all()
             elif user.is_anonymous:
                 return self.objects.filter(Q(published='True') & Q(is_public='True')).distinct()
+            elif settings.ORG_PERMISSION_FILTER == 'exists':
+                return self.objects.filter(Q(published=True, is_public=True)
+                                           | (Q(published=True) & get_org_role_filter(user, ['consumers'], 'pk'))
+                                           | get_org_role_filter(user, ['leaders', 'members', 'guests'], 'pk'))
             else:
                 org_groups_where_read_privilege = user.get_orgs_with_view_privileges()
                 org_groups_where_consumer_privilege = user.get_orgs_with_consumer_privileges()
@@ -226,62 +363,229 @@ class OrgGroup(BaseModel):
             return self.objects.none()
 
 
+class OrgGroupClosure(models.Model):
+    """
+    Ancestor/descendant pairs of the org group tree including the (org, org, 0) self link, maintained by
+    OrgGroup.save and the pre_delete receiver below so that sub tree and privilege lookups are a single query.
+    """
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant', 'ancestor'])]
+
+    ancestor = models.ForeignKey(OrgGroup, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(OrgGroup, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.ancestor_id) + " -> " + str(self.descendant_id) + " at depth " + str(self.depth)
+
+    @classmethod
+    def insert_node(cls, org_group):
+        links = [cls(ancestor_id=org_group.id, descendant_id=org_group.id, depth=0)]
+        if org_group.org_group_id is not None:
+            for ancestor_id, depth in cls.objects.filter(descendant_id=org_group.org_group_id).values_list(
+                    'ancestor_id', 'depth'):
+                links.append(cls(ancestor_id=ancestor_id, descendant_id=org_group.id, depth=depth + 1))
+        cls.objects.bulk_create(links, ignore_conflicts=True)
+
+    @classmethod
+    def move_subtree(cls, org_group):
+        sub_tree = list(cls.objects.filter(ancestor_id=org_group.id).values_list('descendant_id', 'depth'))
+        if not sub_tree:
+            # Node created before the closure table existed, rebuild_org_group_closure fixes the whole tree
+            cls.insert_node(org_group)
+            return
+
+        sub_tree_ids = [descendant_id for descendant_id, _ in sub_tree]
+        cls.objects.filter(descendant_id__in=sub_tree_ids).exclude(ancestor_id__in=sub_tree_ids).delete()
+
+        if org_group.org_group_id is not None:
+            new_ancestors = cls.objects.filter(descendant_id=org_group.org_group_id).values_list('ancestor_id',
+                                                                                                 'depth')
+            cls.objects.bulk_create([cls(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                                         depth=ancestor_depth + 1 + descendant_depth)
+                                     for ancestor_id, ancestor_depth in new_ancestors
+                                     for descendant_id, descendant_depth in sub_tree], ignore_conflicts=True)
+
+    @classmethod
+    def detach_descendants(cls, org_group):
+        # Children of a deleted org group become roots (org_group is SET_NULL), so unlink them from its ancestors
+        ancestor_ids = cls.objects.filter(descendant_id=org_group.id).values_list('ancestor_id', flat=True)
+        cls.objects.filter(ancestor_id__in=list(ancestor_ids),
+                           descendant_id__in=list(cls.objects.filter(ancestor_id=org_group.id, depth__gt=0)
+                                                  .values_list('descendant_id', flat=True))).delete()
+
+    @classmethod
+    def rebuild(cls):
+        parent_ids = dict(OrgGroup.objects.values_list('id', 'org_group_id'))
+        links = []
+        for org_group_id in parent_ids:
+            ancestor_id, depth, visited = org_group_id, 0, set()
+            while ancestor_id is not None and ancestor_id not in visited:
+                visited.add(ancestor_id)
+                links.append(cls(ancestor_id=ancestor_id, descendant_id=org_group_id, depth=depth))
+                ancestor_id = parent_ids.get(ancestor_id)
+                depth += 1
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(links, batch_size=1000)
+        return len(links)
+
+
+# noinspection PyUnusedLocal
+@receiver(pre_delete, sender=OrgGroup, dispatch_uid="detach_org_group_closure")
+def detach_org_group_closure(sender, instance, **kwargs):
+    OrgGroupClosure.detach_descendants(instance)
+
+
 # Extend User model for org group based object permissions helper functions
 
-def get_orgs_with_delete_privileges(user):
-    org_id_where_owner = []
-    orgs_with_direct_owner_privileges = OrgGroup.objects.filter(Q(leaders__pk=user.id))
+org_group_roles = ['leaders', 'members', 'guests', 'consumers']
+org_acl_version_cache_key = 'org_acl_version'
 
-    for org_with_direct_owner_privileges in orgs_with_direct_owner_privileges:
-        transitive_sub_groups = org_with_direct_owner_privileges.get_transitive_sub_groups()
-        org_id_where_owner.extend(transitive_sub_groups)
 
-    return list(set(org_id_where_owner))
+def get_org_acl_version():
+    org_acl_version = cache.get(org_acl_version_cache_key)
+    if org_acl_version is None:
+        cache.add(org_acl_version_cache_key, time.time_ns(), timeout=None)
+        org_acl_version = cache.get(org_acl_version_cache_key)
+    return org_acl_version
 
 
-User.add_to_class('get_orgs_with_delete_privileges', get_orgs_with_delete_privileges)
+def bump_org_acl_version():
+    """
+    Invalidate the cached org privileges of every user, called whenever org group roles or the org tree change.
+    """
+    cache.set(org_acl_version_cache_key, time.time_ns(), timeout=None)
 
 
-def get_orgs_with_change_privileges(user):
-    org_id_where_member = user.get_orgs_with_delete_privileges()
-    orgs_with_direct_member_privileges = OrgGroup.objects.filter(Q(members__pk=user.id))
+def bump_org_acl_version_on_commit():
+    # A bump before the commit would let a concurrent request cache the privileges of the old rows under the new
+    # version, keeping a revoked role working until the cache entry expires
+    transaction.on_commit(bump_org_acl_version)
 
-    for org_with_direct_owner_privileges in orgs_with_direct_member_privileges:
-        transitive_sub_groups = org_with_direct_owner_privileges.get_transitive_sub_groups()
-        org_id_where_member.extend(transitive_sub_groups)
 
-    return list(set(org_id_where_member))
+def get_orgs_with_role_privileges_uncached(user):
+    """
+    Ids of org groups where the user has each role directly or through an ancestor org group, resolved with a
+    single query on the closure table.
+    """
+    role_annotations = {}
+    for role in org_group_roles:
+        role_field = OrgGroup._meta.get_field(role)
+        role_annotations['is_' + role] = Exists(role_field.remote_field.through.objects.filter(
+            **{role_field.m2m_field_name(): OuterRef('ancestor_id'), role_field.m2m_reverse_field_name(): user.id}))
 
+    any_role_filter = Q()
+    for role in org_group_roles:
+        any_role_filter |= Q(**{'is_' + role: True})
 
-User.add_to_class('get_orgs_with_change_privileges', get_orgs_with_change_privileges)
+    orgs_with_role_privileges = {role: set() for role in org_group_roles}
+    for link in OrgGroupClosure.objects.annotate(**role_annotations).filter(any_role_filter).values(
+            'descendant_id', *role_annotations.keys()):
+        for role in org_group_roles:
+            if link['is_' + role]:
+                orgs_with_role_privileges[role].add(link['descendant_id'])
+    return orgs_with_role_privileges
 
 
-def get_orgs_with_view_privileges(user):
-    org_id_where_guest = user.get_orgs_with_change_privileges()
-    orgs_with_direct_guest_privileges = OrgGroup.objects.filter(Q(guests__pk=user.id))
+def get_orgs_with_role_privileges(user):
+    """
+    Cached variant of get_orgs_with_role_privileges_uncached, entries are keyed by the org ACL version so that a
+    role or org tree change invalidates all of them at once.
+    """
+    cache_key = 'org_privileges:' + str(get_org_acl_version()) + ':' + str(user.id)
+    orgs_with_role_privileges = cache.get(cache_key)
+    if orgs_with_role_privileges is None:
+        orgs_with_role_privileges = get_orgs_with_role_privileges_uncached(user)
+        cache.set(cache_key, orgs_with_role_privileges, timeout=settings.ORG_PRIVILEGES_CACHE_TIMEOUT)
+    return orgs_with_role_privileges
+
+
+User.add_to_class('get_orgs_with_role_privileges', get_orgs_with_role_privileges)
+
+
+def user_has_org_role(user, org_group_id, role):
+    """
+    Check if the user holds the role on the org group or any of its ancestors using the cached privilege sets.
+    """
+    if user is None or not user.is_authenticated or org_group_id is None:
+        return False
+    return org_group_id in user.get_orgs_with_role_privileges()[role]
+
+
+def get_orgs_with_delete_privileges(user):
+    return list(user.get_orgs_with_role_privileges()['leaders'])
+
+
+User.add_to_class('get_orgs_with_delete_privileges', get_orgs_with_delete_privileges)
+
+
+def get_orgs_with_change_privileges(user):
+    orgs_with_role_privileges = user.get_orgs_with_role_privileges()
+    return list(orgs_with_role_privileges['leaders'] | orgs_with_role_privileges['members'])
+
+
+User.add_to_class('get_orgs_with_change_privileges', get_orgs_with_change_privileges)
 
-    for org_with_direct_owner_privileges in orgs_with_direct_guest_privileges:
-        transitive_sub_groups = org_with_direct_owner_privileges.get_transitive_sub_groups()
-        org_id_where_guest.extend(transitive_sub_groups)
 
-    return list(set(org_id_where_guest))
+def get_orgs_with_view_privileges(user):
+    orgs_with_role_privileges = user.get_orgs_with_role_privileges()
+    return list(orgs_with_role_privileges['leaders'] | orgs_with_role_privileges['members'] |
+                orgs_with_role_privileges['guests'])
 
 
 User.add_to_class('get_orgs_with_view_privileges', get_orgs_with_view_privileges)
 
 
 def get_orgs_with_consumer_privileges(user):
-    org_id_where_consumer = []
-    orgs_with_direct_consumer_privileges = OrgGroup.objects.filter(Q(consumers__pk=user.id))
+    return list(user.get_orgs_with_role_privileges()['consumers'])
+
 
-    for org_with_direct_owner_privileges in orgs_with_direct_consumer_privileges:
-        transitive_sub_groups = org_with_direct_owner_privileges.get_transitive_sub_groups()
-        org_id_where_consumer.extend(transitive_sub_groups)
+User.add_to_class('get_orgs_with_consumer_privileges', get_orgs_with_consumer_privileges)
 
-    return list(set(org_id_where_consumer))
 
+def get_org_role_filter(user, roles, org_group_field):
+    """
+    Condition on the org group id column org_group_field of the queried model matching the org groups where the user
+    holds one of the roles directly or through an ancestor. It is a correlated EXISTS on the closure and role tables,
+    resolved with their indexes, so the query needs neither a list of org ids nor DISTINCT.
+    """
+    role_filter = Q()
+    for role in roles:
+        role_field = OrgGroup._meta.get_field(role)
+        role_filter |= Exists(role_field.remote_field.through.objects.filter(
+            **{role_field.m2m_field_name(): OuterRef('ancestor_id'), role_field.m2m_reverse_field_name(): user.id}))
+    return Exists(OrgGroupClosure.objects.filter(role_filter, descendant_id=OuterRef(org_group_field)))
 
-User.add_to_class('get_orgs_with_consumer_privileges', get_orgs_with_consumer_privileges)
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=OrgGroup, dispatch_uid="org_group_saved_bump_org_acl_version")
+@receiver(post_delete, sender=OrgGroup, dispatch_uid="org_group_deleted_bump_org_acl_version")
+@receiver(post_delete, sender=User, dispatch_uid="user_deleted_bump_org_acl_version")
+def org_tree_changed(sender, **kwargs):
+    bump_org_acl_version_on_commit()
+
+
+# noinspection PyUnusedLocal
+def org_group_roles_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_org_acl_version_on_commit()
+
+
+for org_group_role in org_group_roles:
+    m2m_changed.connect(org_group_roles_changed, sender=getattr(OrgGroup, org_group_role).through,
+                        dispatch_uid="org_group_" + org_group_role + "_changed_bump_org_acl_version")
+
+
+# noinspection PyUnusedLocal
+@receiver(data_loaded, dispatch_uid="org_groups_loaded_rebuild_org_group_closure")
+def org_groups_loaded(sender, models=(), **kwargs):
+    if OrgGroup in models:
+        OrgGroupClosure.rebuild()
+    bump_org_acl_version_on_commit()
 
 
 # noinspection PyUnresolvedReferences
@@ -294,31 +598,31 @@ class OrgModel(BaseModel):
 
     def is_owner(self, user):
         return (
-                (self.org_group is None) or
-                self.org_group.is_owner(user)
+                (self.org_group_id is None) or
+                user_has_org_role(user, self.org_group_id, 'leaders')
         )
 
     def is_member(self, user):
         return (
-                (self.org_group is None) or
-                self.org_group.is_member(user)
+                (self.org_group_id is None) or
+                user_has_org_role(user, self.org_group_id, 'members')
         )
 
     def is_guest(self, user):
         return (
-                (self.org_group is None) or
-                self.org_group.is_guest(user)
+                (self.org_group_id is None) or
+                user_has_org_role(user, self.org_group_id, 'guests')
         )
 
     def is_consumer(self, user):
         return (
-                (self.org_group is None) or
-                self.org_group.is_consumer(user)
+                (self.org_group_id is None) or
+                user_has_org_role(user, self.org_group_id, 'consumers')
         )
 
     def can_read(self, user):
         return (
-                (self.org_group is None) or
+                (self.org_group_id is None) or
                 self.is_owner(user) or
                 self.is_member(user) or
                 self.is_guest(user) or
@@ -328,14 +632,14 @@ class OrgModel(BaseModel):
 
     def can_modify(self, user):
         return (
-                (self.org_group is None)
+                (self.org_group_id is None)
                 or self.is_owner(user)
                 or self.is_member(user)
         )
 
     def can_delete(self, user):
         return (
-                (self.org_group is None) or
+                (self.org_group_id is None) or
                 self.is_owner(user)
         )
 
@@ -349,6 +653,11 @@ class OrgModel(BaseModel):
             elif user.is_anonymous:
                 return self.objects.filter(
                     Q(published='True') & (Q(is_public='True') | Q(org_group__isnull=True))).distinct()
+            elif settings.ORG_PERMISSION_FILTER == 'exists':
+                return self.objects.filter(Q(org_group__isnull=True)
+                                           | Q(published=True, is_public=True)
+                                           | (Q(published=True) & get_org_role_filter(user, ['consumers'], 'org_group'))
+                                           | get_org_role_filter(user, ['leaders', 'members', 'guests'], 'org_group'))
             else:
                 org_groups_where_read_privilege = user.get_orgs_with_view_privileges()
                 org_groups_where_consumer_privilege = user.get_orgs_with_consumer_privileges()
@@ -384,10 +693,10 @@ class NotMutablePublishOrgModel(OrgModel):
         abstract = True
 
     def can_modify(self, user):
-        return (self.org_group is None) or (not self.published and (self.is_owner(user) or self.is_member(user)))
+        return (self.org_group_id is None) or (not self.published and (self.is_owner(user) or self.is_member(user)))
 
     def can_delete(self, user):
-        return (self.org_group is None) or (not self.published and self.is_owner(user))
+        return (self.org_group_id is None) or (not self.published and self.is_owner(user))
 
 
 class Attachment(OrgModel):
@@ -422,6 +731,121 @@ class LuaField(TextField):
     pass
 
 
+class DataImportJobStatus(models.TextChoices):
+    QUEUED = 'QUEUED', _('Queued'),
+    RUNNING = 'RUNNING', _('Running'),
+    SUCCEEDED = 'SUCCEEDED', _('Succeeded'),
+    FAILED = 'FAILED', _('Failed'),
+
+
+class DataImportJob(models.Model):
+    """
+    Import of an uploaded data ZIP file run in the background, with the counts of the records loaded per model label
+    as progress and the records that could not be loaded as errors.
+    """
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name="data_import_jobs")
+    file_name = models.CharField(max_length=256, null=True, blank=True)
+    # Uploaded file kept outside the media folder until the import finishes
+    file_path = models.CharField(max_length=1024, null=True, blank=True)
+    update_existing = models.BooleanField(default=False)
+    status = models.CharField(max_length=9, choices=DataImportJobStatus.choices, default=DataImportJobStatus.QUEUED)
+    progress = models.JSONField(default=dict, blank=True)
+    errors = models.JSONField(default=list, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Updated by the process of a queued or running job, which is failed once it is older than
+    # DATA_IMPORT_STALE_TIMEOUT
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "Import of " + str(self.file_name) + " - " + str(self.status)
+
+
+class DeletedRecord(models.Model):
+    """
+    Tombstone of a deleted record of an exported model, carried by the incremental exports so that the deletion is
+    applied by their import.
+    """
+    model_label = models.CharField(max_length=128)
+    record_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return str(self.model_label) + " " + str(self.record_id) + " deleted at " + str(self.deleted_at)
+
+
+def is_exported_model(model_class):
+    return issubclass(model_class, BaseModel) or model_class in (User, Group)
+
+
+# noinspection PyUnusedLocal
+def record_deleted_record(sender, instance, **kwargs):
+    if instance.pk is not None:
+        DeletedRecord.objects.create(model_label=sender._meta.label, record_id=instance.pk)
+
+
+def get_linked_ids(through, instance, model):
+    # Ids of the model records linked to instance through the many to many table
+    source_field = next(field for field in through._meta.concrete_fields
+                        if field.is_relation and field.related_model is model)
+    target_field = next(field for field in through._meta.concrete_fields
+                        if field.is_relation and field.related_model is type(instance) and field is not source_field)
+    return set(through.objects.filter(**{target_field.attname: instance.pk}).values_list(source_field.attname,
+                                                                                         flat=True))
+
+
+# noinspection PyUnusedLocal
+@receiver(m2m_changed, dispatch_uid="touch_updated_at_on_m2m_changed")
+def touch_updated_at_on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # Changing a many to many relation does not save its records, their updated_at is moved for incremental exports
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, BaseModel):
+            type(instance).objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    elif issubclass(model, BaseModel):
+        if action == 'pre_clear':
+            instance._cleared_linked_ids = get_linked_ids(sender, instance, model)
+        elif action in ('post_add', 'post_remove', 'post_clear'):
+            linked_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_linked_ids', None)
+            if linked_ids:
+                model.objects.filter(pk__in=linked_ids).update(updated_at=timezone.now())
+
+
+# noinspection PyProtectedMember
+def get_set_null_relations(model_class):
+    # Relations of the exported models (with updated_at) to model_class nulled by its deletions
+    return [related_object for related_object in model_class._meta.related_objects
+            if related_object.on_delete is models.SET_NULL and issubclass(related_object.related_model, BaseModel)]
+
+
+# noinspection PyUnusedLocal,PyProtectedMember
+def touch_updated_at_on_set_null(sender, instance, set_null_relations=(), **kwargs):
+    # The foreign keys nulled by a deletion (SET_NULL) are updated without saving their records, their updated_at is
+    # moved for incremental exports before the deletion nulls them
+    for related_object in set_null_relations:
+        related_object.related_model._base_manager.filter(**{related_object.field.name: instance}).update(
+            updated_at=timezone.now())
+
+
+# noinspection PyProtectedMember
+def connect_incremental_export_receivers(model_classes):
+    """
+    Connect the receivers keeping the incremental exports complete to the exported models, and to the models with
+    exported relations nulled by their deletion. The deletions of the other models (e.g. the closure rows and the
+    tombstones) are left without them.
+    """
+    for model_class in model_classes:
+        if is_exported_model(model_class):
+            post_delete.connect(record_deleted_record, sender=model_class,
+                                dispatch_uid="record_deleted_record_" + model_class._meta.label)
+        set_null_relations = get_set_null_relations(model_class)
+        if set_null_relations:
+            pre_delete.connect(functools.partial(touch_updated_at_on_set_null, set_null_relations=set_null_relations),
+                               sender=model_class, weak=False,
+                               dispatch_uid="touch_updated_at_on_set_null_" + model_class._meta.label)
+
+
 model_name_map = {
     # User and Group modeles are directly mapped in the data_loader
     'Configuration': Configuration,
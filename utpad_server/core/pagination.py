@@ -1,4 +1,96 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator as DjangoPaginator, Page as DjangoPage, EmptyPage, PageNotAnInteger
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError as RequestValidationError
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+count_query_param = "count"
+# Largest count computed by the approximate count on databases without row estimates
+approximate_count_limit = 10000
+
+
+def get_approximate_count(queryset):
+    """
+    Estimated row count of the queryset, from the query planner on PostgreSQL, otherwise a count capped at
+    approximate_count_limit so that the cost does not grow with the table size.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        query_plan = json.loads(queryset.explain(format='json'))
+        return int(query_plan[0]['Plan']['Plan Rows'])
+    return queryset[:approximate_count_limit].count()
+
+
+def get_count_mode(request):
+    # exact (default), approximate or none
+    count_mode = request.query_params.get(count_query_param, 'exact').lower()
+    if count_mode in ('false', 'none', 'skip'):
+        return 'none'
+    return 'approximate' if count_mode == 'approximate' else 'exact'
+
+
+class ApproximateCountPage(DjangoPage):
+    """
+    Page of the ApproximateCountPaginator, whether a next page exists is known from the rows fetched rather than
+    from the count.
+    """
+
+    def __init__(self, object_list, number, paginator, has_next_page):
+        super().__init__(object_list, number, paginator)
+        self.has_next_page = has_next_page
+
+    def has_next(self):
+        return self.has_next_page
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class ApproximateCountPaginator(DjangoPaginator):
+    """
+    Paginator reporting an approximate count, which is never used to validate the page numbers as it can be below
+    the real count: a page is any page with rows, a page size plus one rows are fetched to tell whether a next page
+    follows.
+    """
+
+    @cached_property
+    def count(self):
+        return get_approximate_count(self.object_list)
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not object_list and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        return ApproximateCountPage(object_list[:self.per_page], number, self, len(object_list) > self.per_page)
+
+
+class NoCountPaginator(ApproximateCountPaginator):
+    """
+    Paginator of the pages without a count, the pages known are the ones up to the page fetched and the page after it.
+    """
+    count = None
+
+    def page(self, number):
+        page = super().page(number)
+        self.num_pages = page.next_page_number() if page.has_next() else page.number
+        return page
 
 
 class PageNumberPaginationExtn(PageNumberPagination):
@@ -7,6 +99,20 @@ class PageNumberPaginationExtn(PageNumberPagination):
     page_query_param = "page"
     page_size_query_param = "page_size"
 
+    def paginate_queryset(self, queryset, request, view=None):
+        count_mode = get_count_mode(request)
+        if count_mode == 'approximate':
+            self.django_paginator_class = ApproximateCountPaginator
+        elif count_mode == 'none':
+            self.django_paginator_class = NoCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page_number(self, request, paginator):
+        if isinstance(paginator, NoCountPaginator) and \
+                request.query_params.get(self.page_query_param) in self.last_page_strings:
+            raise NotFound('The last page is not known without a count')
+        return super().get_page_number(request, paginator)
+
     # def get_paginated_response(self, data):
     #     return Response({
     #         'content': data,
@@ -15,3 +121,139 @@ class PageNumberPaginationExtn(PageNumberPagination):
     #             'prev': self.get_previous_link(),
     #         }
     #     })
+
+
+class KeysetPaginationExtn(BasePagination):
+    """
+    Forward only cursor pagination keyed on (ordering field, id) so that every page is an indexed range scan
+    instead of an OFFSET. The ordering field is the first ordering of the queryset, null values are placed last.
+    Orderings on related lookups, many to many fields or expressions are rejected with a 400.
+    """
+    max_page_size = 1000
+    page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+
+    def __init__(self):
+        self.request = None
+        self.count = None
+        self.next_position = None
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    # noinspection PyProtectedMember
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        if not ordering:
+            return queryset.model._meta.pk.attname, False
+        if isinstance(ordering[0], str):
+            field_name = ordering[0].lstrip('-')
+            try:
+                model_field = queryset.model._meta.pk if field_name == 'pk' else queryset.model._meta.get_field(
+                    field_name)
+                if model_field.concrete and not model_field.many_to_many:
+                    return model_field.attname, ordering[0].startswith('-')
+            except FieldDoesNotExist:
+                pass
+        raise RequestValidationError({'ordering': 'Ordering ' + str(ordering[0]) +
+                                                  ' is not supported with cursor pagination, order by a field of the'
+                                                  ' model'})
+
+    def encode_cursor(self, value, pk):
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        elif value is not None and not isinstance(value, (int, float, str, bool)):
+            value = str(value)
+        return base64.urlsafe_b64encode(json.dumps([value, pk]).encode('utf-8')).decode('ascii')
+
+    # noinspection PyProtectedMember
+    def decode_cursor(self, request, model, field_name):
+        encoded_cursor = request.query_params.get(self.cursor_query_param)
+        if not encoded_cursor:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded_cursor.encode('ascii')).decode('utf-8'))
+            # Converted as the fields would, a cursor of other types would fail in the query
+            model_field = next(model_field for model_field in model._meta.concrete_fields
+                               if model_field.attname == field_name)
+            if value is not None:
+                value = model_field.to_python(value)
+            pk = model._meta.pk.to_python(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound('Invalid cursor')
+        if pk is None:
+            raise NotFound('Invalid cursor')
+        return value, pk
+
+    @staticmethod
+    def get_keyset_filter(field_name, descending, value, pk):
+        after_lookup = '__lt' if descending else '__gt'
+        if value is None:
+            return Q(**{field_name + '__isnull': True, 'pk' + after_lookup: pk})
+        return (Q(**{field_name + after_lookup: value}) |
+                Q(**{field_name: value, 'pk' + after_lookup: pk}) |
+                Q(**{field_name + '__isnull': True}))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        field_name, descending = self.get_ordering(queryset)
+        if descending:
+            queryset = queryset.order_by(F(field_name).desc(nulls_last=True), '-pk')
+        else:
+            queryset = queryset.order_by(F(field_name).asc(nulls_last=True), 'pk')
+
+        count_mode = get_count_mode(request)
+        if count_mode == 'exact':
+            self.count = queryset.count()
+        elif count_mode == 'approximate':
+            self.count = get_approximate_count(queryset)
+
+        cursor = self.decode_cursor(request, queryset.model, field_name)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(field_name, descending, *cursor))
+
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = (getattr(results[-1], field_name), results[-1].pk)
+        return results
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.encode_cursor(*self.next_position))
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('first', self.get_first_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,24 +1,110 @@
 from django.contrib.auth.models import User, Group
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.relations import PrimaryKeyRelatedField, ManyRelatedField
 
-from .models import Attachment, OrgGroup, Configuration, Site, base_model_base_fields, org_model_base_fields
+from utpad_server.metrics import measure_serialization
+from .models import Attachment, OrgGroup, Configuration, Site, base_model_base_fields, org_model_base_fields, \
+    org_group_cycle_message
 
 
 class ServerModelSerializer(serializers.ModelSerializer):
 
     def __init__(self, *args, **kwargs):
         self.expand_relation_as_object = kwargs.pop('expand_relation_as_object', True)
+        # Names of the relations to expand as objects when expand_relation_as_object is set, None expands all
+        self.expand_fields = kwargs.pop('expand_fields', None)
+        # Sparse fieldset, only the given fields or all but the excluded fields are serialized
+        included_fields = kwargs.pop('fields', None)
+        excluded_fields = kwargs.pop('exclude', None)
         super().__init__(*args, **kwargs)
 
+        if included_fields is not None or excluded_fields is not None:
+            for field_name in list(self.fields.keys()):
+                if field_name not in self.get_serialized_field_names(included_fields, excluded_fields):
+                    self.fields.pop(field_name)
+
+    @classmethod
+    def get_serialized_field_names(cls, included_fields=None, excluded_fields=None):
+        return [field_name for field_name in cls.Meta.fields
+                if (included_fields is None or field_name in included_fields)
+                and (excluded_fields is None or field_name not in excluded_fields)]
+
+    # noinspection PyProtectedMember
+    @classmethod
+    def get_related_field_names(cls, field_names=None):
+        """
+        Split the relation fields among the serializer fields into the ones to be loaded with select_related
+        (forward foreign key and one to one) and the ones to be loaded with prefetch_related (many to many).
+        """
+        model = cls.Meta.model
+        select_related_fields = []
+        prefetch_related_fields = []
+        for field_name in (cls.Meta.fields if field_names is None else field_names):
+            try:
+                model_field = model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                continue
+            if model_field.many_to_many:
+                prefetch_related_fields.append(field_name)
+            elif model_field.concrete and (model_field.many_to_one or model_field.one_to_one):
+                select_related_fields.append(field_name)
+        return select_related_fields, prefetch_related_fields
+
+    # noinspection PyProtectedMember
+    @classmethod
+    def optimize_queryset(cls, queryset, expand_relation_as_object=True, expand_fields=None, included_fields=None,
+                          excluded_fields=None, required_fields=None):
+        """
+        Load the relations serialized by this serializer along with the queryset to avoid a query per row.
+        Foreign keys are only joined when they are expanded as objects, their ids are available on the row itself.
+        For sparse fieldsets the columns of the fields not serialized are deferred except the required_fields.
+        """
+        field_names = cls.get_serialized_field_names(included_fields, excluded_fields)
+        select_related_fields, prefetch_related_fields = cls.get_related_field_names(field_names)
+
+        if expand_relation_as_object:
+            select_related_fields = [field_name for field_name in select_related_fields
+                                     if expand_fields is None or field_name in expand_fields]
+            if select_related_fields:
+                queryset = queryset.select_related(*select_related_fields)
+
+        for field_name in prefetch_related_fields:
+            if expand_relation_as_object and (expand_fields is None or field_name in expand_fields):
+                queryset = queryset.prefetch_related(field_name)
+            else:
+                # Only the ids of relations that are not expanded are needed
+                related_model = cls.Meta.model._meta.get_field(field_name).related_model
+                queryset = queryset.prefetch_related(Prefetch(field_name, related_model.objects.only('pk')))
+
+        if included_fields is not None or excluded_fields is not None:
+            model_fields = cls.Meta.model._meta
+            loaded_fields = set(required_fields or [])
+            for field_name in field_names:
+                try:
+                    model_field = model_fields.get_field(field_name)
+                except FieldDoesNotExist:
+                    continue
+                if model_field.concrete and not model_field.many_to_many:
+                    loaded_fields.add(field_name)
+            queryset = queryset.only(model_fields.pk.name, *[field_name for field_name in loaded_fields
+                                                             if field_name in model_fields._forward_fields_map])
+        return queryset
+
     def to_representation(self, instance):
+        with measure_serialization():
+            return self.get_representation(instance)
+
+    def get_representation(self, instance):
         super_representation = super().to_representation(instance)
 
         if self.expand_relation_as_object:
             fields = self._readable_fields
 
             for field in fields:
-                attribute = field.get_attribute(instance)
+                if self.expand_fields is not None and field.field_name not in self.expand_fields:
+                    continue
                 instance_field = getattr(instance, field.field_name)
                 if instance_field:
                     if isinstance(field, PrimaryKeyRelatedField):
@@ -28,6 +114,7 @@ class ServerModelSerializer(serializers.ModelSerializer):
                             super_representation[field.field_name] = {'id': instance_field.id, }
                     elif isinstance(field, ManyRelatedField):
                         super_representation[field.field_name] = []
+                        # Uses the prefetch_related cache when the queryset was optimized
                         for related_item in instance_field.all():
                             if hasattr(related_item, 'to_relation_representation'):
                                 repr_item_to_add = related_item.to_relation_representation()
@@ -63,6 +150,11 @@ class OrgGroupSerializer(ServerModelSerializer):
         fields = base_model_base_fields + ['name', 'summary', 'auth_group', 'description', 'org_group',
                                            'leaders', 'members', 'guests', 'consumers', ]
 
+    def validate_org_group(self, value):
+        if self.instance is not None and value is not None and self.instance.creates_cycle(value.id):
+            raise serializers.ValidationError(org_group_cycle_message)
+        return value
+
 
 class AttachmentSerializer(ServerModelSerializer):
     class Meta:
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after data is loaded in bulk, which bypasses the model save and m2m signals, with the list of the model
+# classes loaded as models so that data derived from them can be rebuilt
+data_loaded = Signal()
@@ -1,3 +1,1412 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import contextvars
+import io
+import json
+import sqlite3
+import tempfile
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yaml
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, IntegrityError
+from django.db.models.signals import pre_delete
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, \
+    AsyncClient, AsyncRequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from psycopg_pool import ConnectionPool
+from rest_framework.exceptions import ValidationError as RequestValidationError
+from rest_framework.test import APIClient
+
+from core import pagination
+from core.benchmarks import build_benchmark_dataset, run_benchmark_suite, run_load_test
+from core.checks import get_database_settings_errors, check_database_connection_settings, \
+    check_database_connections, get_cache_settings_errors
+from core.jobs import run_data_import_job, fail_stale_data_import_jobs, claim_data_import_job
+from core.middlewares import RequestMetricsMiddleware, DatabaseRoutingMiddleware, StaticFilesMiddleware
+from core.admin import site as admin_site
+from core.contextprocessors import site_configuration
+from core.models import OrgGroup, OrgGroupClosure, DataImportJob, DataImportJobStatus, DeletedRecord, Configuration, \
+    ConfigurationService, configuration_service, get_database_name, get_org_acl_version, Site
+from core.serializers import OrgGroupSerializer
+from execution.models import Story
+from utpad_server import settings, dataload, urls as project_urls
+from utpad_server.database_routers import ReplicaRouter, WeightedRoundRobin, replica_reads, \
+    iterate_with_replica_reads, primary_pinned, replica_reads_requested
+from utpad_server.metrics import reset_request_metrics, measure_serialization, get_database_pool_stats, \
+    render_database_pool_metrics
+from utpad_server.dataload import model_name_map, serializer_map, save_data_to_folder, bulk_load_data_from_folder, \
+    get_model_levels, run_model_tasks, iterate_zip_data, save_data_to_excel, model_file_names, get_export_watermark, \
+    bulk_load_data_from_zip, save_data_to_parquet_folder, aiterate_zip_data, set_export_watermark, \
+    prune_deleted_records
+
 
 # Create your tests here.
+
+class OrgGroupClosureTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        self.l1_org1 = OrgGroup.objects.create(name="l1_org1", org_group=self.root_org)
+        self.l1_org2 = OrgGroup.objects.create(name="l1_org2", org_group=self.root_org)
+        self.l2_org11 = OrgGroup.objects.create(name="l2_org11", org_group=self.l1_org1)
+        self.l3_org111 = OrgGroup.objects.create(name="l3_org111", org_group=self.l2_org11)
+
+        self.leader = User.objects.create_user(username="leader", password="password")
+        self.member = User.objects.create_user(username="member", password="password")
+        self.consumer = User.objects.create_user(username="consumer", password="password")
+        self.l1_org1.leaders.set([self.leader])
+        self.root_org.members.set([self.member])
+        self.l2_org11.consumers.set([self.consumer])
+
+    def test_transitive_sub_groups(self):
+        self.assertEqual([self.root_org.id, self.l1_org1.id, self.l1_org2.id, self.l2_org11.id, self.l3_org111.id],
+                         self.root_org.get_transitive_sub_groups())
+        self.assertEqual([self.l1_org1.id, self.l2_org11.id, self.l3_org111.id],
+                         self.l1_org1.get_transitive_sub_groups())
+        self.assertEqual(3, OrgGroupClosure.objects.get(ancestor=self.root_org, descendant=self.l3_org111).depth)
+
+    def test_reparent_moves_sub_tree(self):
+        self.l2_org11.org_group = self.l1_org2
+        self.l2_org11.save()
+
+        self.assertEqual([self.l1_org1.id], self.l1_org1.get_transitive_sub_groups())
+        self.assertEqual([self.l1_org2.id, self.l2_org11.id, self.l3_org111.id],
+                         self.l1_org2.get_transitive_sub_groups())
+        self.assertEqual(3, OrgGroupClosure.objects.get(ancestor=self.root_org, descendant=self.l3_org111).depth)
+
+    def test_reparent_to_descendant_is_rejected(self):
+        self.l1_org1.org_group = self.l3_org111
+        with self.assertRaises(IntegrityError):
+            self.l1_org1.save()
+        with self.assertRaises(ValidationError):
+            self.l1_org1.clean()
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username="admin", password="password"))
+        for parent in [self.l3_org111, self.l1_org1]:
+            response = client.patch('/api/org_groups/' + str(self.l1_org1.id) + '/', {'org_group': parent.id},
+                                    format='json')
+            self.assertEqual(400, response.status_code)
+            self.assertIn('org_group', response.data)
+        self.assertEqual(self.root_org.id, OrgGroup.objects.get(pk=self.l1_org1.id).org_group_id)
+
+    def test_delete_detaches_sub_tree(self):
+        self.l1_org1.delete()
+
+        self.assertEqual([self.root_org.id, self.l1_org2.id], self.root_org.get_transitive_sub_groups())
+        self.assertEqual([self.l2_org11.id, self.l3_org111.id],
+                         OrgGroup.objects.get(id=self.l2_org11.id).get_transitive_sub_groups())
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        self.l2_org11.org_group = self.l1_org2
+        self.l2_org11.save()
+        maintained_links = set(OrgGroupClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+        OrgGroupClosure.rebuild()
+
+        self.assertEqual(maintained_links,
+                         set(OrgGroupClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')))
+
+    def test_privileges_resolve_in_single_query(self):
+        with self.assertNumQueries(1):
+            delete_orgs = self.leader.get_orgs_with_delete_privileges()
+        with self.assertNumQueries(1):
+            view_orgs = self.member.get_orgs_with_view_privileges()
+        with self.assertNumQueries(1):
+            consumer_orgs = self.consumer.get_orgs_with_consumer_privileges()
+
+        self.assertEqual({self.l1_org1.id, self.l2_org11.id, self.l3_org111.id}, set(delete_orgs))
+        self.assertEqual(set(self.root_org.get_transitive_sub_groups()), set(view_orgs))
+        self.assertEqual({self.l2_org11.id, self.l3_org111.id}, set(consumer_orgs))
+        self.assertEqual([], self.member.get_orgs_with_delete_privileges())
+
+
+class OrgPrivilegeCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        self.l1_org1 = OrgGroup.objects.create(name="l1_org1", org_group=self.root_org)
+        self.l1_org2 = OrgGroup.objects.create(name="l1_org2", org_group=self.root_org)
+        self.user = User.objects.create_user(username="user", password="password")
+        self.l1_org1.leaders.set([self.user])
+
+    def test_privileges_are_cached_per_request_chain(self):
+        self.assertEqual([self.l1_org1.id], self.user.get_orgs_with_delete_privileges())
+        with self.assertNumQueries(0):
+            self.assertEqual([self.l1_org1.id], self.user.get_orgs_with_view_privileges())
+            self.assertEqual([self.l1_org1.id], self.user.get_orgs_with_change_privileges())
+            self.assertEqual([], self.user.get_orgs_with_consumer_privileges())
+
+    def test_role_change_invalidates_cache(self):
+        self.assertEqual([], self.user.get_orgs_with_consumer_privileges())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.root_org.consumers.add(self.user)
+        self.assertEqual({self.root_org.id, self.l1_org1.id, self.l1_org2.id},
+                         set(self.user.get_orgs_with_consumer_privileges()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.root_org.consumers.clear()
+        self.assertEqual([], self.user.get_orgs_with_consumer_privileges())
+
+    def test_org_tree_change_invalidates_cache(self):
+        self.assertEqual([self.l1_org1.id], self.user.get_orgs_with_delete_privileges())
+        with self.captureOnCommitCallbacks(execute=True):
+            l2_org = OrgGroup.objects.create(name="l2_org", org_group=self.l1_org2)
+            l2_org.org_group = self.l1_org1
+            l2_org.save()
+        self.assertEqual({self.l1_org1.id, l2_org.id}, set(self.user.get_orgs_with_delete_privileges()))
+        with self.captureOnCommitCallbacks(execute=True):
+            l2_org.delete()
+        self.assertEqual([self.l1_org1.id], self.user.get_orgs_with_delete_privileges())
+
+    def test_role_revoked_in_transaction_invalidates_cache_on_commit(self):
+        # Cached like a concurrent request reading the committed roles while the revoking transaction is open
+        self.assertEqual([self.l1_org1.id], self.user.get_orgs_with_delete_privileges())
+        org_acl_version = get_org_acl_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.l1_org1.leaders.remove(self.user)
+                # Privileges read before the commit are cached under the version that the commit replaces
+                self.assertEqual(org_acl_version, get_org_acl_version())
+        self.assertNotEqual(org_acl_version, get_org_acl_version())
+        self.assertEqual([], self.user.get_orgs_with_delete_privileges())
+
+
+def recursive_has_org_role(org_group, user, role):
+    # Parent chain walk used by OrgGroup.is_owner/is_member/is_guest/is_consumer before the closure table
+    return (user in getattr(org_group, role).all()) or (
+            (org_group.org_group is not None) and recursive_has_org_role(org_group.org_group, user, role))
+
+
+class ObjectPermissionQueryCountTestCase(TestCase):
+    tree_depth = 6
+
+    def setUp(self):
+        cache.clear()
+        self.guest = User.objects.create_user(username="guest", password="password")
+        self.guest.user_permissions.set(Permission.objects.filter(codename='view_orggroup'))
+
+        self.org_chain = [OrgGroup.objects.create(name="org_level_0")]
+        for level in range(1, self.tree_depth):
+            self.org_chain.append(OrgGroup.objects.create(name="org_level_" + str(level),
+                                                          org_group=self.org_chain[-1]))
+        self.org_chain[0].guests.set([self.guest])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def count_queries(self, function, *args):
+        with CaptureQueriesContext(connection) as context:
+            result = function(*args)
+        return len(context.captured_queries), result
+
+    def test_role_check_queries_on_deep_tree(self):
+        leaf_org = OrgGroup.objects.get(id=self.org_chain[-1].id)
+        recursive_queries, recursive_can_read = self.count_queries(
+            lambda: any(recursive_has_org_role(leaf_org, self.guest, role)
+                        for role in ['consumers', 'guests', 'members', 'leaders']))
+
+        leaf_org = OrgGroup.objects.get(id=self.org_chain[-1].id)
+        cold_queries, cold_can_read = self.count_queries(leaf_org.can_read, self.guest)
+        warm_queries, warm_can_read = self.count_queries(leaf_org.can_read, self.guest)
+
+        self.assertTrue(recursive_can_read and cold_can_read and warm_can_read)
+        self.assertGreaterEqual(recursive_queries, 2 * self.tree_depth)
+        self.assertEqual(1, cold_queries)
+        self.assertEqual(0, warm_queries)
+
+    def test_detail_request_queries_independent_of_depth(self):
+        self.client.get('/api/org_groups/' + str(self.org_chain[0].id) + '/')
+
+        detail_queries = []
+        for org_group in [self.org_chain[1], self.org_chain[-1]]:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get('/api/org_groups/' + str(org_group.id) + '/')
+            self.assertEqual(200, response.status_code)
+            detail_queries.append(len(context.captured_queries))
+
+        self.assertEqual(detail_queries[0], detail_queries[1])
+
+
+class ListQueryCountTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.superuser = User.objects.create_superuser(username="admin", password="password")
+        self.leader = User.objects.create_user(username="leader", password="password")
+        self.member = User.objects.create_user(username="member", password="password")
+
+        root_org = OrgGroup.objects.create(name="root_org")
+        root_org.leaders.set([self.leader])
+        for index in range(30):
+            org_group = OrgGroup.objects.create(name="org_" + str(index), org_group=root_org)
+            org_group.leaders.set([self.leader])
+            org_group.members.set([self.member])
+
+        self.client = APIClient()
+
+    def get_list_query_count(self, user, page_size):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/org_groups/', {'page_size': page_size})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(page_size, len(response.data['results']))
+        return len(context.captured_queries)
+
+    def test_list_query_count_independent_of_page_size(self):
+        for user in [self.superuser, self.leader]:
+            self.get_list_query_count(user, 1)
+            self.assertEqual(self.get_list_query_count(user, 5), self.get_list_query_count(user, 30))
+
+    def test_relations_are_expanded(self):
+        self.client.force_authenticate(self.superuser)
+        response = self.client.get('/api/org_groups/', {'page_size': 5})
+        org_group = [item for item in response.data['results'] if item['name'] == 'org_1'][0]
+        self.assertEqual({'id': self.member.id, 'name': 'member'}, org_group['members'][0])
+        self.assertEqual('root_org', org_group['org_group']['name'])
+
+
+class ConfigurationServiceTestCase(TestCase):
+    def setUp(self):
+        configuration_service.invalidate()
+        self.site_name = Configuration.objects.create(name="site_name", value="Team Site")
+        Configuration.objects.create(name="sprint_days", value="14")
+        Configuration.objects.create(name="notify", value="Yes")
+        self.request = RequestFactory().get('/')
+
+    def test_lookups_are_cached(self):
+        self.assertEqual("Team Site", get_database_name())
+        with self.assertNumQueries(0):
+            self.assertEqual("Team Site", get_database_name())
+            context = site_configuration(self.request)
+            admin_site.reload_settings()
+        self.assertEqual("Team Site", context["config_site_name"])
+        self.assertEqual("14", context["config_sprint_days"])
+        self.assertEqual("Team Site Administration", admin_site.site_header)
+
+    def test_save_and_delete_invalidate_cache(self):
+        get_database_name()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.site_name.value = "Renamed Site"
+            self.site_name.save()
+        self.assertEqual("Renamed Site", get_database_name())
+        self.assertEqual("Renamed Site Administration", admin_site.site_header)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.site_name.delete()
+        self.assertEqual("Utpad Team Management", get_database_name())
+        self.assertNotIn("config_site_name", configuration_service.get_values())
+
+    def test_other_processes_see_changes_through_version(self):
+        other_process_service = ConfigurationService(check_interval=0)
+        slow_checking_service = ConfigurationService(check_interval=3600)
+        self.assertEqual("14", other_process_service.get("sprint_days"))
+        self.assertEqual("14", slow_checking_service.get("sprint_days"))
+
+        Configuration.objects.filter(name="sprint_days").update(value="10")
+        self.assertEqual("14", other_process_service.get("sprint_days"))
+        configuration_service.invalidate()
+        self.assertEqual("10", other_process_service.get("sprint_days"))
+        self.assertEqual("14", slow_checking_service.get("sprint_days"))
+
+    def test_typed_lookups(self):
+        self.assertEqual(14, configuration_service.get_int("sprint_days"))
+        self.assertEqual(14.0, configuration_service.get_float("sprint_days"))
+        self.assertTrue(configuration_service.get_bool("notify"))
+        self.assertEqual(5, configuration_service.get_int("missing", 5))
+        self.assertEqual("default", configuration_service.get_str("missing", "default"))
+        with self.assertRaises(ValidationError):
+            configuration_service.get_int("site_name")
+        with self.assertRaises(ValidationError):
+            configuration_service.get_bool("sprint_days")
+
+
+class OrgPermissionFilterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        self.l1_org1 = OrgGroup.objects.create(name="l1_org1", org_group=self.root_org)
+        self.l1_org2 = OrgGroup.objects.create(name="l1_org2", org_group=self.root_org)
+        self.l2_org = OrgGroup.objects.create(name="l2_org", org_group=self.l1_org1)
+        self.public_org = OrgGroup.objects.create(name="public_org", published=True, is_public=True)
+        self.published_org = OrgGroup.objects.create(name="published_org", published=True, org_group=self.l1_org2)
+
+        self.guest = User.objects.create_user(username="guest", password="password")
+        self.consumer = User.objects.create_user(username="consumer", password="password")
+        self.multi_role = User.objects.create_user(username="multi_role", password="password")
+        self.l1_org1.guests.set([self.guest])
+        self.root_org.consumers.set([self.consumer])
+        self.l1_org2.leaders.set([self.multi_role])
+        self.l1_org1.members.set([self.multi_role])
+        self.l2_org.guests.set([self.multi_role])
+
+        for org_group in [None, self.root_org, self.l1_org1, self.l2_org, self.published_org]:
+            for published in [False, True]:
+                Story.objects.create(name="story_" + str(org_group) + "_" + str(published), rank=1,
+                                     org_group=org_group, published=published)
+        Story.objects.create(name="public_story", rank=1, org_group=self.l1_org2, published=True, is_public=True)
+        self.configured_permission_filter = settings.ORG_PERMISSION_FILTER
+
+    def tearDown(self):
+        settings.ORG_PERMISSION_FILTER = self.configured_permission_filter
+
+    def get_list_query_set(self, model_class, user, permission_filter):
+        settings.ORG_PERMISSION_FILTER = permission_filter
+        return model_class.get_list_query_set(model_class, user)
+
+    def test_exists_filter_matches_org_ids_filter(self):
+        for model_class in [OrgGroup, Story]:
+            for user in [self.guest, self.consumer, self.multi_role]:
+                self.assertEqual(
+                    set(self.get_list_query_set(model_class, user, 'ids').values_list('id', flat=True)),
+                    set(self.get_list_query_set(model_class, user, 'exists').values_list('id', flat=True)))
+
+        self.assertEqual({"public_org", "published_org"},
+                         set(self.get_list_query_set(OrgGroup, self.consumer, 'exists').values_list('name', flat=True)))
+        self.assertEqual({"story_None_False", "story_None_True", "story_l1_org1_False", "story_l1_org1_True",
+                          "story_l2_org_False", "story_l2_org_True", "public_story"},
+                         set(self.get_list_query_set(Story, self.guest, 'exists').values_list('name', flat=True)))
+
+    def test_exists_filter_needs_no_org_ids_nor_distinct(self):
+        queryset = self.get_list_query_set(Story, self.multi_role, 'exists')
+        sql = str(queryset.query)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn(' IN (', sql)
+        with self.assertNumQueries(1):
+            self.assertEqual(9, len(queryset))
+
+    def test_exists_filter_uses_closure_and_role_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Plan checked on SQLite, use explain_org_permission_filter on other databases")
+        plan = self.get_list_query_set(Story, self.multi_role, 'exists').explain()
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertIn('SEARCH V0 USING COVERING INDEX core_orggro_descend', plan)
+        self.assertIn('SEARCH U0 USING COVERING INDEX core_orggroup_leaders_orggroup_id_user_id', plan)
+
+    def test_explain_command_prints_both_filters(self):
+        output = io.StringIO()
+        call_command('explain_org_permission_filter', 'multi_role', '--model', 'execution.Story', stdout=output)
+        self.assertIn('-- exists (sqlite): 9 records', output.getvalue())
+        self.assertIn('-- ids (sqlite): 9 records', output.getvalue())
+
+
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.superuser = User.objects.create_superuser(username="admin", password="password")
+        self.root_org = OrgGroup.objects.create(name="root_org", description="root org description")
+        self.org_group = OrgGroup.objects.create(name="org", org_group=self.root_org)
+        self.org_group.leaders.set([self.superuser])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.superuser)
+
+    def get_org_group(self, query_params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/org_groups/' + str(self.org_group.id) + '/', query_params)
+        self.assertEqual(200, response.status_code)
+        return response.data, [query['sql'] for query in context.captured_queries]
+
+    def test_fields_and_exclude(self):
+        data, queries = self.get_org_group({'fields': 'id,name'})
+        self.assertEqual({'id', 'name'}, set(data.keys()))
+        self.assertFalse(any('"core_orggroup"."description"' in query for query in queries))
+        self.assertFalse(any('core_orggroup_leaders' in query for query in queries))
+
+        data, queries = self.get_org_group({'exclude': 'description,leaders,members,guests,consumers'})
+        self.assertNotIn('description', data)
+        self.assertIn('summary', data)
+        self.assertFalse(any('core_orggroup_leaders' in query for query in queries))
+
+    def test_expand(self):
+        data, _ = self.get_org_group({'fields': 'org_group,leaders', 'expand': 'none'})
+        self.assertEqual({'org_group': self.root_org.id, 'leaders': [self.superuser.id]}, data)
+
+        data, _ = self.get_org_group({'fields': 'org_group,leaders', 'expand': 'org_group'})
+        self.assertEqual({'org_group': {'id': self.root_org.id, 'name': 'root_org'}, 'leaders': [self.superuser.id]},
+                         data)
+
+        data, _ = self.get_org_group({'fields': 'org_group,leaders'})
+        self.assertEqual([{'id': self.superuser.id, 'name': 'admin'}], data['leaders'])
+
+    def test_write_requests_ignore_sparse_fieldset(self):
+        response = self.client.patch('/api/org_groups/' + str(self.org_group.id) + '/?fields=id',
+                                     {'summary': 'updated'}, format='json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('updated', response.data['summary'])
+        self.assertIn('name', response.data)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(username="admin", password="password")
+        for index in range(25):
+            OrgGroup.objects.create(name="org_" + str(index % 10) + "_" + str(index),
+                                    published=(index % 3 == 0))
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.superuser)
+
+    def walk_pages(self, query_params):
+        names = []
+        response = self.client.get('/api/org_groups/', dict(query_params, pagination='cursor', page_size=7))
+        while True:
+            self.assertEqual(200, response.status_code)
+            names.extend(item['name'] for item in response.data['results'])
+            if response.data['next'] is None:
+                return names, response.data['count']
+            response = self.client.get(response.data['next'])
+
+    def test_walks_all_rows_in_order(self):
+        for ordering in ['id', '-id', 'name', '-name', 'published', '-published']:
+            names, count = self.walk_pages({'ordering': ordering})
+            expected_queryset = OrgGroup.objects.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
+            self.assertEqual(list(expected_queryset.values_list('name', flat=True)), names)
+            self.assertEqual(25, count)
+
+    def test_unsupported_ordering_is_rejected(self):
+        response = self.client.get('/api/org_groups/', {'ordering': 'leaders', 'pagination': 'cursor'})
+        self.assertEqual(400, response.status_code)
+        self.assertIn('ordering', response.data)
+
+        with self.assertRaises(RequestValidationError):
+            pagination.KeysetPaginationExtn.get_ordering(OrgGroup.objects.order_by('org_group__name'))
+        self.assertEqual(('id', True), pagination.KeysetPaginationExtn.get_ordering(OrgGroup.objects.order_by('-pk')))
+
+    def test_count_modes(self):
+        names, count = self.walk_pages({'count': 'false'})
+        self.assertEqual(25, len(names))
+        self.assertIsNone(count)
+
+        _, count = self.walk_pages({'count': 'approximate'})
+        self.assertEqual(25, count)
+
+        response = self.client.get('/api/org_groups/', {'count': 'approximate', 'page_size': 10, 'page': 2})
+        self.assertEqual(25, response.data['count'])
+        self.assertEqual(10, len(response.data['results']))
+
+    def test_approximate_count_pages_beyond_count(self):
+        approximate_count_limit = pagination.approximate_count_limit
+        pagination.approximate_count_limit = 10
+        try:
+            parameters = {'count': 'approximate', 'page_size': 5, 'ordering': 'id'}
+            response = self.client.get('/api/org_groups/', dict(parameters, page=4))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(10, response.data['count'])
+            self.assertEqual(list(OrgGroup.objects.order_by('id').values_list('name', flat=True)[15:20]),
+                             [item['name'] for item in response.data['results']])
+            self.assertIn('page=5', response.data['next'])
+            self.assertIn('page=3', response.data['previous'])
+
+            response = self.client.get('/api/org_groups/', dict(parameters, page=5))
+            self.assertEqual(5, len(response.data['results']))
+            self.assertIsNone(response.data['next'])
+            self.assertEqual(404, self.client.get('/api/org_groups/', dict(parameters, page=6)).status_code)
+        finally:
+            pagination.approximate_count_limit = approximate_count_limit
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/org_groups/', {'pagination': 'cursor', 'cursor': 'invalid'})
+        self.assertEqual(404, response.status_code)
+
+        # Well formed cursors with values of other types than the ordering field and id
+        for ordering, cursor in [('id', [1, 'abc']), ('id', ['abc', 1]), ('updated_at', ['not a time', 1]),
+                                 ('updated_at', [[2025], 1]), ('name', ['org', None]), ('name', {'id': 1})]:
+            encoded_cursor = base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+            response = self.client.get('/api/org_groups/', {'pagination': 'cursor', 'count': 'none',
+                                                            'ordering': ordering, 'cursor': encoded_cursor})
+            self.assertEqual(404, response.status_code)
+
+    def test_page_numbers_without_count(self):
+        parameters = {'count': 'none', 'page_size': 10, 'ordering': 'id'}
+        names = []
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/org_groups/', parameters)
+        self.assertFalse(any('COUNT(' in query['sql'].upper() for query in context.captured_queries))
+        while True:
+            self.assertEqual(200, response.status_code)
+            self.assertIsNone(response.data['count'])
+            names.extend(item['name'] for item in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(list(OrgGroup.objects.order_by('id').values_list('name', flat=True)), names)
+        self.assertIn('page=2', response.data['previous'])
+
+        self.assertEqual(404, self.client.get('/api/org_groups/', dict(parameters, page=4)).status_code)
+        self.assertEqual(404, self.client.get('/api/org_groups/', dict(parameters, page='last')).status_code)
+
+
+class StreamingExportTestCase(TestCase):
+    def setUp(self):
+        self.leader = User.objects.create_user(username="leader", password="password")
+        self.member = User.objects.create_user(username="member", password="password")
+        root_org = OrgGroup.objects.create(name="root_org")
+        for index in range(7):
+            org_group = OrgGroup.objects.create(name="org_" + str(index), org_group=root_org,
+                                                description="line one\nline two")
+            org_group.leaders.set([self.leader])
+            org_group.members.set([self.member, self.leader])
+
+    def test_export_matches_dump_of_serialized_table(self):
+        with tempfile.TemporaryDirectory() as data_folder:
+            save_data_to_folder(data_folder, chunk_size=3)
+            for app_name, app_model_name_map in model_name_map.items():
+                for model_name, model_class in app_model_name_map.items():
+                    file_path = Path(data_folder, app_name, model_name + ".yaml")
+                    if not model_class.objects.exists():
+                        self.assertFalse(file_path.exists())
+                        continue
+                    expected_content = yaml.dump_all(serializer_map[model_class](model_class.objects.all(),
+                                                                                 many=True).data, sort_keys=False)
+                    self.assertEqual(expected_content, file_path.read_text())
+
+    def test_zip_export_matches_folder_export(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username="admin", password="password"))
+        with tempfile.TemporaryDirectory() as data_folder:
+            for compression in ['store', 'deflate', 'bzip2', 'lzma']:
+                response = client.get('/api/export/zip', {'compression': compression, 'level': 9})
+                self.assertEqual(200, response.status_code)
+                self.assertTrue(response.streaming)
+                save_data_to_folder(data_folder)
+                with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zip_file:
+                    file_names = sorted(str(file_path.relative_to(data_folder))
+                                        for file_path in Path(data_folder).rglob('*.yaml'))
+                    self.assertEqual(file_names, sorted(zip_file.namelist()))
+                    for file_name in file_names:
+                        self.assertEqual(Path(data_folder, file_name).read_bytes(), zip_file.read(file_name))
+
+        self.assertEqual(400, client.get('/api/export/zip', {'compression': 'rar'}).status_code)
+        self.assertEqual(400, client.get('/api/export/zip', {'compression': 'deflate', 'level': 12}).status_code)
+
+    def test_export_query_count_independent_of_rows(self):
+        with tempfile.TemporaryDirectory() as data_folder:
+            with CaptureQueriesContext(connection) as context:
+                save_data_to_folder(data_folder, chunk_size=100)
+            query_count = len(context.captured_queries)
+
+            for index in range(20):
+                org_group = OrgGroup.objects.create(name="new_org_" + str(index), description="description")
+                org_group.members.set([self.member])
+            with CaptureQueriesContext(connection) as context:
+                save_data_to_folder(data_folder, chunk_size=100)
+            self.assertEqual(query_count, len(context.captured_queries))
+
+
+class StreamingExcelExportTestCase(TestCase):
+    def setUp(self):
+        self.leader = User.objects.create_user(username="leader", password="password")
+        root_org = OrgGroup.objects.create(name="root_org")
+        for index in range(5):
+            org_group = OrgGroup.objects.create(name="=org_" + str(index), org_group=root_org,
+                                                description="http://example.com/" + str(index))
+            org_group.leaders.set([self.leader])
+
+    @staticmethod
+    def get_expected_cell_value(value):
+        return str(value) if isinstance(value, (list, dict)) else value
+
+    def assert_workbook_matches_serialized_tables(self, workbook):
+        expected_sheet_names = [(app_name + "_" + model_name)[:31]
+                                for model_class, (app_name, model_name) in model_file_names.items()
+                                if model_class.objects.exists()]
+        self.assertEqual(expected_sheet_names, workbook.sheetnames)
+        for model_class, (app_name, model_name) in model_file_names.items():
+            if not model_class.objects.exists():
+                continue
+            records = serializer_map[model_class](model_class.objects.all(), many=True,
+                                                  expand_relation_as_object=False).data
+            rows = list(workbook[(app_name + "_" + model_name)[:31]].iter_rows(values_only=True))
+            self.assertEqual(tuple(records[0].keys()), rows[0])
+            self.assertEqual([tuple(self.get_expected_cell_value(value) for value in record.values())
+                              for record in records], rows[1:])
+
+    def test_excel_export_writes_id_only_rows(self):
+        with tempfile.TemporaryDirectory() as data_folder:
+            file_path = str(Path(data_folder, "data.xlsx"))
+            save_data_to_excel(file_path, chunk_size=2)
+            workbook = openpyxl.load_workbook(file_path, read_only=True)
+            self.assert_workbook_matches_serialized_tables(workbook)
+            workbook.close()
+
+    def test_excel_export_view(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username="admin", password="password"))
+        response = client.get('/api/export/excel')
+        self.assertEqual(200, response.status_code)
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        self.assert_workbook_matches_serialized_tables(workbook)
+        workbook.close()
+
+
+class AsyncExportTestCase(TransactionTestCase):
+    # Committed data, the models are exported in worker threads with their own connections
+    get_expected_cell_value = staticmethod(StreamingExcelExportTestCase.get_expected_cell_value)
+
+    def setUp(self):
+        StreamingExportTestCase.setUp(self)
+        self.admin = User.objects.create_superuser(username="admin", password="password")
+
+    @staticmethod
+    async def read_streaming_content(response):
+        return b''.join([data async for data in response.streaming_content])
+
+    async def get_async_export(self, path, parameters=None, user=None):
+        client = AsyncClient()
+        if user is not None:
+            await client.aforce_login(user)
+        response = await client.get(path, parameters or {})
+        return response, await self.read_streaming_content(response) if response.streaming else response.content
+
+    @staticmethod
+    def read_zip_files(zip_data):
+        with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_file:
+            return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+    async def read_async_zip_data(self, concurrency):
+        return b''.join([data async for data in aiterate_zip_data(chunk_size=2, concurrency=concurrency)])
+
+    def test_async_zip_export_matches_zip_export(self):
+        expected_files = self.read_zip_files(b''.join(iterate_zip_data()))
+        for concurrency in [1, 3]:
+            files = self.read_zip_files(async_to_sync(self.read_async_zip_data)(concurrency))
+            # Same members in the same order
+            self.assertEqual(list(expected_files), list(files))
+            self.assertEqual(expected_files, files)
+
+        response, zip_data = async_to_sync(self.get_async_export)('/api/async/export/zip', {'compression': 'bzip2'},
+                                                                  self.admin)
+        self.assertEqual(200, response.status_code)
+        # Logging in changed the last login of the admin
+        self.assertEqual(self.read_zip_files(b''.join(iterate_zip_data())), self.read_zip_files(zip_data))
+
+        self.assertEqual(401, async_to_sync(self.get_async_export)('/api/async/export/zip')[0].status_code)
+        self.assertEqual(403, async_to_sync(self.get_async_export)('/api/async/export/zip', user=self.member)[
+            0].status_code)
+        self.assertEqual(400, async_to_sync(self.get_async_export)('/api/async/export/zip', {'compression': 'rar'},
+                                                                   self.admin)[0].status_code)
+
+    def test_async_zip_export_serializes_a_bounded_number_of_models_ahead(self):
+        async def read_first_chunk(zip_data):
+            async for data in zip_data:
+                if data:
+                    # Time for the models not bounded by the client to be serialized
+                    await asyncio.sleep(1)
+                    return data
+
+        Site.objects.create(name="ODC1")
+        Configuration.objects.create(name="sprint_days", value="14")
+        with mock.patch('utpad_server.dataload.write_model_yaml_file',
+                        wraps=dataload.write_model_yaml_file) as write_model_yaml_file:
+            zip_data = aiterate_zip_data(chunk_size=2, concurrency=1)
+            async_to_sync(read_first_chunk)(zip_data)
+            # The model copied and the next one
+            self.assertLessEqual(write_model_yaml_file.call_count, 2)
+            async_to_sync(zip_data.aclose)()
+
+            async_to_sync(self.read_async_zip_data)(1)
+            self.assertGreater(write_model_yaml_file.call_count, 4)
+
+    def test_async_zip_export_since_watermark(self):
+        response, zip_data = async_to_sync(self.get_async_export)('/api/async/export/zip', {'since': 'watermark'},
+                                                                  self.admin)
+        self.assertEqual(response['X-Export-Until'], get_export_watermark().isoformat())
+
+        OrgGroup.objects.get(name="org_0").delete()
+        response, zip_data = async_to_sync(self.get_async_export)('/api/async/export/zip', {'since': 'watermark'},
+                                                                  self.admin)
+        with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_file:
+            self.assertEqual([{'model': 'core.OrgGroup', 'id': DeletedRecord.objects.last().record_id}],
+                             list(yaml.safe_load_all(zip_file.read('deleted.yaml'))))
+        self.assertEqual(response['X-Export-Until'], get_export_watermark().isoformat())
+
+    def test_async_excel_export(self):
+        response, excel_data = async_to_sync(self.get_async_export)('/api/async/export/excel', user=self.admin)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('attachment; filename="exported_data.xlsx"', response['Content-Disposition'])
+        workbook = openpyxl.load_workbook(io.BytesIO(excel_data), read_only=True)
+        StreamingExcelExportTestCase.assert_workbook_matches_serialized_tables(self, workbook)
+        workbook.close()
+
+        self.assertEqual(403, async_to_sync(self.get_async_export)('/api/async/export/excel', user=self.member)[
+            0].status_code)
+
+
+class ParquetExportTestCase(TestCase):
+    def setUp(self):
+        self.leader = User.objects.create_user(username="leader", password="password")
+        self.member = User.objects.create_user(username="member", password="password")
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        for index in range(5):
+            org_group = OrgGroup.objects.create(name="org_" + str(index), org_group=self.root_org)
+            org_group.leaders.set([self.leader])
+            org_group.members.set([self.member, self.leader] if index % 2 else [])
+
+    def assert_org_groups_table(self, table):
+        self.assertEqual(pa.int64(), table.schema.field('org_group').type)
+        self.assertEqual(pa.list_(pa.int64()), table.schema.field('members').type)
+        self.assertEqual(pa.timestamp('us', tz='UTC'), table.schema.field('updated_at').type)
+        self.assertEqual(pa.bool_(), table.schema.field('published').type)
+
+        org_groups = OrgGroup.objects.order_by('id')
+        self.assertEqual([org_group.id for org_group in org_groups], table.column('id').to_pylist())
+        self.assertEqual([org_group.org_group_id for org_group in org_groups], table.column('org_group').to_pylist())
+        self.assertEqual([sorted(org_group.members.values_list('id', flat=True)) for org_group in org_groups],
+                         [sorted(member_ids) for member_ids in table.column('members').to_pylist()])
+        self.assertEqual([org_group.updated_at for org_group in org_groups], table.column('updated_at').to_pylist())
+
+    def test_parquet_export_writes_typed_columns(self):
+        with tempfile.TemporaryDirectory() as data_folder:
+            export_results = save_data_to_parquet_folder(data_folder, chunk_size=2)
+            self.assertEqual(6, export_results['core.OrgGroup']['records'])
+            self.assertFalse(Path(data_folder, "core", "Site.parquet").exists())
+            table = pq.read_table(str(Path(data_folder, "core", "OrgGroup.parquet")))
+            self.assertEqual(3, pq.ParquetFile(str(Path(data_folder, "core", "OrgGroup.parquet"))).num_row_groups)
+        self.assert_org_groups_table(table)
+
+    def test_parquet_export_view(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username="admin", password="password"))
+        response = client.get('/api/export/parquet')
+        self.assertEqual(200, response.status_code)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zip_file:
+            self.assertIn('auth/User.parquet', zip_file.namelist())
+            table = pq.read_table(io.BytesIO(zip_file.read('core/OrgGroup.parquet')))
+        self.assert_org_groups_table(table)
+
+        client.force_authenticate(self.member)
+        self.assertEqual(403, client.get('/api/export/parquet').status_code)
+
+
+class BulkImportTestCase(TestCase):
+    def setUp(self):
+        self.leader = User.objects.create_user(username="leader", password="password")
+        self.member = User.objects.create_user(username="member", password="password")
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        parent_org = self.root_org
+        for index in range(6):
+            parent_org = OrgGroup.objects.create(name="org_" + str(index), org_group=parent_org)
+            parent_org.leaders.set([self.leader])
+            parent_org.members.set([self.member, self.leader])
+        self.data_folder = tempfile.TemporaryDirectory()
+        save_data_to_folder(self.data_folder.name)
+
+    def tearDown(self):
+        self.data_folder.cleanup()
+
+    def bulk_load_data(self, **kwargs):
+        load_results = bulk_load_data_from_folder(self.data_folder.name, **kwargs)
+        return {model_label: {key: value for key, value in result.items() if key != 'seconds'}
+                for model_label, result in load_results.items()}
+
+    @staticmethod
+    def get_org_groups_data():
+        return [{key: value for key, value in org_group_data.items() if key not in ('created_at', 'updated_at')}
+                for org_group_data in OrgGroupSerializer(OrgGroup.objects.order_by('id'), many=True).data]
+
+    def test_bulk_import_recreates_records(self):
+        org_groups_data = self.get_org_groups_data()
+        transitive_sub_groups = self.root_org.get_transitive_sub_groups()
+        OrgGroup.objects.all().delete()
+
+        load_counts = self.bulk_load_data(batch_size=4)
+        self.assertEqual({'created': 7, 'updated': 0, 'skipped': 0}, load_counts['core.OrgGroup'])
+        self.assertEqual({'created': 0, 'updated': 0, 'skipped': 2}, load_counts['auth.User'])
+        self.assertEqual(org_groups_data, self.get_org_groups_data())
+        # The closure bypassed by the bulk insert is rebuilt
+        self.assertEqual(transitive_sub_groups, OrgGroup.objects.get(name="root_org").get_transitive_sub_groups())
+        self.assertTrue(self.leader.get_orgs_with_delete_privileges())
+
+    def test_bulk_import_updates_existing_records(self):
+        org_groups_data = self.get_org_groups_data()
+        org_group = OrgGroup.objects.get(name="org_3")
+        org_group.name = "renamed"
+        org_group.save()
+        org_group.members.set([])
+
+        load_counts = self.bulk_load_data(update_existing=True)
+        self.assertEqual({'created': 0, 'updated': 7, 'skipped': 0}, load_counts['core.OrgGroup'])
+        self.assertEqual(org_groups_data, self.get_org_groups_data())
+
+    def test_bulk_import_skips_conflicting_records(self):
+        User.objects.filter(username="member").update(username="old_member")
+        User.objects.create_user(username="member", password="password")
+        User.objects.filter(username="old_member").delete()
+
+        # The member in the files has a different id than the one with the same user name
+        load_counts = self.bulk_load_data()
+        self.assertEqual({'created': 0, 'updated': 0, 'skipped': 2}, load_counts['auth.User'])
+        load_counts = self.bulk_load_data(update_existing=True)
+        self.assertEqual({'created': 0, 'updated': 1, 'skipped': 1}, load_counts['auth.User'])
+        self.assertEqual(1, User.objects.filter(username="member").count())
+
+
+class IncrementalExportTestCase(TestCase):
+    def setUp(self):
+        self.member = User.objects.create_user(username="member", password="password")
+        self.root_org = OrgGroup.objects.create(name="root_org")
+        for index in range(5):
+            OrgGroup.objects.create(name="org_" + str(index), org_group=self.root_org)
+        self.full_data_folder = tempfile.TemporaryDirectory()
+        self.delta_data_folder = tempfile.TemporaryDirectory()
+        save_data_to_folder(self.full_data_folder.name)
+        self.since = timezone.now()
+
+        # Changes after the full export
+        renamed_org = OrgGroup.objects.get(name="org_1")
+        renamed_org.name = "renamed"
+        renamed_org.save()
+        OrgGroup.objects.get(name="org_2").members.add(self.member)
+        self.member.org_groups_where_guest.add(OrgGroup.objects.get(name="org_3"))
+        OrgGroup.objects.get(name="org_4").delete()
+        OrgGroup.objects.create(name="new_org", org_group=self.root_org)
+
+    def tearDown(self):
+        self.full_data_folder.cleanup()
+        self.delta_data_folder.cleanup()
+
+    @staticmethod
+    def get_org_groups_data():
+        return [{key: value for key, value in org_group_data.items() if key not in ('created_at', 'updated_at')}
+                for org_group_data in OrgGroupSerializer(OrgGroup.objects.order_by('id'), many=True).data]
+
+    def test_incremental_export_writes_changes_and_deletions(self):
+        export_results = save_data_to_folder(self.delta_data_folder.name, since=self.since)
+        exported_names = {org_group_data['name'] for org_group_data in yaml.safe_load_all(
+            Path(self.delta_data_folder.name, "core", "OrgGroup.yaml").read_text())}
+        self.assertEqual({"renamed", "org_2", "org_3", "new_org"}, exported_names)
+        self.assertNotIn("org_0", exported_names)
+        self.assertFalse(Path(self.delta_data_folder.name, "core", "Site.yaml").exists())
+        # Users have no updated_at and are always exported
+        self.assertEqual(User.objects.count(), export_results['auth.User']['records'])
+
+        deleted_records = list(yaml.safe_load_all(Path(self.delta_data_folder.name, "deleted.yaml").read_text()))
+        self.assertIn({'model': 'core.OrgGroup', 'id': DeletedRecord.objects.get().record_id}, deleted_records)
+        self.assertEqual(1, export_results['core.DeletedRecord']['records'])
+
+    def test_incremental_export_includes_records_nulled_by_deletion(self):
+        since = timezone.now()
+        # The sub groups of the root org become roots without being saved
+        self.root_org.delete()
+        save_data_to_folder(self.delta_data_folder.name, since=since)
+        exported_org_groups = list(yaml.safe_load_all(
+            Path(self.delta_data_folder.name, "core", "OrgGroup.yaml").read_text()))
+        self.assertEqual({"org_0", "renamed", "org_2", "org_3", "new_org"},
+                         {org_group_data['name'] for org_group_data in exported_org_groups})
+        self.assertTrue(all(org_group_data['org_group'] is None for org_group_data in exported_org_groups))
+
+    def test_watermark_export_includes_changes_committed_after_it_started(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username="admin", password="password"))
+        overlap = timedelta(seconds=settings.EXPORT_WATERMARK_OVERLAP)
+        export_started = timezone.now()
+        b''.join(client.get('/api/export/zip', {'since': 'watermark'}).streaming_content)
+        self.assertLessEqual(export_started - overlap, get_export_watermark())
+        self.assertLessEqual(get_export_watermark(), timezone.now() - overlap)
+
+        # Saved by a transaction running when the export started and committed after it read the org groups
+        late_org = OrgGroup.objects.create(name="late_org")
+        OrgGroup.objects.filter(pk=late_org.pk).update(updated_at=export_started - timedelta(seconds=1))
+        response = client.get('/api/export/zip', {'since': 'watermark'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zip_file:
+            self.assertIn("late_org", {org_group_data['name'] for org_group_data in yaml.safe_load_all(
+                zip_file.read('core/OrgGroup.yaml'))})
+
+    def test_deletions_tracked_for_exported_models_only(self):
+        deleted_record_count = DeletedRecord.objects.count()
+        OrgGroupClosure.objects.filter(ancestor=self.root_org, depth=1).delete()
+        DeletedRecord.objects.filter(pk=DeletedRecord.objects.first().pk).delete()
+        self.assertEqual(deleted_record_count - 1, DeletedRecord.objects.count())
+        # Models without exported relations nulled by their deletion are deleted without pre_delete receivers
+        self.assertFalse(pre_delete.has_listeners(OrgGroupClosure))
+        self.assertFalse(pre_delete.has_listeners(DeletedRecord))
+        self.assertTrue(pre_delete.has_listeners(User))
+
+    def test_deleted_records_pruned(self):
+        DeletedRecord.objects.update(deleted_at=timezone.now() - timedelta(days=settings.DELETED_RECORD_RETENTION_DAYS,
+                                                                           hours=1))
+        # Kept while the watermark is older
+        set_export_watermark(timezone.now() - timedelta(days=settings.DELETED_RECORD_RETENTION_DAYS, hours=2))
+        self.assertEqual(1, DeletedRecord.objects.count())
+
+        set_export_watermark(timezone.now())
+        self.assertFalse(DeletedRecord.objects.exists())
+        OrgGroup.objects.get(name="org_3").delete()
+        self.assertEqual(0, prune_deleted_records())
+        self.assertEqual(1, DeletedRecord.objects.count())
+
+    def test_incremental_import_applies_delta(self):
+        save_data_to_folder(self.delta_data_folder.name, since=self.since)
+        org_groups_data = self.get_org_groups_data()
+
+        # Back to the state of the full export, then forward with the delta
+        OrgGroup.objects.all().delete()
+        bulk_load_data_from_folder(self.full_data_folder.name)
+        self.assertEqual(5, OrgGroup.objects.filter(name__startswith="org_").count())
+        load_results = bulk_load_data_from_folder(self.delta_data_folder.name)
+        self.assertEqual(1, load_results['core.OrgGroup']['deleted'])
+        self.assertEqual(org_groups_data, self.get_org_groups_data())
+
+    def test_zip_export_since_watermark(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username="admin", password="password"))
+        self.assertEqual(400, client.get('/api/export/zip', {'since': 'yesterday'}).status_code)
+
+        response = client.get('/api/export/zip', {'since': 'watermark'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zip_file:
+            # Without a watermark everything is exported
+            self.assertNotIn('deleted.yaml', zip_file.namelist())
+        self.assertEqual(response['X-Export-Until'], get_export_watermark().isoformat())
+
+        OrgGroup.objects.get(name="org_0").delete()
+        response = client.get('/api/export/zip', {'since': 'watermark'})
+        with tempfile.TemporaryDirectory() as data_folder:
+            zip_file_path = str(Path(data_folder, "delta.zip"))
+            Path(zip_file_path).write_bytes(b''.join(response.streaming_content))
+            with zipfile.ZipFile(zip_file_path) as zip_file:
+                self.assertIn('deleted.yaml', zip_file.namelist())
+                # Along with the deletion of the setup, within the overlap of the watermark
+                self.assertIn({'model': 'core.OrgGroup', 'id': DeletedRecord.objects.last().record_id},
+                              list(yaml.safe_load_all(zip_file.read('deleted.yaml'))))
+            # Deleted again by the import
+            OrgGroup.objects.create(id=DeletedRecord.objects.last().record_id, name="org_0")
+            load_results = bulk_load_data_from_zip(zip_file_path)
+        self.assertEqual(1, load_results['core.OrgGroup']['deleted'])
+        self.assertFalse(OrgGroup.objects.filter(name="org_0").exists())
+
+
+class DataLoadOrderTestCase(TestCase):
+    def test_models_depend_on_earlier_levels(self):
+        model_levels = get_model_levels()
+        ordered_model_classes = set()
+        for model_level in model_levels:
+            for model_class in model_level:
+                for model_field in [*model_class._meta.concrete_fields, *model_class._meta.many_to_many]:
+                    if model_field.is_relation and model_field.related_model is not model_class and \
+                            model_field.related_model in serializer_map:
+                        self.assertIn(model_field.related_model, ordered_model_classes)
+            ordered_model_classes.update(model_level)
+        self.assertEqual({model_class for app_model_name_map in model_name_map.values()
+                          for model_class in app_model_name_map.values()}, ordered_model_classes)
+
+    def test_model_tasks_run_concurrently_per_level(self):
+        model_levels = get_model_levels()
+        completed_model_classes = []
+
+        def model_task(model_class):
+            completed_model_classes.append(model_class)
+            return {'name': model_class.__name__}
+
+        results = run_model_tasks(model_levels, model_task, workers=3)
+        self.assertEqual([model_class for model_level in model_levels for model_class in model_level],
+                         list(results.keys()))
+        for model_class, result in results.items():
+            self.assertEqual(model_class.__name__, result['name'])
+            self.assertGreaterEqual(result['seconds'], 0)
+        # Every level completes before the next one starts
+        for index, model_level in enumerate(model_levels):
+            level_start = sum(len(level) for level in model_levels[:index])
+            self.assertEqual(set(model_level), set(completed_model_classes[level_start:level_start + len(model_level)]))
+
+
+class DataImportJobTestCase(TestCase):
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(username="admin", password="password")
+        member = User.objects.create_user(username="member", password="password")
+        self.member_id = member.id
+        root_org = OrgGroup.objects.create(name="root_org")
+        for index in range(5):
+            org_group = OrgGroup.objects.create(name="org_" + str(index), org_group=root_org)
+            org_group.members.set([member])
+        self.zip_data = b''.join(iterate_zip_data())
+
+        # The member in the archive is replaced by one with another id and the same user name
+        User.objects.filter(username="member").delete()
+        User.objects.create_user(username="member", password="password")
+        OrgGroup.objects.all().delete()
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.superuser)
+
+    def test_import_job_runs_in_background(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/import/zip',
+                                        {'file': SimpleUploadedFile('data.zip', self.zip_data)}, format='multipart')
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(1, len(callbacks))
+        job = DataImportJob.objects.get(pk=response.data['job_id'])
+        self.assertEqual(DataImportJobStatus.QUEUED, job.status)
+
+        # Run the queued job in the test transaction instead of the background thread
+        run_data_import_job(job.id)
+
+        response = self.client.get('/api/import/jobs/' + str(job.id))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(DataImportJobStatus.SUCCEEDED, response.data['status'])
+        self.assertEqual({'created': 6, 'updated': 0, 'skipped': 0},
+                         {key: value for key, value in response.data['progress']['core.OrgGroup'].items()
+                          if key != 'seconds'})
+        self.assertEqual([('auth.User', self.member_id)],
+                         [(error['model'], error['id']) for error in response.data['errors']])
+        self.assertEqual(6, OrgGroup.objects.count())
+        self.assertFalse(Path(job.file_path).exists())
+
+    def create_job(self, status, heartbeat_seconds_ago=0):
+        with tempfile.NamedTemporaryFile(prefix='utpad-import-', suffix='.zip', delete=False) as zip_file:
+            zip_file.write(self.zip_data)
+        return DataImportJob.objects.create(file_name='data.zip', file_path=zip_file.name, status=status,
+                                            heartbeat_at=timezone.now() - timedelta(seconds=heartbeat_seconds_ago))
+
+    def test_stale_jobs_failed_and_files_removed(self):
+        stale_queued_job = self.create_job(DataImportJobStatus.QUEUED, settings.DATA_IMPORT_STALE_TIMEOUT + 1)
+        stale_running_job = self.create_job(DataImportJobStatus.RUNNING, settings.DATA_IMPORT_STALE_TIMEOUT + 1)
+        running_job = self.create_job(DataImportJobStatus.RUNNING)
+        with self.assertLogs('core.jobs', level='WARNING'):
+            self.assertEqual({stale_queued_job.id, stale_running_job.id}, set(fail_stale_data_import_jobs()))
+        for job in [stale_queued_job, stale_running_job]:
+            job.refresh_from_db()
+            self.assertEqual(DataImportJobStatus.FAILED, job.status)
+            self.assertFalse(Path(job.file_path).exists())
+        running_job.refresh_from_db()
+        self.assertEqual(DataImportJobStatus.RUNNING, running_job.status)
+        self.assertTrue(Path(running_job.file_path).exists())
+        Path(running_job.file_path).unlink()
+
+        # The job of a stopped process is not run
+        run_data_import_job(stale_queued_job.id)
+        self.assertEqual(0, OrgGroup.objects.count())
+
+    def test_one_job_runs_at_a_time_in_queue_order(self):
+        running_job = self.create_job(DataImportJobStatus.RUNNING)
+        first_job = self.create_job(DataImportJobStatus.QUEUED)
+        second_job = self.create_job(DataImportJobStatus.QUEUED)
+        self.assertEqual(DataImportJobStatus.QUEUED, claim_data_import_job(first_job.id))
+
+        # Run by the process that received it, possibly another one
+        DataImportJob.objects.filter(pk=running_job.pk).update(status=DataImportJobStatus.SUCCEEDED)
+        self.assertEqual(DataImportJobStatus.QUEUED, claim_data_import_job(second_job.id))
+        self.assertEqual(DataImportJobStatus.RUNNING, claim_data_import_job(first_job.id))
+        self.assertEqual(DataImportJobStatus.QUEUED, claim_data_import_job(second_job.id))
+        for job in [running_job, first_job, second_job]:
+            Path(job.file_path).unlink()
+
+    def test_import_requires_zip_file(self):
+        response = self.client.post('/api/import/zip', {'file': SimpleUploadedFile('data.zip', b'not a zip')},
+                                    format='multipart')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(404, self.client.get('/api/import/jobs/1000').status_code)
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        reset_request_metrics()
+        self.admin = User.objects.create_superuser(username="admin", password="password")
+        for index in range(3):
+            OrgGroup.objects.create(name="org_" + str(index))
+
+    def test_metrics_endpoint_exposes_view_histograms(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(200, client.get('/api/org_groups/').status_code)
+        query_count = len(context.captured_queries)
+
+        response = client.get('/api/metrics')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        metrics = response.content.decode('utf-8').splitlines()
+        labels = 'view="orggroup-list",method="GET"'
+        self.assertIn('# TYPE utpad_request_duration_seconds histogram', metrics)
+        self.assertIn(f'utpad_request_duration_seconds_count{{{labels}}} 1', metrics)
+        self.assertIn(f'utpad_request_queries_sum{{{labels}}} {query_count}', metrics)
+        self.assertIn(f'utpad_request_queries_bucket{{{labels},le="+Inf"}} 1', metrics)
+        serializer_seconds = next(float(line.split(' ')[1]) for line in metrics
+                                  if line.startswith(f'utpad_request_serializer_duration_seconds_sum{{{labels}}}'))
+        self.assertGreater(serializer_seconds, 0)
+
+        client.force_authenticate(User.objects.create_user(username="member", password="password"))
+        self.assertEqual(403, client.get('/api/metrics').status_code)
+
+    def test_slow_requests_logged_with_slowest_queries(self):
+        def get_response(request):
+            with measure_serialization():
+                list(OrgGroup.objects.all())
+                list(User.objects.all())
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(get_response)
+        middleware.slow_request_threshold = 0
+        middleware.slow_request_logged_queries = 1
+        with self.assertLogs('utpad_server.metrics', level='WARNING') as logs:
+            middleware(RequestFactory().get('/slow'))
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('Slow request GET /slow (unresolved)', logs.output[0])
+        self.assertIn('2 queries', logs.output[0])
+        self.assertEqual(1, logs.output[0].count('SELECT'))
+
+        middleware.slow_request_threshold = None
+        with self.assertNoLogs('utpad_server.metrics', level='WARNING'):
+            middleware(RequestFactory().get('/slow'))
+
+    def test_async_requests_measured(self):
+        async def get_response(request):
+            await OrgGroup.objects.acount()
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(DatabaseRoutingMiddleware(get_response))
+        self.assertTrue(iscoroutinefunction(middleware))
+        middleware.slow_request_threshold = 0
+        with self.assertLogs('utpad_server.metrics', level='WARNING') as logs:
+            async_to_sync(middleware)(AsyncRequestFactory().get('/slow'))
+        self.assertIn('1 queries', logs.output[0])
+
+
+class DatabaseConnectionTestCase(TestCase):
+    postgresql_settings = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'utpad', 'OPTIONS': {}}
+
+    def test_persistent_connections_are_configured(self):
+        self.assertEqual(settings.DATABASE_CONN_MAX_AGE, settings.DATABASES['default']['CONN_MAX_AGE'])
+        self.assertEqual(settings.DATABASE_CONN_HEALTH_CHECKS, settings.DATABASES['default']['CONN_HEALTH_CHECKS'])
+
+    def test_connection_settings_checks(self):
+        pool = {'min_size': 2, 'max_size': 10, 'timeout': 10}
+        self.assertEqual([], get_database_settings_errors(
+            'default', dict(self.postgresql_settings, CONN_MAX_AGE=60)))
+        self.assertEqual([], get_database_settings_errors(
+            'default', dict(self.postgresql_settings, OPTIONS={'pool': pool}, CONN_MAX_AGE=0), pool))
+        self.assertEqual(['core.W001'], [error.id for error in get_database_settings_errors(
+            'default', dict(self.postgresql_settings, CONN_MAX_AGE=0))])
+        self.assertEqual(['core.E003', 'core.E004'], [error.id for error in get_database_settings_errors(
+            'default', dict(self.postgresql_settings, OPTIONS={'pool': {'min_size': 4, 'max_size': 2}},
+                            CONN_MAX_AGE=60))])
+        self.assertEqual(['core.E001'], [error.id for error in get_database_settings_errors(
+            'default', {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {'pool': pool}})])
+        self.assertEqual(['core.W002'], [error.id for error in get_database_settings_errors(
+            'default', {'ENGINE': 'django.db.backends.sqlite3', 'CONN_MAX_AGE': 60}, pool)])
+
+    def test_cache_settings_checks(self):
+        local_memory_cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                              'OPTIONS': {'MAX_ENTRIES': 100000}}
+        self.assertEqual(['core.E007'], [error.id for error in get_cache_settings_errors(local_memory_cache, None)])
+        self.assertEqual(['core.E007'], [error.id for error in get_cache_settings_errors(local_memory_cache, 4)])
+        self.assertEqual([], get_cache_settings_errors(local_memory_cache, 1))
+        file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': 'data/cache'}
+        self.assertEqual(['core.W003'], [error.id for error in get_cache_settings_errors(file_cache, None)])
+        self.assertEqual([], get_cache_settings_errors(dict(file_cache, OPTIONS={'MAX_ENTRIES': 100000}), None))
+
+    def test_startup_checks_pass(self):
+        self.assertEqual([], check_database_connection_settings(None, databases=['default']))
+        self.assertEqual([], check_database_connections(None, databases=['default']))
+        call_command('check', '--database', 'default', '--fail-level', 'ERROR', stdout=io.StringIO(),
+                     stderr=io.StringIO())
+
+    def test_pool_statistics_are_rendered(self):
+        self.assertEqual({}, get_database_pool_stats())
+        pool = ConnectionPool('dbname=utpad', open=False, min_size=2, max_size=5)
+        metrics = render_database_pool_metrics({'default': dict(pool.get_stats(), requests_num=3)})
+        self.assertIn('# TYPE utpad_database_pool_max gauge\nutpad_database_pool_max{database="default"} 5\n', metrics)
+        self.assertIn('utpad_database_pool_available{database="default"} 0\n', metrics)
+        self.assertIn('# TYPE utpad_database_pool_requests_num_total counter\n'
+                      'utpad_database_pool_requests_num_total{database="default"} 3\n', metrics)
+
+        superuser = User.objects.create_superuser(username="admin", password="password")
+        client = APIClient()
+        client.force_authenticate(superuser)
+        response = client.get('/api/metrics')
+        self.assertEqual(200, response.status_code)
+
+
+class DatabaseRoutingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter({'replica1': 2, 'replica2': 1}, 'explicit')
+        # The writes of the previous tests pinned this thread to the primary
+        self.pinned_token = primary_pinned.set(False)
+
+    def tearDown(self):
+        primary_pinned.reset(self.pinned_token)
+
+    def run_in_context(self, function, *args):
+        # Keeps the routing state set by the test out of the other tests run by this thread
+        return contextvars.copy_context().run(function, *args)
+
+    def test_weighted_round_robin(self):
+        replicas = WeightedRoundRobin({'replica1': 2, 'replica2': 1, 'disabled': 0})
+        picks = [replicas.next() for _ in range(6)]
+        self.assertEqual(['replica1', 'replica2', 'replica1', 'replica1', 'replica2', 'replica1'], picks)
+
+    def test_reads_and_writes(self):
+        def route():
+            reads = [self.router.db_for_read(Story)]
+            with replica_reads():
+                reads += [self.router.db_for_read(Story) for _ in range(3)]
+                reads.append(self.router.db_for_write(Story))
+                reads.append(self.router.db_for_read(Story))
+            return reads
+
+        self.assertEqual(['default', 'replica1', 'replica2', 'replica1', 'default', 'default'],
+                         self.run_in_context(route))
+        self.assertFalse(self.router.allow_migrate('replica1', 'core'))
+        self.assertTrue(self.router.allow_migrate('default', 'core'))
+
+    def test_read_all_policy_and_instance_hint(self):
+        router = ReplicaRouter({'replica1': 1}, 'all')
+        story = Story(name="story")
+        story._state.db = 'default'
+        self.assertEqual('replica1', self.run_in_context(router.db_for_read, Story))
+        self.assertEqual('default', self.run_in_context(lambda: router.db_for_read(Story, instance=story)))
+        self.assertEqual('default', ReplicaRouter({}, 'all').db_for_read(Story))
+
+    def test_streamed_and_worker_reads_use_replicas(self):
+        def iterate_reads():
+            for _ in range(2):
+                yield self.router.db_for_read(Story)
+
+        self.assertEqual(['replica1', 'replica2'], list(iterate_with_replica_reads(iterate_reads())))
+        self.assertEqual('default', self.router.db_for_read(Story))
+
+        def read_in_worker(model_name):
+            return {'database': 'replica' if replica_reads_requested.get() else 'default'}
+
+        with replica_reads():
+            results = run_model_tasks([['a', 'b']], read_in_worker, workers=2)
+        self.assertEqual({'replica'}, {result['database'] for result in results.values()})
+
+    def test_middleware_pins_reads_after_writes(self):
+        request_factory = RequestFactory()
+        pinned = []
+
+        def get_response(request):
+            pinned.append(primary_pinned.get())
+            if request.method == 'POST':
+                self.router.db_for_write(Story)
+            return HttpResponse()
+
+        middleware = DatabaseRoutingMiddleware(get_response)
+        middleware.replicas_configured = True
+
+        def handle(request):
+            return middleware(request)
+
+        response = self.run_in_context(handle, request_factory.get('/api/stories/'))
+        self.assertNotIn(middleware.pin_cookie_name, response.cookies)
+        response = self.run_in_context(handle, request_factory.post('/api/stories/'))
+        self.assertEqual(middleware.stickiness, response.cookies[middleware.pin_cookie_name]['max-age'])
+        request = request_factory.get('/api/stories/')
+        request.COOKIES[middleware.pin_cookie_name] = '1'
+        self.run_in_context(handle, request)
+        self.assertEqual([False, True, True], pinned)
+
+    def test_sync_sqlite_replicas(self):
+        with tempfile.TemporaryDirectory() as folder:
+            primary_name = str(Path(folder, 'db.sqlite3'))
+            replica_name = str(Path(folder, 'db-replica.sqlite3'))
+            with sqlite3.connect(primary_name) as primary_connection:
+                primary_connection.execute('CREATE TABLE story (name TEXT)')
+                primary_connection.execute("INSERT INTO story VALUES ('story')")
+            primary_connection.close()
+
+            databases, replica_weights = settings.DATABASES, settings.DATABASE_REPLICA_WEIGHTS
+            settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': primary_name},
+                                  'replica1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': replica_name}}
+            settings.DATABASE_REPLICA_WEIGHTS = {'replica1': 1}
+            try:
+                call_command('sync_sqlite_replicas', stdout=io.StringIO())
+            finally:
+                settings.DATABASES, settings.DATABASE_REPLICA_WEIGHTS = databases, replica_weights
+
+            replica_connection = sqlite3.connect(replica_name)
+            self.assertEqual([('story',)], replica_connection.execute('SELECT name FROM story').fetchall())
+            replica_connection.close()
+
+
+class DatabaseRoutingTransactionTestCase(TestCase):
+    def test_reads_in_transactions_use_primary(self):
+        with replica_reads():
+            self.assertEqual('default', ReplicaRouter({'replica1': 1}, 'all').db_for_read(Story))
+
+
+class StaticFilesMiddlewareTestCase(SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.TemporaryDirectory()
+        Path(self.static_root.name, 'assets').mkdir()
+        Path(self.static_root.name, 'logo.png').write_bytes(b'png')
+        Path(self.static_root.name, 'assets', 'index-B3x9Zq1d.js').write_text('console.log("utpad");' * 100)
+        Path(self.static_root.name, 'assets', 'index-B3x9Zq1d.js.gz').write_bytes(b'gzip')
+        self.static_urls = settings.STATIC_URLS
+        settings.STATIC_URLS = ['/static/', '/assets/']
+
+    def tearDown(self):
+        settings.STATIC_URLS = self.static_urls
+        self.static_root.cleanup()
+
+    def test_static_files_served_with_cache_headers_at_every_static_url(self):
+        with self.settings(STATIC_ROOT=self.static_root.name, STATIC_URL='/static/', WHITENOISE_MAX_AGE=3600,
+                           WHITENOISE_IMMUTABLE_FILE_TEST=r'^.+[.-][0-9a-zA-Z_-]{8,12}\..+$'):
+            middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+        request_factory = RequestFactory()
+
+        response = middleware(request_factory.get('/static/logo.png'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('max-age=3600, public', response['Cache-Control'])
+
+        response = middleware(request_factory.get('/assets/assets/index-B3x9Zq1d.js', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertIn('immutable', response['Cache-Control'])
+        response.close()
+
+        self.assertEqual(404, middleware(request_factory.get('/api/org_groups/')).status_code)
+
+
+class ProductionUrlsTestCase(SimpleTestCase):
+    def test_uploaded_files_not_served_with_whitenoise(self):
+        static_files_server = settings.STATIC_FILES_SERVER
+        settings.STATIC_FILES_SERVER = 'whitenoise'
+        try:
+            production_urls = importlib.reload(project_urls)
+            with self.assertRaises(Resolver404):
+                resolve(settings.MEDIA_URL + 'attachments/report.pdf', urlconf=production_urls)
+        finally:
+            settings.STATIC_FILES_SERVER = static_files_server
+            importlib.reload(project_urls)
+
+
+class LoadTestTestCase(LiveServerTestCase):
+    def test_load_test_reports_latencies(self):
+        OrgGroup.objects.create(name="public_org", published=True, is_public=True)
+        result = run_load_test(self.live_server_url, ['/api/org_groups/', '/api/missing/'], concurrency=2,
+                               duration=0.5)
+        self.assertGreater(result['requests'], 2)
+        self.assertGreater(result['errors'], 0)
+        self.assertIn('/api/missing/: HTTP 404', result['first_errors'])
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertLessEqual(result['p99_ms'], result['max_ms'])
+
+
+class BenchmarkSuiteTestCase(TestCase):
+    def test_benchmark_suite_runs_on_small_dataset(self):
+        org_groups, users, engineers = build_benchmark_dataset(depth=2, fan_out=2, users=8, sites=2, stories=20,
+                                                               leaves=20)
+        self.assertEqual(3, len(org_groups))
+        results = run_benchmark_suite(org_groups, users, engineers, repeat=1)
+        for benchmark_name in ['stories_list_member', 'stories_detail_member', 'leaves_list_superuser',
+                               'org_groups_list_member', 'capacity_view_superuser', 'engineer_capacity_view_member',
+                               'yaml_export', 'yaml_import', 'excel_export']:
+            self.assertGreater(results[benchmark_name]['queries'], 0, benchmark_name)
+            self.assertGreaterEqual(results[benchmark_name]['seconds'], results[benchmark_name]['min_seconds'])
+        self.assertEqual(3, results['capacity_compute']['org_groups'])
@@ -2,7 +2,9 @@ from django.urls import include, path
 from rest_framework import routers
 from rest_framework_simplejwt import views as jwt_views
 
-from .apiviews import get_user_profile_details, ExportZIPDataView, ImportZIPDataView, export_all_data_as_excel
+from .apiviews import get_user_profile_details, ExportZIPDataView, ImportZIPDataView, DataImportJobView, \
+    export_all_data_as_excel, export_all_data_as_parquet, get_request_metrics, aexport_all_data_as_zip, \
+    aexport_all_data_as_excel
 from .views import UserViewSet, GroupViewSet, AttachmentViewSet, OrgGroupViewSet, ConfigurationViewSet, SiteViewSet
 
 router = routers.DefaultRouter()
@@ -27,5 +29,10 @@ urlpatterns = [
     path('get_user_profile', get_user_profile_details),
     path('export/zip', ExportZIPDataView.as_view()),
     path('import/zip', ImportZIPDataView.as_view()),
+    path('import/jobs/<int:job_id>', DataImportJobView.as_view()),
     path('export/excel', export_all_data_as_excel),
+    path('export/parquet', export_all_data_as_parquet),
+    path('metrics', get_request_metrics),
+    path('async/export/zip', aexport_all_data_as_zip),
+    path('async/export/excel', aexport_all_data_as_excel),
 ]
@@ -2,11 +2,13 @@ from django.contrib.auth.models import User, Group
 from django.core.exceptions import FieldDoesNotExist
 from rest_framework import viewsets
 from rest_framework.permissions import DjangoObjectPermissions, DjangoModelPermissions, IsAdminUser, BasePermission
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
 
 from .models import Attachment, OrgGroup, Configuration, Site
+from .pagination import KeysetPaginationExtn
 from .serializers import UserSerializer, GroupSerializer, AttachmentSerializer, OrgGroupSerializer, \
-    ConfigurationSerializer, SiteSerializer
+    ConfigurationSerializer, SiteSerializer, ServerModelSerializer
 
 exact_fields_filter_lookups = ['exact', ]
 # many_to_many_id_field_lookups = ['contains']
@@ -29,6 +31,15 @@ class IsSuperUser(IsAdminUser):
         return bool(request.user and request.user.is_superuser)
 
 
+def get_api_user(request):
+    """
+    User of a plain Django request authenticated by the REST framework authentication classes, for the async views
+    that are not REST framework views. Raises AuthenticationFailed for invalid credentials.
+    """
+    return Request(request, authenticators=[authentication_class() for authentication_class in
+                                            api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+
+
 class DjangoObjectPermissionsOrAnonReadOnly(DjangoObjectPermissions):
     """
     Similar to DjangoObjectPermissions, except that anonymous users are
@@ -37,7 +48,77 @@ class DjangoObjectPermissionsOrAnonReadOnly(DjangoObjectPermissions):
     authenticated_users_only = False
 
 
-class ServerOrgGroupViewSet(viewsets.ModelViewSet):
+pagination_query_param = 'pagination'
+fields_query_param = 'fields'
+exclude_query_param = 'exclude'
+expand_query_param = 'expand'
+# Fields read by the object level permission checks, never deferred for sparse fieldsets
+permission_required_fields = ['published', 'is_public', 'org_group', 'user', ]
+
+
+def get_query_param_list(request, query_param):
+    if query_param not in request.query_params:
+        return None
+    return [value.strip() for value in request.query_params.get(query_param).split(',') if value.strip()]
+
+
+class ServerModelViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        return self.optimize_queryset(super().get_queryset())
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor selects keyset pagination, page number pagination stays the default
+        if not hasattr(self, '_paginator') and self.request is not None and \
+                self.request.query_params.get(pagination_query_param) == 'cursor':
+            self._paginator = KeysetPaginationExtn()
+        return super().paginator
+
+    def get_representation_options(self):
+        """
+        Serializer options from the fields, exclude and expand query parameters of read requests.
+        expand=none serializes relations as ids, expand=<relation>,... expands only the given relations.
+        """
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return {}
+
+        representation_options = {}
+        included_fields = get_query_param_list(self.request, fields_query_param)
+        if included_fields is not None:
+            representation_options['fields'] = included_fields
+        excluded_fields = get_query_param_list(self.request, exclude_query_param)
+        if excluded_fields is not None:
+            representation_options['exclude'] = excluded_fields
+
+        expand_fields = get_query_param_list(self.request, expand_query_param)
+        if expand_fields is not None and expand_fields not in (['all'], ['true']):
+            if expand_fields in ([], ['none'], ['false']):
+                representation_options['expand_relation_as_object'] = False
+            else:
+                representation_options['expand_fields'] = expand_fields
+        return representation_options
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), ServerModelSerializer):
+            kwargs.update(self.get_representation_options())
+        return super().get_serializer(*args, **kwargs)
+
+    def optimize_queryset(self, queryset):
+        # Load the relations used by the serializer with the queryset instead of once per serialized row
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, ServerModelSerializer):
+            representation_options = self.get_representation_options()
+            return serializer_class.optimize_queryset(
+                queryset,
+                expand_relation_as_object=representation_options.get('expand_relation_as_object', True),
+                expand_fields=representation_options.get('expand_fields'),
+                included_fields=representation_options.get('fields'),
+                excluded_fields=representation_options.get('exclude'),
+                required_fields=permission_required_fields)
+        return queryset
+
+
+class ServerOrgGroupViewSet(ServerModelViewSet):
     def get_queryset(self):
         user = self.request.user
         if (user is None) or user.is_superuser:
@@ -46,7 +127,7 @@ class ServerOrgGroupViewSet(viewsets.ModelViewSet):
         model = self.queryset.model
 
         if (self.action == 'list') and hasattr(model, 'get_list_query_set'):
-            return model.get_list_query_set(model, self.request.user)
+            return self.optimize_queryset(model.get_list_query_set(model, self.request.user))
         else:
             return super().get_queryset()
 
@@ -146,7 +227,7 @@ class ToolIntegrationDeletePermission(BasePermission):
         return request.user.is_superuser or request.user.has_perm('core.tool_integration_delete')
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ServerModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [IsSuperUser]
@@ -185,7 +266,7 @@ class UserViewSet(viewsets.ModelViewSet):
     }
 
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(ServerModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [IsSuperUser]
@@ -227,7 +308,7 @@ base_model_ordering_fields = [
 
 # filter_backends = (DjangoFilterBackend, OrderingFilter, SearchFilter)
 
-class ConfigurationViewSet(ModelViewSet):
+class ConfigurationViewSet(ServerModelViewSet):
     queryset = Configuration.objects.all()
     serializer_class = ConfigurationSerializer
     permission_classes = [IsSuperUser]
@@ -0,0 +1,53 @@
+# Gunicorn configuration of the production server started by runserver-prod.sh, the values come from the SERVER_*
+# settings of config.yaml.
+#
+# Graceful restart: kill -HUP <master pid> replaces the workers once they finished their requests, a data import
+# running in a worker is failed if it does not finish within SERVER_GRACEFUL_TIMEOUT. The application is
+# preloaded in the master, so a code update needs a new master: kill -USR2 <master pid> starts one next to the old
+# one, then kill -QUIT <old master pid> once the new workers serve.
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'utpad_server.settings')
+
+from utpad_server import settings  # noqa: E402
+
+bind = settings.SERVER_BIND
+workers = settings.SERVER_WORKERS or multiprocessing.cpu_count() * 2 + 1
+
+if settings.SERVER_INTERFACE == 'asgi':
+    wsgi_app = 'utpad_server.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'utpad_server.wsgi:application'
+    # Threads share the memory of their worker and wait on the database concurrently
+    worker_class = 'gthread'
+    threads = settings.SERVER_THREADS
+
+# Load Django once in the master and fork the workers from it, sharing its memory pages copy-on-write
+preload_app = True
+
+timeout = settings.SERVER_TIMEOUT
+graceful_timeout = settings.SERVER_GRACEFUL_TIMEOUT
+keepalive = 5
+
+# Replace the workers after a number of requests (0, never, by default as the data imports run in the workers), at
+# different times so that they do not restart together
+max_requests = settings.SERVER_MAX_REQUESTS
+max_requests_jitter = max(1, settings.SERVER_MAX_REQUESTS // 10) if settings.SERVER_MAX_REQUESTS else 0
+
+accesslog = '-'
+errorlog = '-'
+proc_name = 'utpad-server'
+
+
+# noinspection PyUnusedLocal
+def when_ready(server):
+    from django.db import connections
+    from core.jobs import fail_stale_data_import_jobs
+
+    # Imports left queued or running by the workers of a previous run, once their heartbeats are stale
+    fail_stale_data_import_jobs()
+    # Connections opened while loading the application must not be shared by the forked workers
+    connections.close_all()
+
@@ -0,0 +1,19 @@
+#!/bin/bash
+# Compare the development server with the production server under the same load, on the database of config.yaml.
+# Usage: ./loadtest.sh [load_test options, e.g. --username admin --password secret --duration 20]
+set -e
+
+DEV_PORT=${DEV_PORT:-8001}
+PROD_PORT=${PROD_PORT:-8002}
+
+python3 manage.py collectstatic --noinput > /dev/null
+python3 manage.py runserver 127.0.0.1:$DEV_PORT --insecure --noreload > logs/loadtest-dev.log 2>&1 &
+DEV_PID=$!
+gunicorn --config gunicorn.conf.py --bind 127.0.0.1:$PROD_PORT --access-logfile /dev/null \
+  > logs/loadtest-prod.log 2>&1 &
+PROD_PID=$!
+trap 'kill $DEV_PID $PROD_PID 2> /dev/null' EXIT
+sleep 5
+
+python3 manage.py load_test --url http://127.0.0.1:$DEV_PORT --label runserver "$@"
+python3 manage.py load_test --url http://127.0.0.1:$PROD_PORT --label gunicorn "$@"
@@ -3,4 +3,7 @@ python manage.py makemigrations capacity
 python manage.py makemigrations execution
 
 python manage.py migrate
+python manage.py createcachetable
 
+python manage.py rebuild_org_group_closure
+python manage.py rebuild_availability_calendar
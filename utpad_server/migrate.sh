@@ -5,3 +5,7 @@ python3 manage.py makemigrations capacity
 python3 manage.py makemigrations execution
 
 python3 manage.py migrate
+python3 manage.py createcachetable
+
+python3 manage.py rebuild_org_group_closure
+python3 manage.py rebuild_availability_calendar
@@ -0,0 +1,9 @@
+#!/bin/bash
+# Production server: gunicorn workers configured by gunicorn.conf.py from the SERVER_* settings of config.yaml.
+# Set STATIC_FILES_SERVER: whitenoise and DEBUG: False in config.yaml for the static files to be served compressed
+# with cache headers.
+set -e
+
+python3 manage.py collectstatic --noinput
+python3 manage.py check --deploy --database default
+exec gunicorn --config gunicorn.conf.py
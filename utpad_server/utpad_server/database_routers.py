@@ -1,20 +1,123 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+from django.db import connections
+
+from utpad_server import settings
+
+primary_database = 'default'
+
+# Reads of the current request or thread go to the primary, set after a write for read-your-writes consistency and by
+# the database routing middleware for the requests of a client that wrote recently
+primary_pinned = contextvars.ContextVar('primary_pinned', default=False)
+primary_written = contextvars.ContextVar('primary_written', default=False)
+
+# Reads of the block go to the replicas when DATABASE_REPLICA_READS is explicit
+replica_reads_requested = contextvars.ContextVar('replica_reads_requested', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """
+    Send the reads of the block to the replicas, unless the request or thread is pinned to the primary by a write.
+    Used by the long read-only exports and computations that would otherwise load the primary.
+    """
+    token = replica_reads_requested.set(True)
+    try:
+        yield
+    finally:
+        replica_reads_requested.reset(token)
+
+
+def iterate_with_replica_reads(iterable):
+    # Streamed responses are iterated after the view returned, each step is run within replica_reads
+    iterator = iter(iterable)
+    while True:
+        with replica_reads():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def aiterate_with_replica_reads(async_iterable):
+    # Async counterpart of iterate_with_replica_reads for the responses streamed by the async views
+    async_iterator = aiter(async_iterable)
+    try:
+        while True:
+            with replica_reads():
+                try:
+                    item = await anext(async_iterator)
+                except StopAsyncIteration:
+                    return
+            yield item
+    finally:
+        if hasattr(async_iterator, 'aclose'):
+            await async_iterator.aclose()
+
+
+class WeightedRoundRobin:
+    """
+    Smooth weighted round-robin: every alias is picked in proportion to its weight, spread evenly over the sequence.
+    """
+
+    def __init__(self, weights):
+        self.weights = {alias: weight for alias, weight in weights.items() if weight > 0}
+        self.total_weight = sum(self.weights.values())
+        self.current_weights = {alias: 0 for alias in self.weights}
+        self.lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.weights)
+
+    def next(self):
+        with self.lock:
+            for alias, weight in self.weights.items():
+                self.current_weights[alias] += weight
+            alias = max(self.current_weights, key=self.current_weights.get)
+            self.current_weights[alias] -= self.total_weight
+            return alias
+
+
 # noinspection PyMethodMayBeStatic,PyProtectedMember
 class ReplicaRouter:
+    """
+    Send all writes to the primary (default) database and reads to the replicas of DATABASE_REPLICAS, picked by
+    weighted round-robin. Reads go to the primary within transactions, after a write of the request or thread and
+    when DATABASE_REPLICA_READS is explicit outside the replica_reads blocks.
+    """
+
+    def __init__(self, replica_weights=None, replica_reads_policy=None):
+        self.replicas = WeightedRoundRobin(
+            settings.DATABASE_REPLICA_WEIGHTS if replica_weights is None else replica_weights)
+        self.replica_reads_policy = settings.DATABASE_REPLICA_READS if replica_reads_policy is None \
+            else replica_reads_policy
+
     def db_for_read(self, model, **hints):
-        return 'default'
-
-    # def db_for_write(self, model, **hints):
-    #     return 'default'
-    #
-    # def allow_relation(self, obj1, obj2, **hints):
-    #     """
-    #     Relations between objects are allowed if both objects are
-    #     in the same pool.
-    #     """
-    #     # db_list = ('default', 'replica')
-    #     if obj1._state.db == obj2._state.db:
-    #         return True
-    #     return None
-    #
-    # def allow_migrate(self, db, app_label, model_name=None, **hints):
-    #     return True
+        if not self.replicas or primary_pinned.get() or connections[primary_database].in_atomic_block:
+            return primary_database
+        # Related objects are read from the database their instance was read from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db is not None:
+            return instance._state.db
+        if self.replica_reads_policy == 'all' or replica_reads_requested.get():
+            return self.replicas.next()
+        return primary_database
+
+    def db_for_write(self, model, **hints):
+        primary_pinned.set(True)
+        primary_written.set(True)
+        return primary_database
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {primary_database} | set(self.replicas.weights)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary
+        return db == primary_database
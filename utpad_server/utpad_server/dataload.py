@@ -1,97 +1,982 @@
+import asyncio
+import contextvars
+import io
+import json
 import logging
 import os
+import tempfile
+import time
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
 from pathlib import Path
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
 import yaml
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import Group, User
-from django.db import IntegrityError
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from core.models import model_name_map as core_model_name_map
+from capacity.models import model_name_map as capacity_model_name_map
+from capacity.serializers import serializer_map as capacity_serializer_map
+from core.models import Configuration, DeletedRecord, model_name_map as core_model_name_map
 from core.serializers import serializer_map as api_serializer_map
+from core.signals import data_loaded
+from execution.models import model_name_map as execution_model_name_map
+from execution.serializers import serializer_map as execution_serializer_map
+from utpad_server import settings
 
 model_name_map = {
     'auth': {'Group': Group, 'User': User},
     'core': core_model_name_map,
+    'capacity': capacity_model_name_map,
+    'execution': execution_model_name_map,
 }
 
 serializer_map = {}
 serializer_map.update(api_serializer_map)
+serializer_map.update(capacity_serializer_map)
+serializer_map.update(execution_serializer_map)
+
+# App and model name of the data file of every model
+model_file_names = {model_class: (app_name, model_name) for app_name, app_model_name_map in model_name_map.items()
+                    for model_name, model_class in app_model_name_map.items()}
 
 logger = logging.getLogger(__name__)
 
+# Rows fetched (with their prefetched relations) at a time while exporting
+export_chunk_size = 2000
+
+
+# Configuration holding the time up to which the data was exported by the last export run with since=watermark
+export_watermark_name = 'export_watermark'
+# File of the incremental exports listing the records deleted since the export start time
+deleted_records_file_name = 'deleted.yaml'
+
+
+def parse_export_since(value: str):
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError(f"Invalid export start time {value}")
+    return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+
+def get_export_watermark():
+    value = Configuration.objects.filter(name=export_watermark_name).values_list('value', flat=True).first()
+    return parse_export_since(value) if value else None
+
+
+def set_export_watermark(until):
+    Configuration.objects.update_or_create(name=export_watermark_name, defaults={
+        'value': until.isoformat(), 'description': 'Time up to which the data was exported by the last incremental '
+                                                   'export'})
+    prune_deleted_records()
+
+
+def prune_deleted_records():
+    """
+    Delete the tombstones no longer needed by the incremental exports: those older than both the watermark and
+    DELETED_RECORD_RETENTION_DAYS, the latter covering the exports since a given time. Returns the number deleted.
+    """
+    prune_before = timezone.now() - timedelta(days=settings.DELETED_RECORD_RETENTION_DAYS)
+    watermark = get_export_watermark()
+    if watermark is not None:
+        prune_before = min(prune_before, watermark)
+    return DeletedRecord.objects.filter(deleted_at__lt=prune_before).delete()[0]
+
+
+def get_export_until():
+    """
+    Time up to which an export starting now exports the changes, taken before querying. It is EXPORT_WATERMARK_OVERLAP
+    seconds earlier than now as updated_at is set when a record is saved, not when its transaction commits: the
+    records saved by the transactions still running are exported again by the next export from the watermark.
+    """
+    return timezone.now() - timedelta(seconds=settings.EXPORT_WATERMARK_OVERLAP)
+
+
+def resolve_export_since(value: str = None):
+    """
+    Start time of an export given as an ISO 8601 time, or watermark for the time the last export by watermark was
+    run (None, all the data, if there is none). None exports all the data.
+    """
+    if not value:
+        return None
+    if value == 'watermark':
+        return get_export_watermark()
+    return parse_export_since(value)
+
+
+def get_export_queryset(model_class, since=None):
+    # Models without updated_at (users and groups) are always exported in full
+    model_records = model_class.objects.all()
+    if since is not None and any(model_field.name == 'updated_at' for model_field in model_class._meta.fields):
+        model_records = model_records.filter(updated_at__gte=since)
+    return model_records
+
+
+def iterate_serialized_records(model_class, chunk_size: int = export_chunk_size, expand_relation_as_object=True,
+                               since=None):
+    """
+    Serialized records of the model, fetched chunk_size rows at a time so that the whole table is never in memory.
+    Only the records changed since the time passed are returned.
+    """
+    serializer_cls = serializer_map[model_class]
+    serializer = serializer_cls(expand_relation_as_object=expand_relation_as_object)
+    model_records = serializer_cls.optimize_queryset(get_export_queryset(model_class, since),
+                                                     expand_relation_as_object=expand_relation_as_object)
+    for model_record in model_records.iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(model_record)
+
+
+def get_model_levels(model_classes=None):
+    """
+    Group the models in levels so that every model only references (by foreign key, one to one or many to many)
+    models of earlier levels. Models of a level do not depend on each other and can be loaded concurrently.
+    """
+    model_classes = list(model_file_names.keys() if model_classes is None else model_classes)
+    dependencies = {}
+    for model_class in model_classes:
+        # noinspection PyProtectedMember
+        model_fields = [*model_class._meta.concrete_fields, *model_class._meta.many_to_many]
+        dependencies[model_class] = {model_field.related_model for model_field in model_fields
+                                     if model_field.is_relation and model_field.related_model in model_classes
+                                     and model_field.related_model is not model_class}
+
+    model_levels = []
+    ordered_model_classes = set()
+    while len(ordered_model_classes) < len(model_classes):
+        model_level = [model_class for model_class in model_classes if model_class not in ordered_model_classes
+                       and dependencies[model_class] <= ordered_model_classes]
+        if not model_level:
+            # Circular references rely on the foreign key constraints being checked at commit
+            model_level = [model_class for model_class in model_classes if model_class not in ordered_model_classes]
+            logger.warning(f"Circular references among {[model_class.__name__ for model_class in model_level]}")
+        model_levels.append(model_level)
+        ordered_model_classes.update(model_level)
+    return model_levels
+
+
+def get_default_workers():
+    # SQLite allows one writer at a time
+    return 1 if connection.vendor == 'sqlite' else min(4, os.cpu_count() or 1)
+
+
+def run_with_own_connection(task, *args):
+    try:
+        return task(*args)
+    finally:
+        # Close the connection opened by the worker thread
+        connections.close_all()
+
+
+def run_model_tasks(model_levels, model_task, workers=None):
+    """
+    Run model_task for every model level by level, the models of a level in a pool of workers threads each with its
+    own database connection. Returns the results of model_task by model with the time taken in seconds added.
+    """
+    if workers is None:
+        workers = get_default_workers()
+
+    def timed_model_task(model_class):
+        start_time = time.perf_counter()
+        result = model_task(model_class)
+        result['seconds'] = round(time.perf_counter() - start_time, 3)
+        return result
+
+    results = {}
+    for model_level in model_levels:
+        if workers <= 1 or len(model_level) == 1:
+            for model_class in model_level:
+                results[model_class] = timed_model_task(model_class)
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(model_level))) as executor:
+                # The workers run in a copy of the caller context to follow its database routing
+                futures = {model_class: executor.submit(contextvars.copy_context().run, run_with_own_connection,
+                                                        timed_model_task, model_class)
+                           for model_class in model_level}
+                for model_class in model_level:
+                    results[model_class] = futures[model_class].result()
+    return results
+
+
+def get_deleted_records_queryset(since):
+    # Values rather than values_list rows, which aiterator() would fetch on the event loop
+    model_labels = [model_class._meta.label for model_class in model_file_names]
+    return DeletedRecord.objects.filter(deleted_at__gte=since, model_label__in=model_labels).order_by('id').values(
+        'model_label', 'record_id')
+
+
+def iterate_deleted_records(since, chunk_size: int = export_chunk_size):
+    """
+    Model label and id of the records of the exported models deleted since the time passed.
+    """
+    for deleted_record in get_deleted_records_queryset(since).iterator(chunk_size=chunk_size):
+        yield {'model': deleted_record['model_label'], 'id': deleted_record['record_id']}
+
+
+def save_model_data_to_folder(data_folder: str, model_class, chunk_size: int = export_chunk_size, since=None):
+    app_to_save, model_to_save = model_file_names[model_class]
+    logger.info(f"Going to write {app_to_save} {model_to_save}")
+    os.makedirs(Path(data_folder, app_to_save), exist_ok=True)
+    file_path = Path(data_folder, app_to_save, model_to_save + ".yaml")
+    counts = {'records': 0}
+
+    def count_records(model_records_data):
+        for model_record_data in model_records_data:
+            counts['records'] += 1
+            yield model_record_data
+
+    if get_export_queryset(model_class, since).exists():
+        with open(str(file_path), 'w', ) as yaml_file:
+            # Every document is written to the file as soon as its record is serialized
+            yaml.dump_all(count_records(iterate_serialized_records(model_class, chunk_size, since=since)), yaml_file,
+                          sort_keys=False)
+    return counts
 
-def save_data_to_folder(data_folder: str):
+
+def save_data_to_folder(data_folder: str, chunk_size: int = export_chunk_size, workers: int = None, since=None):
+    """
+    Write the records of every model to a YAML file per model, models in dependency order with the independent
+    models written concurrently. Returns the records written and seconds taken by model label.
+
+    With since, the export is incremental: only the records changed since then are written, along with the
+    records deleted since then in deleted.yaml (counted as core.DeletedRecord).
+    """
     os.makedirs(data_folder, exist_ok=True)
-    for app_to_save in model_name_map.keys():
-        logger.info(f"Going to write {app_to_save}")
-        for model_to_save in model_name_map[app_to_save].keys():
-            logger.info(f"Going to write f{model_to_save}")
-            model_class = model_name_map[app_to_save][model_to_save]
-            model_records = model_class.objects.all()
-            os.makedirs(Path(data_folder, app_to_save), exist_ok=True)
-            # for model_record in model_records:
-            file_path = Path(data_folder, app_to_save, model_to_save + ".yaml")
-            serializer_cls = serializer_map[model_class]
-            if len(model_records) > 0:
-                with open(str(file_path), 'w', ) as yaml_file:
-                    yaml.dump_all(serializer_cls(model_records, many=True).data, yaml_file, sort_keys=False)
+    results = run_model_tasks(get_model_levels(),
+                              lambda model_class: save_model_data_to_folder(data_folder, model_class, chunk_size,
+                                                                            since),
+                              workers)
+    results = {model_class._meta.label: result for model_class, result in results.items()}
+    if since is not None:
+        start_time = time.perf_counter()
+        deleted_count = 0
+        with open(str(Path(data_folder, deleted_records_file_name)), 'w', ) as yaml_file:
+            for deleted_count, _ in enumerate(dump_yaml_documents(iterate_deleted_records(since, chunk_size),
+                                                                  yaml_file), start=1):
+                pass
+        results[DeletedRecord._meta.label] = {'records': deleted_count,
+                                              'seconds': round(time.perf_counter() - start_time, 3)}
+    return results
+
+
+def dump_yaml_documents(model_records_data, yaml_file):
+    """
+    Write the documents to yaml_file as yaml.dump_all does, yielding after every document so that the caller can
+    forward the output produced so far.
+    """
+    dumper = yaml.Dumper(yaml_file, default_flow_style=False, sort_keys=False)
+    try:
+        dumper.open()
+        for model_record_data in model_records_data:
+            dumper.represent(model_record_data)
+            yield
+        dumper.close()
+    finally:
+        dumper.dispose()
+
+
+class ZipStreamBuffer(io.RawIOBase):
+    """
+    Unseekable file receiving the ZIP output, emptied by the reader as the archive is produced.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def read_chunks(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+zip_compression_methods = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+# Levels supported by the compression methods, other methods have no levels
+zip_compression_levels = {
+    'deflate': range(0, 10),
+    'bzip2': range(1, 10),
+}
+# Zstandard compression is available in the zipfile module from Python 3.14
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):
+    zip_compression_methods['zstd'] = zipfile.ZIP_ZSTANDARD
+    zip_compression_levels['zstd'] = range(-7, 23)
+
+
+def iterate_zip_data(compression=zipfile.ZIP_DEFLATED, compresslevel: int = None,
+                     chunk_size: int = export_chunk_size, since=None):
+    """
+    ZIP archive of the YAML files of save_data_to_folder produced piece by piece while the records are serialized,
+    so that neither a file nor the whole archive is kept.
+    """
+    zip_buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(zip_buffer, 'w', compression=compression, compresslevel=compresslevel) as zip_file:
+        for model_class in [model_class for model_level in get_model_levels() for model_class in model_level]:
+            if not get_export_queryset(model_class, since).exists():
+                continue
+            app_to_save, model_to_save = model_file_names[model_class]
+            logger.info(f"Going to write {app_to_save} {model_to_save}")
+            member = zip_file.open(app_to_save + "/" + model_to_save + ".yaml", 'w', force_zip64=True)
+            with io.TextIOWrapper(member, encoding='utf-8') as yaml_file:
+                for _ in dump_yaml_documents(iterate_serialized_records(model_class, chunk_size, since=since),
+                                             yaml_file):
+                    if zip_buffer.chunks:
+                        yield zip_buffer.read_chunks()
+        if since is not None:
+            member = zip_file.open(deleted_records_file_name, 'w', force_zip64=True)
+            with io.TextIOWrapper(member, encoding='utf-8') as yaml_file:
+                for _ in dump_yaml_documents(iterate_deleted_records(since, chunk_size), yaml_file):
+                    if zip_buffer.chunks:
+                        yield zip_buffer.read_chunks()
+    # Rest of the compressed data and the central directory
+    yield zip_buffer.read_chunks()
+
+
+# Bytes of a temporary file copied to a ZIP archive or a response at a time
+file_copy_size = 1024 * 1024
+
+
+def write_model_yaml_file(model_class, chunk_size: int = export_chunk_size, since=None):
+    """
+    Anonymous temporary file with the YAML documents of the records of the model changed since the time passed,
+    positioned at its start.
+    """
+    yaml_file = tempfile.TemporaryFile(prefix='utpad-export-', suffix='.yaml')
+    try:
+        text_file = io.TextIOWrapper(yaml_file, encoding='utf-8')
+        yaml.dump_all(iterate_serialized_records(model_class, chunk_size, since=since), text_file, sort_keys=False)
+        text_file.detach()
+        yaml_file.seek(0)
+        return yaml_file
+    except Exception:
+        yaml_file.close()
+        raise
+
+
+def copy_file_chunk(source_file, target_file, size=file_copy_size):
+    data = source_file.read(size)
+    target_file.write(data)
+    return len(data)
+
+
+async def aiterate_file_chunks(file, chunk_size=file_copy_size):
+    """
+    Chunks of a binary file read in worker threads for the responses streamed by the async views, the file is closed
+    once read or when the response is closed.
+    """
+    try:
+        while data := await sync_to_async(file.read, thread_sensitive=False)(chunk_size):
+            yield data
+    finally:
+        file.close()
+
+
+async def aiterate_zip_data(compression=zipfile.ZIP_DEFLATED, compresslevel: int = None,
+                            chunk_size: int = export_chunk_size, since=None, concurrency: int = None):
+    """
+    iterate_zip_data for the async views. The models are serialized in worker threads, each to a temporary file
+    copied to the archive in model order, the compression running in worker threads too. At most concurrency
+    (ASYNC_TASK_CONCURRENCY by default) models are serialized ahead of the one copied, so that the files written do
+    not get further ahead of a slow client.
+    """
+    concurrency = concurrency or settings.ASYNC_TASK_CONCURRENCY
+
+    async def write_model_file(model_class):
+        if not await get_export_queryset(model_class, since).aexists():
+            return None
+        return await sync_to_async(run_with_own_connection, thread_sensitive=False)(
+            write_model_yaml_file, model_class, chunk_size, since)
+
+    model_classes = iter([model_class for model_level in get_model_levels() for model_class in model_level])
+    model_file_tasks = deque()
+
+    def start_model_file_tasks():
+        while len(model_file_tasks) < concurrency:
+            model_class = next(model_classes, None)
+            if model_class is None:
+                return
+            model_file_tasks.append((model_class, asyncio.ensure_future(write_model_file(model_class))))
+
+    zip_buffer = ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(zip_buffer, 'w', compression=compression, compresslevel=compresslevel) as zip_file:
+            start_model_file_tasks()
+            while model_file_tasks:
+                model_class, model_file_task = model_file_tasks.popleft()
+                yaml_file = await model_file_task
+                # The next model is serialized while this one is copied
+                start_model_file_tasks()
+                if yaml_file is None:
+                    continue
+                app_to_save, model_to_save = model_file_names[model_class]
+                logger.info(f"Going to write {app_to_save} {model_to_save}")
+                with yaml_file, zip_file.open(app_to_save + "/" + model_to_save + ".yaml", 'w',
+                                              force_zip64=True) as member:
+                    while await sync_to_async(copy_file_chunk, thread_sensitive=False)(yaml_file, member):
+                        if zip_buffer.chunks:
+                            yield zip_buffer.read_chunks()
+            if since is not None:
+                # Only model labels and ids, dumped on the event loop as they are read
+                member = zip_file.open(deleted_records_file_name, 'w', force_zip64=True)
+                with io.TextIOWrapper(member, encoding='utf-8') as yaml_file:
+                    dumper = yaml.Dumper(yaml_file, default_flow_style=False, sort_keys=False)
+                    try:
+                        dumper.open()
+                        async for deleted_record in get_deleted_records_queryset(since).aiterator(
+                                chunk_size=chunk_size):
+                            dumper.represent({'model': deleted_record['model_label'],
+                                              'id': deleted_record['record_id']})
+                            if zip_buffer.chunks:
+                                yield zip_buffer.read_chunks()
+                        dumper.close()
+                    finally:
+                        dumper.dispose()
+        # Rest of the compressed data and the central directory
+        yield zip_buffer.read_chunks()
+    finally:
+        # Closed early by a disconnected client: the model files not copied yet are dropped
+        for _, model_file_task in model_file_tasks:
+            if not model_file_task.done():
+                model_file_task.cancel()
+            elif not model_file_task.cancelled() and model_file_task.exception() is None \
+                    and model_file_task.result() is not None:
+                model_file_task.result().close()
 
 
 def load_data_from_folder(data_folder: str):
     if os.path.exists(data_folder):
-        for app_to_save in model_name_map.keys():
-            logger.info(f"Going to load {app_to_save}")
-            if os.path.exists(Path(data_folder, app_to_save)):
-                for model_to_save in model_name_map[app_to_save].keys():
-                    logger.info(f"Going to load {model_to_save}")
-                    model_class = model_name_map[app_to_save][model_to_save]
-                    file_path = Path(data_folder, app_to_save, model_to_save + ".yaml")
-                    if os.path.exists(file_path):
-                        with open(str(file_path), 'r', ) as yaml_file:
-                            model_records_data = yaml.safe_load_all(yaml_file)
-                            for model_record_data in model_records_data:
-                                m2m_fkeys = {}
-                                foreign_keys = {}
-                                for key in model_record_data.keys():
-                                    field_cls = model_class.__dict__[key].__class__
-                                    if 'ToMany' in field_cls.__name__:  # 'related_descriptors' in field_cls.__module__:
-                                        m2m_fkeys[key] = model_record_data[key]
-                                    if model_record_data[key] and (
-                                            'ForwardOneToOne' in field_cls.__name__ or 'ForwardManyToOne' in field_cls.__name__):
-                                        model_record_data[key] = model_class.__dict__[
-                                            key].field.related_model.objects.get(id=model_record_data[key]['id'])
-
-                                # for foreign_key in foreign_keys.keys():
-                                #     del model_record_data[foreign_key]
-
-                                for to_many_key in m2m_fkeys.keys():
-                                    del model_record_data[to_many_key]
-
-                                try:
-                                    model_record = model_class.objects.create(**model_record_data)
-                                    # TODO: Verify keys working well.
-                                    logger.info(f"Created {str(model_record)}")
-                                except IntegrityError as e:
-                                    model_record = model_class.objects.get(id=model_record_data['id'])
-                                    model_serializer_cls = serializer_map[model_class]
-                                    logger.info(
-                                        f"Ignoring existing data {model_record_data['id']} {str(e)}")
-
-                                for to_many_key, value in m2m_fkeys.items():
-                                    model_record.__getattribute__(to_many_key).set([int(item['id']) for item in value])
-
-
-def save_data_to_excel(file_path: str):
-    with pd.ExcelWriter(file_path) as writer:
-        for app_to_save in model_name_map.keys():
-            logger.info(f"Going to write {app_to_save}")
-            for model_to_save in model_name_map[app_to_save].keys():
-                logger.info(f"Going to write {model_to_save}")
-                model_class = model_name_map[app_to_save][model_to_save]
-                model_records = model_class.objects.all()
-                serializer_cls = serializer_map[model_class]
-                if len(model_records) > 0:
-                    df = pd.DataFrame(serializer_cls(model_records, many=True).data)
-                    df.to_excel(writer, sheet_name=app_to_save + "_" + model_to_save, index=False)
+        for model_class in [model_class for model_level in get_model_levels() for model_class in model_level]:
+            app_to_save, model_to_save = model_file_names[model_class]
+            logger.info(f"Going to load {app_to_save} {model_to_save}")
+            file_path = Path(data_folder, app_to_save, model_to_save + ".yaml")
+            if os.path.exists(file_path):
+                with open(str(file_path), 'r', ) as yaml_file:
+                    model_records_data = yaml.safe_load_all(yaml_file)
+                    for model_record_data in model_records_data:
+                        m2m_fkeys = {}
+                        foreign_keys = {}
+                        for key in model_record_data.keys():
+                            field_cls = model_class.__dict__[key].__class__
+                            if 'ToMany' in field_cls.__name__:  # 'related_descriptors' in field_cls.__module__:
+                                m2m_fkeys[key] = model_record_data[key]
+                            if model_record_data[key] and ('ForwardOneToOne' in field_cls.__name__
+                                                           or 'ForwardManyToOne' in field_cls.__name__):
+                                model_record_data[key] = model_class.__dict__[
+                                    key].field.related_model.objects.get(id=model_record_data[key]['id'])
+
+                        # for foreign_key in foreign_keys.keys():
+                        #     del model_record_data[foreign_key]
+
+                        for to_many_key in m2m_fkeys.keys():
+                            del model_record_data[to_many_key]
+
+                        try:
+                            model_record = model_class.objects.create(**model_record_data)
+                            # TODO: Verify keys working well.
+                            logger.info(f"Created {str(model_record)}")
+                        except IntegrityError as e:
+                            model_record = model_class.objects.get(id=model_record_data['id'])
+                            model_serializer_cls = serializer_map[model_class]
+                            logger.info(
+                                f"Ignoring existing data {model_record_data['id']} {str(e)}")
+
+                        for to_many_key, value in m2m_fkeys.items():
+                            model_record.__getattribute__(to_many_key).set([int(item['id']) for item in value])
+
+
+# Rows inserted at a time by the bulk import
+import_batch_size = 1000
+
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Largest number of record errors kept by an import
+max_import_errors = 1000
+
+
+def report_record_error(errors, model_class, record_id, message):
+    logger.info(f"Skipping {model_class.__name__} {record_id} {message}")
+    if errors is not None and len(errors) < max_import_errors:
+        errors.append({'model': model_class._meta.label, 'id': record_id, 'error': message})
+
+
+def get_related_id(value):
+    # Relations are exported as objects with an id or as the id alone
+    return value['id'] if isinstance(value, dict) else value
+
+
+def get_record_values(model_class, model_record_data):
+    """
+    Column values of the record by attribute name, foreign keys as <field>_id, and the related ids of every many to
+    many field. Keys that are not model fields are ignored.
+    """
+    values = {}
+    m2m_values = {}
+    for key, value in model_record_data.items():
+        try:
+            model_field = model_class._meta.get_field(key)
+        except FieldDoesNotExist:
+            continue
+        if model_field.many_to_many:
+            m2m_values[model_field] = [get_related_id(item) for item in value or []]
+        elif model_field.concrete:
+            values[model_field.attname] = get_related_id(value) if model_field.is_relation and value else value
+    return values, m2m_values
+
+
+def get_existing_ids(model_class, ids):
+    return set(model_class.objects.filter(pk__in=set(ids)).values_list('pk', flat=True))
+
+
+def drop_missing_references(model_class, model_records, m2m_values_by_id, errors=None):
+    """
+    Clear the relations of the records to rows that do not exist, dropping the records whose required foreign keys
+    are missing. References to the model itself are kept as the referenced records may be in a later batch.
+    """
+    for model_field in model_class._meta.concrete_fields:
+        if not model_field.is_relation or model_field.related_model == model_class:
+            continue
+        related_ids = [getattr(model_record, model_field.attname) for model_record in model_records]
+        existing_ids = get_existing_ids(model_field.related_model, [related_id for related_id in related_ids
+                                                                     if related_id is not None])
+        kept_records = []
+        for model_record, related_id in zip(model_records, related_ids):
+            if related_id is None or related_id in existing_ids:
+                kept_records.append(model_record)
+            elif model_field.null:
+                logger.info(f"Clearing missing {model_field.name} {related_id} of {model_class.__name__}"
+                            f" {model_record.pk}")
+                setattr(model_record, model_field.attname, None)
+                kept_records.append(model_record)
+            else:
+                report_record_error(errors, model_class, model_record.pk,
+                                    f"Missing {model_field.name} {related_id}")
+        model_records = kept_records
+
+    for model_field in model_class._meta.many_to_many:
+        existing_ids = get_existing_ids(model_field.related_model,
+                                        [related_id for m2m_values in m2m_values_by_id.values()
+                                         for related_id in m2m_values.get(model_field, [])])
+        for m2m_values in m2m_values_by_id.values():
+            if model_field in m2m_values:
+                m2m_values[model_field] = [related_id for related_id in m2m_values[model_field]
+                                           if related_id in existing_ids]
+    return model_records
+
+
+def create_m2m_links(model_class, m2m_values_by_id, replace=False, batch_size=import_batch_size):
+    """
+    Insert the through rows of the many to many relations of the records with ids in bulk, replacing the existing
+    links of the records if replace is set.
+    """
+    for model_field in model_class._meta.many_to_many:
+        through_model = model_field.remote_field.through
+        source_field_name = model_field.m2m_field_name() + '_id'
+        target_field_name = model_field.m2m_reverse_field_name() + '_id'
+        record_ids = [record_id for record_id, m2m_values in m2m_values_by_id.items() if model_field in m2m_values]
+        if not record_ids:
+            continue
+        if replace:
+            through_model.objects.filter(**{source_field_name + '__in': record_ids}).delete()
+        through_model.objects.bulk_create(
+            [through_model(**{source_field_name: record_id, target_field_name: target_id})
+             for record_id in record_ids for target_id in m2m_values_by_id[record_id][model_field]],
+            ignore_conflicts=True, batch_size=batch_size)
+
+
+def save_model_records(model_class, model_records, update_existing):
+    # Existing records keep their creation time
+    # noinspection PyProtectedMember
+    update_fields = [model_field.name for model_field in model_class._meta.concrete_fields
+                     if not model_field.primary_key and not getattr(model_field, 'auto_now_add', False)]
+    if update_existing:
+        model_class.objects.bulk_create(model_records, update_conflicts=True,
+                                        unique_fields=[model_class._meta.pk.name], update_fields=update_fields)
+    else:
+        model_class.objects.bulk_create(model_records, ignore_conflicts=True)
+
+
+def bulk_load_model_records(model_class, model_records_data, update_existing=False,
+                            batch_size: int = import_batch_size, progress=None, errors=None):
+    """
+    Load the records of a model in one transaction, batch_size records per bulk insert. Existing records (same id)
+    are skipped or updated along with their many to many links as per update_existing. A batch failing on a
+    constraint is retried record by record, skipping the failing records which are added to errors if passed.
+    progress is called with the model and the counts after every batch. Returns the counts of records created,
+    updated and skipped.
+    """
+    counts = {'created': 0, 'updated': 0, 'skipped': 0}
+    model_records_data = iter(model_records_data)
+    with transaction.atomic():
+        while batch := list(islice(model_records_data, batch_size)):
+            model_records = []
+            m2m_values_by_id = {}
+            for model_record_data in batch:
+                values, m2m_values = get_record_values(model_class, model_record_data)
+                model_record = model_class(**values)
+                model_records.append(model_record)
+                if model_record.pk is not None:
+                    m2m_values_by_id[model_record.pk] = m2m_values
+
+            existing_ids = get_existing_ids(model_class, [model_record.pk for model_record in model_records])
+            if not update_existing:
+                counts['skipped'] += sum(model_record.pk in existing_ids for model_record in model_records)
+                model_records = [model_record for model_record in model_records if model_record.pk not in existing_ids]
+            valid_records = drop_missing_references(model_class, model_records, m2m_values_by_id, errors)
+            counts['skipped'] += len(model_records) - len(valid_records)
+            model_records = valid_records
+
+            try:
+                with transaction.atomic():
+                    save_model_records(model_class, model_records, update_existing)
+                saved_records = model_records
+            except IntegrityError as e:
+                logger.info(f"Loading {model_class.__name__} records one at a time as the batch failed: {str(e)}")
+                saved_records = []
+                for model_record in model_records:
+                    try:
+                        with transaction.atomic():
+                            save_model_records(model_class, [model_record], update_existing)
+                        saved_records.append(model_record)
+                    except IntegrityError as record_error:
+                        report_record_error(errors, model_class, model_record.pk, str(record_error))
+
+            # Records conflicting on other unique fields are silently ignored by the insert
+            saved_ids = get_existing_ids(model_class, [model_record.pk for model_record in saved_records]) \
+                if not update_existing else {model_record.pk for model_record in saved_records}
+            counts['created'] += len(saved_ids - existing_ids)
+            counts['updated'] += len(saved_ids & existing_ids)
+            counts['skipped'] += len(model_records) - len(saved_ids)
+            for model_record in saved_records:
+                if model_record.pk not in saved_ids:
+                    report_record_error(errors, model_class, model_record.pk, "Conflicts with an existing record")
+
+            create_m2m_links(model_class, {record_id: m2m_values for record_id, m2m_values in m2m_values_by_id.items()
+                                           if record_id in saved_ids}, update_existing, batch_size)
+            if progress:
+                progress(model_class, counts)
+    if progress:
+        # Called once more after the commit
+        progress(model_class, counts)
+    return counts
+
+
+def reset_sequences(model_classes):
+    # Ids are inserted explicitly, move the sequences past them for the records created later
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), model_classes):
+            cursor.execute(sql)
+
+
+def bulk_load_model_data(model_class, open_model_file, update_existing=False, batch_size: int = import_batch_size,
+                         progress=None, errors=None):
+    app_to_load, model_to_load = model_file_names[model_class]
+    logger.info(f"Going to load {app_to_load} {model_to_load}")
+    with open_model_file(app_to_load + "/" + model_to_load + ".yaml") as yaml_file:
+        return bulk_load_model_records(model_class, yaml.load_all(yaml_file, Loader=YAMLLoader), update_existing,
+                                       batch_size, progress, errors)
+
+
+def delete_records(open_model_file, batch_size: int = import_batch_size):
+    """
+    Delete the records listed in deleted.yaml, in one transaction with the models referencing others deleted first.
+    Returns the number of records deleted by model, not counting the records deleted along with them.
+    """
+    model_classes_by_label = {model_class._meta.label: model_class for model_class in model_file_names}
+    ids_by_model = defaultdict(set)
+    with open_model_file(deleted_records_file_name) as yaml_file:
+        for deleted_record in yaml.load_all(yaml_file, Loader=YAMLLoader):
+            if deleted_record and deleted_record.get('model') in model_classes_by_label:
+                ids_by_model[model_classes_by_label[deleted_record['model']]].add(deleted_record['id'])
+
+    deleted_counts = {}
+    with transaction.atomic():
+        for model_level in reversed(get_model_levels(list(ids_by_model.keys()))):
+            for model_class in model_level:
+                logger.info(f"Going to delete {model_class.__name__} records")
+                record_ids = sorted(ids_by_model[model_class])
+                deleted_counts[model_class] = 0
+                for index in range(0, len(record_ids), batch_size):
+                    deleted_counts[model_class] += model_class.objects.filter(
+                        pk__in=record_ids[index:index + batch_size]).delete()[1].get(model_class._meta.label, 0)
+    return deleted_counts
+
+
+def bulk_load_data(model_file_exists, open_model_file, update_existing=False, batch_size: int = import_batch_size,
+                   progress=None, workers: int = None, errors=None):
+    """
+    Load the YAML data files, named <app>/<model>.yaml, opened as text by open_model_file with bulk inserts, one
+    transaction per model. Models are loaded in dependency order with the models not depending on each other loaded
+    concurrently. Returns the counts of records created, updated and skipped and the seconds taken by model label.
+
+    Data of an incremental export (with a deleted.yaml) is applied as a delta: the deleted records are removed first
+    and the changed records are then loaded updating the existing ones. The counts then include the records deleted.
+    """
+    is_delta = model_file_exists(deleted_records_file_name)
+    deleted_counts = {}
+    if is_delta:
+        update_existing = True
+        deleted_counts = delete_records(open_model_file, batch_size)
+
+    model_classes = [model_class for model_class, (app_to_load, model_to_load) in model_file_names.items()
+                     if model_file_exists(app_to_load + "/" + model_to_load + ".yaml")]
+    results = run_model_tasks(get_model_levels(model_classes),
+                              lambda model_class: bulk_load_model_data(model_class, open_model_file, update_existing,
+                                                                       batch_size, progress, errors),
+                              workers)
+    for model_class, deleted_count in deleted_counts.items():
+        results.setdefault(model_class, {'created': 0, 'updated': 0, 'skipped': 0, 'seconds': 0})
+    if is_delta:
+        for model_class, result in results.items():
+            result['deleted'] = deleted_counts.get(model_class, 0)
+
+    loaded_models = model_classes + [model_class for model_class in deleted_counts if model_class not in model_classes]
+    if model_classes:
+        reset_sequences(model_classes)
+    if loaded_models:
+        data_loaded.send(sender=None, models=loaded_models)
+    return {model_class._meta.label: result for model_class, result in results.items()}
+
+
+def bulk_load_data_from_folder(data_folder: str, update_existing=False, batch_size: int = import_batch_size,
+                               progress=None, workers: int = None, errors=None):
+    """
+    Load the YAML files of save_data_to_folder with bulk_load_data.
+    """
+    if not os.path.exists(data_folder):
+        return {}
+    return bulk_load_data(lambda file_name: os.path.exists(Path(data_folder, file_name)),
+                          lambda file_name: open(str(Path(data_folder, file_name)), 'r', ),
+                          update_existing, batch_size, progress, workers, errors)
+
+
+def bulk_load_data_from_zip(zip_file_path: str, update_existing=False, batch_size: int = import_batch_size,
+                            progress=None, workers: int = None, errors=None):
+    """
+    Load the YAML files of a ZIP file of the export with bulk_load_data, reading the members without extracting them.
+    """
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_file:
+        file_names = set(zip_file.namelist())
+        return bulk_load_data(lambda file_name: file_name in file_names,
+                              lambda file_name: io.TextIOWrapper(zip_file.open(file_name), encoding='utf-8'),
+                              update_existing, batch_size, progress, workers, errors)
+
+
+def write_excel_cell(worksheet, row, column, value):
+    # Strings are always written as text so that values starting with = or looking like URLs are kept as they are
+    if value is None:
+        return
+    if isinstance(value, bool):
+        worksheet.write_boolean(row, column, value)
+    elif isinstance(value, (int, float)):
+        worksheet.write_number(row, column, value)
+    else:
+        worksheet.write_string(row, column, value if isinstance(value, str) else str(value))
+
+
+def write_excel_sheet(worksheet, model_records_data, header_format=None):
+    """
+    Write the serialized records row by row below a header of their field names. Returns the number of records.
+    """
+    record_count = 0
+    for record_count, model_record_data in enumerate(model_records_data, start=1):
+        if record_count == 1:
+            worksheet.write_row(0, 0, list(model_record_data.keys()), header_format)
+        for column, value in enumerate(model_record_data.values()):
+            write_excel_cell(worksheet, record_count, column, value)
+    return record_count
+
+
+def write_data_to_excel(file, chunk_size: int = export_chunk_size):
+    """
+    Write every model with records to its own sheet of an Excel workbook at file (a path or a binary file object).
+    Relations are written as ids. The workbook is written in constant memory mode: every row is flushed to a
+    temporary file once the next row is started so that neither the records nor the sheets are held in memory.
+    """
+    workbook = xlsxwriter.Workbook(file, {'constant_memory': True})
+    try:
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        for model_class, (app_name, model_name) in model_file_names.items():
+            if not model_class.objects.exists():
+                continue
+            logger.info(f"Going to write {app_name}_{model_name}")
+            worksheet = workbook.add_worksheet((app_name + "_" + model_name)[:31])
+            write_excel_sheet(worksheet, iterate_serialized_records(model_class, chunk_size,
+                                                                    expand_relation_as_object=False), header_format)
+    finally:
+        workbook.close()
+
+
+def save_data_to_excel(file_path: str, chunk_size: int = export_chunk_size):
+    write_data_to_excel(file_path, chunk_size)
     logger.info(f"Wrote data to {file_path}")
+
+
+# Parquet column types of the model fields by internal type, fields of other types are written as strings
+parquet_column_types = {
+    'AutoField': pa.int64(),
+    'BigAutoField': pa.int64(),
+    'SmallAutoField': pa.int64(),
+    'IntegerField': pa.int64(),
+    'BigIntegerField': pa.int64(),
+    'SmallIntegerField': pa.int64(),
+    'PositiveIntegerField': pa.int64(),
+    'PositiveBigIntegerField': pa.int64(),
+    'PositiveSmallIntegerField': pa.int64(),
+    'BooleanField': pa.bool_(),
+    'FloatField': pa.float64(),
+    'DateField': pa.date32(),
+    'DateTimeField': pa.timestamp('us', tz='UTC'),
+    'TimeField': pa.time64('us'),
+    'DurationField': pa.duration('us'),
+}
+
+# Files are exported in snappy, zstd, gzip... compressed pages as supported by pyarrow
+parquet_compression = 'zstd'
+
+
+def get_parquet_column_type(model_field):
+    if model_field.many_to_many:
+        return pa.list_(get_parquet_column_type(model_field.target_field))
+    if model_field.is_relation:
+        return get_parquet_column_type(model_field.target_field)
+    if model_field.get_internal_type() == 'DecimalField':
+        return pa.decimal128(model_field.max_digits, model_field.decimal_places)
+    return parquet_column_types.get(model_field.get_internal_type(), pa.string())
+
+
+def get_parquet_column_value_converter(model_field):
+    # Values not converted by pyarrow to the column type
+    if model_field.get_internal_type() == 'JSONField':
+        return lambda value: json.dumps(value) if value is not None else None
+    if get_parquet_column_type(model_field) == pa.string():
+        return lambda value: str(value) if value is not None else None
+    return None
+
+
+def get_parquet_schema(model_class):
+    """
+    Schema of the Parquet file of a model, a column per concrete and many to many field named as in the YAML files.
+    Relations are the related ids, many to many relations lists of the related ids.
+    """
+    model_fields = list(model_class._meta.concrete_fields) + list(model_class._meta.many_to_many)
+    return pa.schema([pa.field(model_field.name, get_parquet_column_type(model_field)) for model_field in model_fields])
+
+
+def get_m2m_ids(model_field, record_ids):
+    # Related ids of every record for a many to many field
+    through = model_field.remote_field.through
+    source_attname = through._meta.get_field(model_field.m2m_field_name()).attname
+    target_attname = through._meta.get_field(model_field.m2m_reverse_field_name()).attname
+    m2m_ids = defaultdict(list)
+    for record_id, related_id in through.objects.filter(**{source_attname + '__in': record_ids}).order_by(
+            'pk').values_list(source_attname, target_attname):
+        m2m_ids[record_id].append(related_id)
+    return m2m_ids
+
+
+def iterate_parquet_record_batches(model_class, chunk_size: int = export_chunk_size):
+    """
+    Record batches of the records of the model in the Parquet schema, chunk_size records at a time with their many to
+    many relations fetched per batch.
+    """
+    schema = get_parquet_schema(model_class)
+    concrete_fields = list(model_class._meta.concrete_fields)
+    converters = [get_parquet_column_value_converter(model_field) for model_field in concrete_fields]
+    pk_index = concrete_fields.index(model_class._meta.pk)
+    rows = model_class.objects.order_by('pk').values_list(
+        *[model_field.attname for model_field in concrete_fields]).iterator(chunk_size=chunk_size)
+
+    while chunk := list(islice(rows, chunk_size)):
+        columns = [[converter(value) for value in column] if converter else list(column)
+                   for converter, column in zip(converters, zip(*chunk))]
+        record_ids = columns[pk_index]
+        for model_field in model_class._meta.many_to_many:
+            m2m_ids = get_m2m_ids(model_field, record_ids)
+            columns.append([m2m_ids.get(record_id, []) for record_id in record_ids])
+        yield pa.RecordBatch.from_arrays([pa.array(column, type=schema_field.type)
+                                          for column, schema_field in zip(columns, schema)], schema=schema)
+
+
+def write_model_parquet(model_class, file, chunk_size: int = export_chunk_size, compression=parquet_compression):
+    """
+    Write the records of the model to the Parquet file at file (a path or a binary file object), a row group per
+    chunk_size records. Returns the number of records written.
+    """
+    record_count = 0
+    with pq.ParquetWriter(file, get_parquet_schema(model_class), compression=compression) as writer:
+        for record_batch in iterate_parquet_record_batches(model_class, chunk_size):
+            writer.write_batch(record_batch)
+            record_count += record_batch.num_rows
+    return record_count
+
+
+def save_model_data_to_parquet_folder(data_folder: str, model_class, chunk_size: int = export_chunk_size):
+    app_to_save, model_to_save = model_file_names[model_class]
+    counts = {'records': 0}
+    if model_class.objects.exists():
+        logger.info(f"Going to write {app_to_save} {model_to_save}")
+        os.makedirs(Path(data_folder, app_to_save), exist_ok=True)
+        counts['records'] = write_model_parquet(model_class, str(Path(data_folder, app_to_save,
+                                                                      model_to_save + ".parquet")), chunk_size)
+    return counts
+
+
+def save_data_to_parquet_folder(data_folder: str, chunk_size: int = export_chunk_size, workers: int = None):
+    """
+    Write the records of every model with records to a Parquet file per model, <app>/<model>.parquet, with the
+    independent models written concurrently. Returns the records written and seconds taken by model label.
+    """
+    os.makedirs(data_folder, exist_ok=True)
+    results = run_model_tasks(get_model_levels(),
+                              lambda model_class: save_model_data_to_parquet_folder(data_folder, model_class,
+                                                                                    chunk_size),
+                              workers)
+    return {model_class._meta.label: result for model_class, result in results.items()}
+
+
+# Bytes of a Parquet file copied to the ZIP archive at a time
+parquet_zip_copy_size = 1024 * 1024
+
+
+def iterate_parquet_zip_data(chunk_size: int = export_chunk_size):
+    """
+    ZIP archive of the Parquet files of save_data_to_parquet_folder produced piece by piece. Every file is written
+    to a temporary file first as the Parquet footer is only known at the end, and stored without compression as its
+    pages are compressed already.
+    """
+    zip_buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_STORED) as zip_file:
+        for model_class, (app_to_save, model_to_save) in model_file_names.items():
+            if not model_class.objects.exists():
+                continue
+            logger.info(f"Going to write {app_to_save} {model_to_save}")
+            with tempfile.TemporaryFile(prefix='utpad-export-', suffix='.parquet') as parquet_file:
+                write_model_parquet(model_class, parquet_file, chunk_size)
+                parquet_file.seek(0)
+                with zip_file.open(app_to_save + "/" + model_to_save + ".parquet", 'w', force_zip64=True) as member:
+                    while data := parquet_file.read(parquet_zip_copy_size):
+                        member.write(data)
+                        if zip_buffer.chunks:
+                            yield zip_buffer.read_chunks()
+    # Rest of the archive and the central directory
+    yield zip_buffer.read_chunks()
@@ -0,0 +1,236 @@
+import bisect
+import contextvars
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, values above the last bound are only in the +Inf bucket
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+query_count_buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Name, help and buckets of the histograms kept for every view and method
+request_histograms = {
+    'utpad_request_duration_seconds': ('Wall time of the requests', duration_buckets),
+    'utpad_request_queries': ('SQL statements executed by the requests', query_count_buckets),
+    'utpad_request_sql_duration_seconds': ('Time spent executing SQL statements by the requests', duration_buckets),
+    'utpad_request_serializer_duration_seconds': ('Time spent serializing records by the requests', duration_buckets),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        cumulative_counts = []
+        total = 0
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+            cumulative_counts.append(total)
+        return cumulative_counts
+
+
+# Histograms of this process by (view name, method), reset on restart
+request_metrics = {}
+request_metrics_lock = threading.Lock()
+
+
+class RequestMeasurement:
+    """
+    Queries and serializer time of the request being handled, with the slowest statements kept for the slow log.
+    Updated by every thread working for the request.
+    """
+
+    def __init__(self, logged_query_count=5):
+        self.logged_query_count = logged_query_count
+        self.query_count = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.slowest_queries = []
+        self.lock = threading.Lock()
+
+    def add_query(self, sql, duration):
+        with self.lock:
+            self.query_count += 1
+            self.sql_seconds += duration
+            if self.logged_query_count > 0:
+                if len(self.slowest_queries) < self.logged_query_count:
+                    heapq.heappush(self.slowest_queries, (duration, self.query_count, sql))
+                elif duration > self.slowest_queries[0][0]:
+                    heapq.heapreplace(self.slowest_queries, (duration, self.query_count, sql))
+
+    def add_serializer_time(self, duration):
+        with self.lock:
+            self.serializer_seconds += duration
+
+    def get_slowest_queries(self):
+        return [(duration, sql) for duration, _, sql in sorted(self.slowest_queries, reverse=True)]
+
+
+# Measurement of the request handled in the current context, copied to the threads working for the request
+current_request_measurement = contextvars.ContextVar('current_request_measurement', default=None)
+serializer_depth = contextvars.ContextVar('serializer_depth', default=0)
+
+
+def measure_query(execute, sql, params, many, context):
+    # Execute wrapper of every database connection, only timed within measure_request
+    measurement = current_request_measurement.get()
+    if measurement is None:
+        return execute(sql, params, many, context)
+    start_time = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        measurement.add_query(sql, time.perf_counter() - start_time)
+
+
+def install_query_measurement(connection):
+    if measure_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(measure_query)
+
+
+# noinspection PyUnusedLocal
+@receiver(connection_created, dispatch_uid="install_query_measurement_on_connection_created")
+def install_query_measurement_on_connection_created(sender, connection, **kwargs):
+    # Connections of the worker threads and of the async views run through sync_to_async
+    install_query_measurement(connection)
+
+
+@contextmanager
+def measure_request(logged_query_count=5):
+    """
+    Count the SQL statements run on every database connection and the serializer time within the block, including
+    the ones of the threads started from it with a copy of its context.
+    """
+    for connection in connections.all(initialized_only=False):
+        install_query_measurement(connection)
+    measurement = RequestMeasurement(logged_query_count)
+    token = current_request_measurement.set(measurement)
+    try:
+        yield measurement
+    finally:
+        current_request_measurement.reset(token)
+
+
+@contextmanager
+def measure_serialization():
+    # Only the outermost of nested serializers is timed
+    measurement = current_request_measurement.get()
+    if measurement is None:
+        yield
+        return
+    depth = serializer_depth.get()
+    token = serializer_depth.set(depth + 1)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        serializer_depth.reset(token)
+        if depth == 0:
+            measurement.add_serializer_time(time.perf_counter() - start_time)
+
+
+def record_request_metrics(view_name, method, wall_seconds, measurement):
+    with request_metrics_lock:
+        histograms = request_metrics.get((view_name, method))
+        if histograms is None:
+            histograms = request_metrics[(view_name, method)] = {
+                metric_name: Histogram(buckets) for metric_name, (_, buckets) in request_histograms.items()}
+        histograms['utpad_request_duration_seconds'].observe(wall_seconds)
+        histograms['utpad_request_queries'].observe(measurement.query_count)
+        histograms['utpad_request_sql_duration_seconds'].observe(measurement.sql_seconds)
+        histograms['utpad_request_serializer_duration_seconds'].observe(measurement.serializer_seconds)
+
+
+def reset_request_metrics():
+    with request_metrics_lock:
+        request_metrics.clear()
+
+
+def log_slow_request(request, view_name, wall_seconds, measurement):
+    slowest_queries = ''.join(f"\n  {duration:.4f}s {sql}" for duration, sql in measurement.get_slowest_queries())
+    logger.warning(f"Slow request {request.method} {request.path} ({view_name}) took {wall_seconds:.3f}s with "
+                   f"{measurement.query_count} queries in {measurement.sql_seconds:.3f}s and serializers in "
+                   f"{measurement.serializer_seconds:.3f}s, slowest queries:{slowest_queries}")
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_bound(bound):
+    return repr(float(bound))
+
+
+def render_request_metrics():
+    """
+    The request histograms in the Prometheus text exposition format.
+    """
+    with request_metrics_lock:
+        snapshot = {key: {metric_name: (histogram.get_cumulative_counts(), histogram.sum, histogram.count)
+                          for metric_name, histogram in histograms.items()}
+                    for key, histograms in request_metrics.items()}
+
+    lines = []
+    for metric_name, (help_text, buckets) in request_histograms.items():
+        lines.append(f"# HELP {metric_name} {help_text}")
+        lines.append(f"# TYPE {metric_name} histogram")
+        for (view_name, method), histograms in sorted(snapshot.items()):
+            cumulative_counts, total, count = histograms[metric_name]
+            labels = f'view="{escape_label_value(view_name)}",method="{escape_label_value(method)}"'
+            for bound, cumulative_count in zip([format_bound(bound) for bound in buckets] + ['+Inf'],
+                                               cumulative_counts):
+                lines.append(f'{metric_name}_bucket{{{labels},le="{bound}"}} {cumulative_count}')
+            lines.append(f"{metric_name}_sum{{{labels}}} {total}")
+            lines.append(f"{metric_name}_count{{{labels}}} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+# Statistics of psycopg_pool.ConnectionPool.get_stats() that are current values, the others are counters
+database_pool_gauge_stats = {'pool_min', 'pool_max', 'pool_size', 'pool_available', 'requests_waiting'}
+
+
+def get_database_pool_stats():
+    """
+    Statistics of the connection pools of this process by database alias, for the databases configured with a pool.
+    """
+    pool_stats = {}
+    for alias in connections:
+        if connections.settings[alias].get('OPTIONS', {}).get('pool'):
+            pool = getattr(connections[alias], 'pool', None)
+            if pool is not None:
+                pool_stats[alias] = pool.get_stats()
+    return pool_stats
+
+
+def render_database_pool_metrics(pool_stats):
+    """
+    The database pool statistics in the Prometheus text exposition format.
+    """
+    lines = []
+    for stat_name in sorted({stat_name for stats in pool_stats.values() for stat_name in stats}):
+        if stat_name in database_pool_gauge_stats:
+            metric_name, metric_type = 'utpad_database_' + stat_name, 'gauge'
+        else:
+            metric_name, metric_type = 'utpad_database_pool_' + stat_name + '_total', 'counter'
+        lines.append(f"# TYPE {metric_name} {metric_type}")
+        for alias, stats in sorted(pool_stats.items()):
+            if stat_name in stats:
+                lines.append(f'{metric_name}{{database="{escape_label_value(alias)}"}} {stats[stat_name]}')
+    return ''.join(line + '\n' for line in lines)
@@ -176,6 +176,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'core.middlewares.RequestMetricsMiddleware',
+    'core.middlewares.DatabaseRoutingMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -224,8 +226,103 @@ DATABASES = {
     },
 }
 
+# Seconds a worker keeps its database connection open for the next requests, 0 closes it after every request and null
+# keeps it open forever. Not used with the connection pool, which keeps the connections itself.
+DATABASE_CONN_MAX_AGE = config['DATABASE_CONN_MAX_AGE'] if 'DATABASE_CONN_MAX_AGE' in config else 60
+
+# Check that a kept or pooled connection is still usable before a request uses it
+DATABASE_CONN_HEALTH_CHECKS = config['DATABASE_CONN_HEALTH_CHECKS'] if 'DATABASE_CONN_HEALTH_CHECKS' in config \
+    else True
+
+# psycopg 3 connection pool of every worker process for PostgreSQL, the options of psycopg_pool.ConnectionPool like
+# min_size, max_size, timeout, max_lifetime and max_idle. Null disables the pool.
+DATABASE_POOL = config['DATABASE_POOL'] if 'DATABASE_POOL' in config else None
+
+# Read replicas of the default database by alias, each configured like DATABASE with an optional WEIGHT (default 1)
+# giving its share of the reads
+DATABASE_REPLICAS = config['DATABASE_REPLICAS'] if 'DATABASE_REPLICAS' in config else {}
+DATABASE_REPLICA_WEIGHTS = {}
+for replica_alias, replica_database in DATABASE_REPLICAS.items():
+    replica_database = dict(replica_database)
+    DATABASE_REPLICA_WEIGHTS[replica_alias] = replica_database.pop('WEIGHT', 1)
+    # Tests read the replicas from the test database of the primary
+    replica_database.setdefault('TEST', {'MIRROR': 'default'})
+    DATABASES[replica_alias] = replica_database
+
+# Reads sent to the replicas: all of them, or explicit for only the exports and capacity computations
+DATABASE_REPLICA_READS = config['DATABASE_REPLICA_READS'] if 'DATABASE_REPLICA_READS' in config else 'explicit'
+
+# Seconds for which the reads of a client go to the primary after one of its requests wrote to it, longer than the
+# replication lag so that the client reads its own writes
+DATABASE_REPLICA_STICKINESS = config['DATABASE_REPLICA_STICKINESS'] if 'DATABASE_REPLICA_STICKINESS' in config \
+    else 10
+
+# Values set in the database configurations themselves take precedence
+for database in DATABASES.values():
+    if DATABASE_POOL and database['ENGINE'] == 'django.db.backends.postgresql':
+        database.setdefault('OPTIONS', {}).setdefault('pool', DATABASE_POOL)
+    database.setdefault('CONN_MAX_AGE', 0 if database.get('OPTIONS', {}).get('pool') else DATABASE_CONN_MAX_AGE)
+    database.setdefault('CONN_HEALTH_CHECKS', DATABASE_CONN_HEALTH_CHECKS)
+
+DATABASE_ROUTERS = ['utpad_server.database_routers.ReplicaRouter']
+
+# Cache used for org privileges and other derived data. The default local memory cache is per process, configure a
+# file based or database cache in config.yaml to share cached data and its invalidation across worker processes. The
+# deployment checks (runserver-prod.sh) fail with a local memory cache unless SERVER_WORKERS is 1.
+CACHES = {
+    "default": config['CACHE'] if 'CACHE' in config else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'utpad-server',
+        # The cached org privileges (per user) and capacity (per org group, time range and version) outnumber the
+        # default 300 entries
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Seconds for which the org group privileges of a user are cached, entries are also invalidated on org changes
+ORG_PRIVILEGES_CACHE_TIMEOUT = config['ORG_PRIVILEGES_CACHE_TIMEOUT'] if 'ORG_PRIVILEGES_CACHE_TIMEOUT' in config \
+    else 3600
+
+# Seconds for which computed org group capacity is cached, entries are also invalidated on leave, holiday and
+# participation changes
+CAPACITY_CACHE_TIMEOUT = config['CAPACITY_CACHE_TIMEOUT'] if 'CAPACITY_CACHE_TIMEOUT' in config else 86400
+
+# Count leave and holiday days live from the leaves and site holidays or from the availability calendars (calendar),
+# which are only maintained on changes with the calendar source
+CAPACITY_AVAILABILITY_SOURCE = config['CAPACITY_AVAILABILITY_SOURCE'] if 'CAPACITY_AVAILABILITY_SOURCE' in config \
+    else 'live'
+
+# Seconds between checks of the configuration version in the shared cache by the in-process Configuration cache,
+# changes saved by other worker processes are seen after at most this delay (needs a cache shared by the workers)
+CONFIGURATION_CHECK_INTERVAL = config['CONFIGURATION_CHECK_INTERVAL'] if 'CONFIGURATION_CHECK_INTERVAL' in config \
+    else 1.0
+
+# Filter of the org group privileges of list queries: ids (default) for the cached org ids of the user passed as IN
+# lists, exists for EXISTS subqueries on the org tree closure and role tables. Compare the plans of both with the
+# explain_org_permission_filter command before opting in to exists.
+ORG_PERMISSION_FILTER = config['ORG_PERMISSION_FILTER'] if 'ORG_PERMISSION_FILTER' in config else 'ids'
+
+# Seconds between the heartbeats of the queued and running data import jobs, and without a heartbeat after which a
+# job is failed as its process stopped (worker restarted or killed)
+DATA_IMPORT_HEARTBEAT_INTERVAL = config['DATA_IMPORT_HEARTBEAT_INTERVAL'] \
+    if 'DATA_IMPORT_HEARTBEAT_INTERVAL' in config else 10
+DATA_IMPORT_STALE_TIMEOUT = config['DATA_IMPORT_STALE_TIMEOUT'] if 'DATA_IMPORT_STALE_TIMEOUT' in config else 120
+
+# Seconds before the start of an incremental export at which its watermark is set, the changes of the transactions
+# running when it started are exported again by the next export instead of being skipped
+EXPORT_WATERMARK_OVERLAP = config['EXPORT_WATERMARK_OVERLAP'] if 'EXPORT_WATERMARK_OVERLAP' in config else 300
+# Days the tombstones of the deleted records are kept at least, pruned by the exports by watermark once older than the
+# watermark too. Exports since an earlier time may miss deletions.
+DELETED_RECORD_RETENTION_DAYS = config['DELETED_RECORD_RETENTION_DAYS'] \
+    if 'DELETED_RECORD_RETENTION_DAYS' in config else 90
+
+# Requests taking longer than this many seconds are logged along with their slowest SQL statements, null disables
+SLOW_REQUEST_THRESHOLD = config['SLOW_REQUEST_THRESHOLD'] if 'SLOW_REQUEST_THRESHOLD' in config else 1.0
+
+# Number of the slowest SQL statements of a request kept for the slow request log
+SLOW_REQUEST_LOGGED_QUERIES = config['SLOW_REQUEST_LOGGED_QUERIES'] if 'SLOW_REQUEST_LOGGED_QUERIES' in config else 5
+
 # print("Database object is :", str(DATABASES))
-# DATABASE_ROUTERS = ['utpad_server.database_routers.ReplicaRouter']
 
 # AUTH_GROUP_MODEL = 'auth_custom.Group'
 # AUTH_USER_MODEL = 'auth_custom.User'
@@ -279,6 +376,40 @@ MEDIA_BASE_NAME = 'data'
 MEDIA_ROOT = str(Path(DATA_MOUNT_DIR, MEDIA_BASE_NAME))
 # os.makedirs(MEDIA_ROOT, exist_ok=True)
 
+# Server of the static files: django for the development server (runserver --insecure), whitenoise for the production
+# server which serves STATIC_ROOT, filled by collectstatic with gzip and brotli copies, at every static URL
+STATIC_FILES_SERVER = config['STATIC_FILES_SERVER'] if 'STATIC_FILES_SERVER' in config else 'django'
+STATIC_ROOT = config['STATIC_ROOT'] if 'STATIC_ROOT' in config else str(Path(BASE_DIR, 'collected_static'))
+
+# Seconds the browsers cache static files without a content hash in their name, hashed ones like the frontend build
+# assets are cached for ten years
+STATIC_FILES_MAX_AGE = config['STATIC_FILES_MAX_AGE'] if 'STATIC_FILES_MAX_AGE' in config else 3600
+
+if STATIC_FILES_SERVER == 'whitenoise':
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                      'core.middlewares.StaticFilesMiddleware')
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedStaticFilesStorage'},
+    }
+    WHITENOISE_MAX_AGE = STATIC_FILES_MAX_AGE
+    # Names with a content hash like the frontend build assets (index-B3x9Zq1d.js) never change
+    WHITENOISE_IMMUTABLE_FILE_TEST = r'^.+[.-][0-9a-zA-Z_-]{8,12}\..+$'
+
+# Production server (gunicorn.conf.py): address, worker processes (null for 2 per CPU plus 1), threads per worker,
+# wsgi or asgi interface, seconds before a stuck worker is killed and given to finish requests on restart, and
+# requests after which a worker is replaced to bound memory growth. Replacing a worker stops the data import running
+# in it (core.jobs) after the graceful timeout, so workers are not replaced by default (0).
+SERVER_BIND = config['SERVER_BIND'] if 'SERVER_BIND' in config else '0.0.0.0:8000'
+SERVER_WORKERS = config['SERVER_WORKERS'] if 'SERVER_WORKERS' in config else None
+SERVER_THREADS = config['SERVER_THREADS'] if 'SERVER_THREADS' in config else 4
+SERVER_INTERFACE = config['SERVER_INTERFACE'] if 'SERVER_INTERFACE' in config else 'wsgi'
+SERVER_TIMEOUT = config['SERVER_TIMEOUT'] if 'SERVER_TIMEOUT' in config else 300
+SERVER_GRACEFUL_TIMEOUT = config['SERVER_GRACEFUL_TIMEOUT'] if 'SERVER_GRACEFUL_TIMEOUT' in config else 30
+SERVER_MAX_REQUESTS = config['SERVER_MAX_REQUESTS'] if 'SERVER_MAX_REQUESTS' in config else 0
+# Worker threads an async view (/api/async/...) runs its independent org group or model work in at the same time
+ASYNC_TASK_CONCURRENCY = config['ASYNC_TASK_CONCURRENCY'] if 'ASYNC_TASK_CONCURRENCY' in config else 4
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -67,7 +67,10 @@ urlpatterns = [
         TemplateView.as_view(template_name='index.html')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Static files are served by the StaticFilesMiddleware with whitenoise. The uploaded files are not served by the
+# production server, as with static() when DEBUG is off, since they are readable per org.
+if settings.STATIC_FILES_SERVER != 'whitenoise':
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
-for STATIC_URL in settings.STATIC_URLS:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS)
+    for STATIC_URL in settings.STATIC_URLS:
+        urlpatterns += static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS)